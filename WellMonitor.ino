@@ -23,6 +23,16 @@ const char* password = "Sheridan1068!";
 #define READING_INTERVAL 30000  // 30 seconds between readings
 #define APP_SEND_INTERVAL 300000  // 5 minutes between app updates
 
+// Reading buffer: every reading is kept until the app has accepted it
+#define BUFFER_SIZE 240            // 2 hours of readings at 30 second intervals
+#define MAX_READINGS_PER_POST 40   // Readings sent per /tank-data request
+
+// Upload format: packed binary records (see backend/wire.py) or JSON
+#define DEVICE_ID "nano_esp32_tank_01"
+#define USE_BINARY_PAYLOAD true
+#define BINARY_HEADER_SIZE 10
+#define BINARY_RECORD_SIZE 26
+
 // Initialize sensor and web server
 WebServer server(80);
 
@@ -34,6 +44,18 @@ float batteryVoltage = 0;
 unsigned long lastReading = 0;
 unsigned long lastAppUpdate = 0;
 
+struct BufferedReading {
+  unsigned long timestamp;
+  float distance;
+  float level;
+  float gallons;
+  float battery;
+};
+
+BufferedReading readingBuffer[BUFFER_SIZE];
+int bufferStart = 0;
+int bufferCount = 0;
+
 // Custom ultrasonic function for Nano ESP32
 long getUltrasonicDistance() {
   // Send trigger pulse
@@ -135,6 +157,9 @@ void takeSensorReading() {
     // Calculate water level and gallons
     calculateWaterLevel();
     
+    // Keep the reading until it has been sent to the app
+    bufferReading();
+    
     // Log readings
     Serial.println("=== Sensor Reading ===");
     Serial.print("Distance to water: ");
@@ -167,6 +192,21 @@ void calculateWaterLevel() {
   gallons = fillPercentage * TANK_CAPACITY_GALLONS;
 }
 
+// Add the current reading to the buffer, dropping the oldest when full
+void bufferReading() {
+  if (bufferCount == BUFFER_SIZE) {
+    bufferStart = (bufferStart + 1) % BUFFER_SIZE;
+    bufferCount--;
+  }
+  BufferedReading& entry = readingBuffer[(bufferStart + bufferCount) % BUFFER_SIZE];
+  entry.timestamp = millis();
+  entry.distance = currentDistance;
+  entry.level = waterLevel;
+  entry.gallons = gallons;
+  entry.battery = batteryVoltage;
+  bufferCount++;
+}
+
 // Battery voltage monitoring function
 void readBatteryVoltage() {
   int adcValue = analogRead(BATTERY_PIN);
@@ -253,49 +293,121 @@ void setupWebServer() {
 }
 
 void sendDataToApp() {
-  if (WiFi.status() == WL_CONNECTED) {
-    HTTPClient http;
-    
-    // Construct full URL - backend server
-    String url = "http://192.168.86.21:8090/tank-data";
-    http.begin(url);
+  if (WiFi.status() != WL_CONNECTED) {
+    Serial.println("WiFi not connected - keeping " + String(bufferCount) + " buffered readings");
+    return;
+  }
+  
+  // Send buffered readings oldest first; stop at the first failure and retry next interval
+  while (bufferCount > 0) {
+    int count = min(bufferCount, MAX_READINGS_PER_POST);
+    if (!sendBatch(count)) {
+      break;
+    }
+    bufferStart = (bufferStart + count) % BUFFER_SIZE;
+    bufferCount -= count;
+  }
+}
+
+// POST the oldest `count` buffered readings as one batch; true once they can be discarded
+bool sendBatch(int count) {
+  HTTPClient http;
+  
+  // Construct full URL - backend server
+  String url = "http://192.168.86.21:8090/tank-data";
+  http.begin(url);
+  
+  int httpResponseCode;
+  if (USE_BINARY_PAYLOAD) {
+    static uint8_t payload[BINARY_HEADER_SIZE + sizeof(DEVICE_ID) + MAX_READINGS_PER_POST * BINARY_RECORD_SIZE];
+    size_t length = packBinaryBatch(payload, count);
+    http.addHeader("Content-Type", "application/vnd.wellsensor.readings");
+    httpResponseCode = http.POST(payload, length);
+  } else {
     http.addHeader("Content-Type", "application/json");
     
-    // Create JSON payload
-    DynamicJsonDocument doc(1024);
-    doc["device_id"] = "nano_esp32_tank_01";
-    doc["distance_cm"] = currentDistance;
-    doc["water_level_cm"] = waterLevel;
-    doc["gallons"] = gallons;
-    doc["fill_percentage"] = (gallons / TANK_CAPACITY_GALLONS) * 100;
-    doc["battery_voltage"] = batteryVoltage;
-    doc["timestamp"] = millis();
+    // Shared fields are sent once; sent_at lets the server date each reading
+    DynamicJsonDocument doc(512 + count * 192);
+    doc["device_id"] = DEVICE_ID;
     doc["wifi_rssi"] = WiFi.RSSI();
     doc["tank_capacity"] = TANK_CAPACITY_GALLONS;
+    doc["sent_at"] = millis();
+    
+    JsonArray readings = doc.createNestedArray("readings");
+    for (int i = 0; i < count; i++) {
+      BufferedReading& entry = readingBuffer[(bufferStart + i) % BUFFER_SIZE];
+      JsonObject reading = readings.createNestedObject();
+      reading["timestamp"] = entry.timestamp;
+      reading["distance_cm"] = entry.distance;
+      reading["water_level_cm"] = entry.level;
+      reading["gallons"] = entry.gallons;
+      reading["fill_percentage"] = (entry.gallons / TANK_CAPACITY_GALLONS) * 100;
+      reading["battery_voltage"] = entry.battery;
+    }
     
     String jsonString;
     serializeJson(doc, jsonString);
     
     // Send POST request
-    int httpResponseCode = http.POST(jsonString);
-    
-    if (httpResponseCode > 0) {
-      String response = http.getString();
-      Serial.print("App update sent successfully. Response: ");
-      Serial.println(httpResponseCode);
-      Serial.print("Response body: ");
-      Serial.println(response);
-    } else {
-      Serial.print("Error sending to app: ");
-      Serial.println(httpResponseCode);
-      Serial.print("Error: ");
-      Serial.println(http.errorToString(httpResponseCode));
-    }
-    
-    http.end();
+    httpResponseCode = http.POST(jsonString);
+  }
+  
+  bool sent = httpResponseCode >= 200 && httpResponseCode < 300;
+  
+  if (sent) {
+    Serial.print("Sent ");
+    Serial.print(count);
+    Serial.print(" readings to app. Response: ");
+    Serial.println(httpResponseCode);
+  } else if (httpResponseCode > 0) {
+    Serial.print("App rejected batch: ");
+    Serial.println(httpResponseCode);
+    Serial.print("Response body: ");
+    Serial.println(http.getString());
+    // A malformed batch will never be accepted; drop it rather than block the buffer
+    sent = httpResponseCode >= 400 && httpResponseCode < 500 && httpResponseCode != 429;
   } else {
-    Serial.println("WiFi not connected - cannot send to app");
+    Serial.print("Error sending to app: ");
+    Serial.println(httpResponseCode);
+    Serial.print("Error: ");
+    Serial.println(http.errorToString(httpResponseCode));
+  }
+  
+  http.end();
+  return sent;
+}
+
+// Pack the oldest `count` buffered readings in the little-endian layout of backend/wire.py
+size_t packBinaryBatch(uint8_t* out, int count) {
+  uint8_t idLength = strlen(DEVICE_ID);
+  uint16_t recordCount = count;
+  uint32_t sentAt = millis();
+  int16_t rssi = WiFi.RSSI();
+  size_t pos = 0;
+  
+  // Header: magic, version, device_id length, record count, sent_at
+  out[pos++] = 'W';
+  out[pos++] = 'S';
+  out[pos++] = 1;
+  out[pos++] = idLength;
+  memcpy(out + pos, &recordCount, 2); pos += 2;
+  memcpy(out + pos, &sentAt, 4); pos += 4;
+  memcpy(out + pos, DEVICE_ID, idLength); pos += idLength;
+  
+  // Records: timestamp, distance, level, gallons, fill %, battery, RSSI
+  for (int i = 0; i < count; i++) {
+    BufferedReading& entry = readingBuffer[(bufferStart + i) % BUFFER_SIZE];
+    uint32_t timestamp = entry.timestamp;
+    float fillPercentage = (entry.gallons / TANK_CAPACITY_GALLONS) * 100;
+    memcpy(out + pos, &timestamp, 4); pos += 4;
+    memcpy(out + pos, &entry.distance, 4); pos += 4;
+    memcpy(out + pos, &entry.level, 4); pos += 4;
+    memcpy(out + pos, &entry.gallons, 4); pos += 4;
+    memcpy(out + pos, &fillPercentage, 4); pos += 4;
+    memcpy(out + pos, &entry.battery, 4); pos += 4;
+    memcpy(out + pos, &rssi, 2); pos += 2;
   }
+  return pos;
 }
 
 // Optional: Add deep sleep for battery conservation
@@ -1,28 +1,64 @@
 import os
 import json
-import requests
+import logging
 import schedule
 import time
 import threading
-import smtplib
+import queue
+import functools
+import atexit
+import uuid
+import itertools
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
-from flask import Flask, jsonify, request
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore, messaging
 from dotenv import load_dotenv
+from .coordinator import Coordinator, CoordinatorUnavailable
+from .write_queue import FirestoreWriteQueue
+from .estimator import UsageEstimator
+from .filters import ReadingFilter
+from .forecast import ConsumptionForecaster
+from .segments import KINDS as EVENT_KINDS, EventSegmenter, summarize_events
+from .leaks import LeakDetector
+from .devices import DeviceRegistry
+from .poller import DevicePoller, parse_endpoints
+from .jobs import JobManager
+from .broadcaster import Broadcaster
+from .cache import ResponseCache
+from .spool import Spool, SpoolReplayer
+from .notifier import NotificationDispatcher, SMTPMailer, FCMSender
+from .rules import RuleEngine, features_from_readings, load_rules
+from .ingest import PayloadError, decode_body, normalize_batch
+from .replay import Replay, firestore_readings, local_readings
+from .metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .logs import configure_logging, parse_levels, parse_rates
+from .compression import ReadingCompressor, interpolate_buckets
+from .storage import (BACKENDS as STORAGE_BACKENDS, CompressedStorage, FirestoreStorage, MemoryStorage,
+                      MirroredStorage, SQLiteStorage)
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
 ESP32_IP = os.getenv('ESP32_IP', '192.168.86.90')
 ESP32_PORT = os.getenv('ESP32_PORT', '80')
+# Comma separated host[:port] list of sensors to poll; defaults to ESP32_IP
+ESP32_ENDPOINTS = parse_endpoints(os.getenv('ESP32_DEVICES') or ESP32_IP, ESP32_PORT)
+POLL_TIMEOUT_SECONDS = float(os.getenv('POLL_TIMEOUT_SECONDS', '5'))
+POLL_MAX_WORKERS = int(os.getenv('POLL_MAX_WORKERS', '16'))
+POLL_JITTER_SECONDS = float(os.getenv('POLL_JITTER_SECONDS', '2'))
+POLL_FAILURE_THRESHOLD = int(os.getenv('POLL_FAILURE_THRESHOLD', '3'))
+POLL_CIRCUIT_OPEN_SECONDS = int(os.getenv('POLL_CIRCUIT_OPEN_SECONDS', '60'))
+FORCE_READING_WORKERS = int(os.getenv('FORCE_READING_WORKERS', '4'))
 ALERT_THRESHOLD = float(os.getenv('ALERT_THRESHOLD_PERCENT', '10'))
 ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN_MINUTES', '30'))
 
@@ -32,6 +68,50 @@ CRITICAL_LEVEL_THRESHOLD = float(os.getenv('CRITICAL_LEVEL_THRESHOLD', '10'))
 EMERGENCY_LEVEL_THRESHOLD = float(os.getenv('EMERGENCY_LEVEL_THRESHOLD', '5'))
 RAPID_DROP_THRESHOLD = float(os.getenv('RAPID_DROP_THRESHOLD', '15'))
 SUSTAINED_DROP_THRESHOLD = float(os.getenv('SUSTAINED_DROP_THRESHOLD', '5'))
+LOW_BATTERY_VOLTAGE = float(os.getenv('LOW_BATTERY_VOLTAGE', '11.0'))
+
+# Alert Rules (JSON file; defaults to rules built from the thresholds above)
+ALERT_RULES_FILE = os.getenv('ALERT_RULES_FILE')
+
+# Usage Estimation
+USAGE_WINDOW_HOURS = float(os.getenv('USAGE_WINDOW_HOURS', '24'))
+USAGE_RATE_METHOD = os.getenv('USAGE_RATE_METHOD', 'least_squares')  # or 'endpoints'
+
+# Reading Filter (glitch rejection and smoothing before alert checks)
+READING_FILTER = os.getenv('READING_FILTER', 'true').lower() == 'true'
+FILTER_WINDOW = int(os.getenv('FILTER_WINDOW', '5'))
+FILTER_SIGMAS = float(os.getenv('FILTER_SIGMAS', '3'))
+FILTER_MIN_DEVIATION = float(os.getenv('FILTER_MIN_DEVIATION', '3'))
+FILTER_SMOOTHING = os.getenv('FILTER_SMOOTHING', 'kalman')  # 'kalman', 'ema' or 'off'
+FILTER_PROCESS_NOISE = float(os.getenv('FILTER_PROCESS_NOISE', '5'))
+FILTER_MEASUREMENT_NOISE = float(os.getenv('FILTER_MEASUREMENT_NOISE', '0.5'))
+FILTER_EMA_SECONDS = float(os.getenv('FILTER_EMA_SECONDS', '120'))
+
+# Consumption Forecast (hour-of-week usage profile for days remaining)
+FORECAST_DECAY = float(os.getenv('FORECAST_DECAY', '0.2'))  # Weight of the newest week
+FORECAST_MIN_HOURS = int(os.getenv('FORECAST_MIN_HOURS', '24'))
+FORECAST_HORIZON_DAYS = int(os.getenv('FORECAST_HORIZON_DAYS', '14'))
+FORECAST_CONFIDENCE = float(os.getenv('FORECAST_CONFIDENCE', '0.8'))
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '28'))
+
+# Pump Events (refill, draw and idle periods)
+EVENT_MIN_GALLONS = float(os.getenv('EVENT_MIN_GALLONS', '10'))  # Smallest change that starts an event
+EVENT_IDLE_MINUTES = int(os.getenv('EVENT_IDLE_MINUTES', '30'))
+EVENT_MAX_GAP_MINUTES = int(os.getenv('EVENT_MAX_GAP_MINUTES', '120'))
+EVENTS_DEFAULT_LIMIT = int(os.getenv('EVENTS_DEFAULT_LIMIT', '100'))
+EVENTS_MAX_LIMIT = int(os.getenv('EVENTS_MAX_LIMIT', '1000'))
+
+# Leak Detection (nightly minimum night flow against a learned baseline)
+LEAK_DETECTION = os.getenv('LEAK_DETECTION', 'true').lower() == 'true'
+LEAK_CHECK_TIME = os.getenv('LEAK_CHECK_TIME', '06:00')  # Local time, after the night window
+LEAK_NIGHT_START_HOUR = int(os.getenv('LEAK_NIGHT_START_HOUR', '1'))
+LEAK_NIGHT_END_HOUR = int(os.getenv('LEAK_NIGHT_END_HOUR', '5'))
+LEAK_BASELINE_NIGHTS = int(os.getenv('LEAK_BASELINE_NIGHTS', '14'))
+LEAK_MIN_BASELINE_NIGHTS = int(os.getenv('LEAK_MIN_BASELINE_NIGHTS', '5'))
+LEAK_CONFIRM_NIGHTS = int(os.getenv('LEAK_CONFIRM_NIGHTS', '2'))
+LEAK_MIN_EXCESS_GPH = float(os.getenv('LEAK_MIN_EXCESS_GPH', '2'))
+LEAK_SIGMAS = float(os.getenv('LEAK_SIGMAS', '3'))
+LEAK_COOLDOWN_HOURS = float(os.getenv('LEAK_COOLDOWN_HOURS', '72'))  # Between repeat alerts for one leak
 
 # Cooldown Settings
 NORMAL_COOLDOWN = int(os.getenv('NORMAL_COOLDOWN', '30'))
@@ -46,86 +126,372 @@ SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 ALERT_EMAIL = os.getenv('ALERT_EMAIL')
 ALERT_EMAIL_PASSWORD = os.getenv('ALERT_EMAIL_PASSWORD')
 
+# Notification Delivery
+NOTIFY_PUSH_WORKERS = int(os.getenv('NOTIFY_PUSH_WORKERS', '2'))
+NOTIFY_EMAIL_CONNECTIONS = int(os.getenv('NOTIFY_EMAIL_CONNECTIONS', '1'))
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', '3'))
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', '1000'))
+
+# Firestore Write Queue
+WRITE_QUEUE_MAX_SIZE = int(os.getenv('WRITE_QUEUE_MAX_SIZE', '10000'))
+FIRESTORE_BATCH_SIZE = int(os.getenv('FIRESTORE_BATCH_SIZE', '100'))
+FIRESTORE_FLUSH_INTERVAL = float(os.getenv('FIRESTORE_FLUSH_INTERVAL', '1.0'))
+FIRESTORE_MAX_RETRIES = int(os.getenv('FIRESTORE_MAX_RETRIES', '5'))
+
+# Bulk Ingestion Limits for /tank-data
+MAX_BATCH_READINGS = int(os.getenv('MAX_BATCH_READINGS', '1000'))
+MAX_TANK_DATA_BYTES = int(os.getenv('MAX_TANK_DATA_BYTES', '1048576'))
+
+# Local Time-Series Store
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+RAW_RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', '30'))
+MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv('MINUTE_ROLLUP_RETENTION_DAYS', '30'))
+ALERT_RETENTION_DAYS = int(os.getenv('ALERT_RETENTION_DAYS', '90'))
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', '365'))
+
+# Storage
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # 'sqlite', 'memory' or 'firestore'
+FIRESTORE_MIRROR = os.getenv('FIRESTORE_MIRROR', 'true').lower() == 'true'
+
+# Reading Compression
+COMPRESSION_MODE = os.getenv('COMPRESSION_MODE', 'swinging_door')  # 'deadband', 'swinging_door' or 'off'
+COMPRESSION_GALLONS_TOLERANCE = float(os.getenv('COMPRESSION_GALLONS_TOLERANCE', '5'))
+COMPRESSION_FILL_TOLERANCE = float(os.getenv('COMPRESSION_FILL_TOLERANCE', '0.5'))
+COMPRESSION_MAX_GAP_SECONDS = int(os.getenv('COMPRESSION_MAX_GAP_SECONDS', '3600'))
+# Replays of Firestore readings measure no change between readings further apart (two polls)
+MIRROR_REPLAY_MAX_GAP_SECONDS = int(os.getenv('MIRROR_REPLAY_MAX_GAP_SECONDS', '600'))
+
+FORECAST_FILE = os.getenv('FORECAST_FILE', os.path.join(DATA_DIR, 'forecast.json'))
+SEGMENTS_FILE = os.getenv('SEGMENTS_FILE', os.path.join(DATA_DIR, 'segments.json'))
+
+# Offline Spool
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(DATA_DIR, 'spool'))
+SPOOL_MAX_MB = int(os.getenv('SPOOL_MAX_MB', '512'))
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', '1.0'))
+SPOOL_REPLAY_RATE = float(os.getenv('SPOOL_REPLAY_RATE', '50'))
+
+# History Downsampling
+HISTORY_DEFAULT_POINTS = int(os.getenv('HISTORY_DEFAULT_POINTS', '200'))
+HISTORY_MAX_POINTS = int(os.getenv('HISTORY_MAX_POINTS', '1000'))
+
+# Live Event Stream
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Response Cache
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '60'))
+
+# Worker Coordination
+RUN_DIR = os.getenv('RUN_DIR', '/tmp/wellsensor')
+LEADER_RETRY_SECONDS = int(os.getenv('LEADER_RETRY_SECONDS', '5'))
+
+# Metrics
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(RUN_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+
+# Logging
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')  # Per-logger levels, e.g. backend.poller=DEBUG,werkzeug=WARNING
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # or 'text'
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')  # Log 1 in N of an event, e.g. reading=100,batch=10
+
+# Log records are queued and written by one background thread per worker
+configure_logging(LOG_LEVEL, parse_levels(LOG_LEVELS), parse_rates(LOG_SAMPLING), fmt=LOG_FORMAT)
+
 # Global variables
-last_reading = None
-last_alert_time = None
-last_critical_alert_time = None
-last_emergency_alert_time = None
 alert_history = []
-usage_history = []
 alerts_enabled = True  # Global flag to enable/disable all alerts
 
+# Fan-out of live readings and alerts to /stream subscribers in this worker
+events = Broadcaster()
+STREAM_EVENT_TYPES = ('reading', 'alert')
+
+# Storage reads other workers may forward to the leader
+STORAGE_QUERIES = ('query_raw', 'query_buckets', 'query_alerts', 'query_events', 'latest')
+
+# Cached JSON for read endpoints, cleared whenever any event is published
+# here or relayed from the leader
+response_cache = ResponseCache(ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+
+# Prometheus metrics for /metrics; every worker records its own and they are
+# merged through per-process snapshot files in METRICS_DIR
+metrics = Metrics(METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+request_seconds = metrics.histogram('wellsensor_http_request_seconds', 'Time to handle a request',
+                                    ('endpoint', 'method'))
+esp32_poll_seconds = metrics.histogram('wellsensor_esp32_request_seconds', 'ESP32 request latency',
+                                       ('path', 'outcome'))
+firestore_commit_seconds = metrics.histogram('wellsensor_firestore_commit_seconds',
+                                             'Firestore batch commit latency', ('outcome',))
+firestore_query_seconds = metrics.histogram('wellsensor_firestore_query_seconds', 'Firestore query latency',
+                                            ('query',))
+notification_send_seconds = metrics.histogram('wellsensor_notification_send_seconds',
+                                              'FCM and SMTP batch send latency', ('channel',))
+readings_ingested = metrics.counter('wellsensor_readings_total', 'Readings ingested', ('device_id',))
+readings_dropped = metrics.counter('wellsensor_readings_dropped_total',
+                                   'Readings rejected or left out of alert checks', ('reason',))
+alerts_fired = metrics.counter('wellsensor_alerts_fired_total', 'Alerts raised', ('type', 'severity'))
+alerts_suppressed = metrics.counter('wellsensor_alerts_suppressed_total', 'Alerts held back by a cooldown',
+                                    ('rule',))
+
+def new_reading_filter():
+    return ReadingFilter(window=FILTER_WINDOW, n_sigmas=FILTER_SIGMAS, min_deviation=FILTER_MIN_DEVIATION,
+                         smoothing=FILTER_SMOOTHING, process_noise=FILTER_PROCESS_NOISE,
+                         measurement_noise=FILTER_MEASUREMENT_NOISE, ema_seconds=FILTER_EMA_SECONDS)
+
+# Per-device readings, usage estimates, reading filters and alert cooldowns,
+# keyed by device_id
+devices = DeviceRegistry(
+    lambda: UsageEstimator(window_seconds=USAGE_WINDOW_HOURS * 3600, method=USAGE_RATE_METHOD),
+    new_reading_filter if READING_FILTER else None
+)
+
+def new_forecaster():
+    return ConsumptionForecaster(decay=FORECAST_DECAY, min_hours=FORECAST_MIN_HOURS,
+                                 horizon_hours=FORECAST_HORIZON_DAYS * 24, confidence=FORECAST_CONFIDENCE)
+
+# Hour-of-week usage profiles per device, kept up to date one reading at a
+# time on the leader and saved to FORECAST_FILE
+forecaster = new_forecaster()
+
+def new_segmenter(ready=True):
+    return EventSegmenter(min_gallons=EVENT_MIN_GALLONS, idle_seconds=EVENT_IDLE_MINUTES * 60,
+                          max_gap_seconds=EVENT_MAX_GAP_MINUTES * 60, ready=ready)
+
+# Refill/draw/idle segmentation per device. Live readings are held until the
+# leader has caught it up with stored history (rebuild_segments)
+segmenter = new_segmenter(ready=False)
+
+leak_detector = LeakDetector(
+    night_start_hour=LEAK_NIGHT_START_HOUR, night_end_hour=LEAK_NIGHT_END_HOUR,
+    baseline_nights=LEAK_BASELINE_NIGHTS, min_baseline_nights=LEAK_MIN_BASELINE_NIGHTS,
+    confirm_nights=LEAK_CONFIRM_NIGHTS, min_excess_gph=LEAK_MIN_EXCESS_GPH, n_sigmas=LEAK_SIGMAS,
+    refill_gallons=EVENT_MIN_GALLONS
+)
+# Latest nightly result per device_id, on the leader
+leak_checks = {}
+
+def init_firebase():
+    """Initialize the Firebase app, if it is not yet, and return a Firestore client"""
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.Certificate({
+            "type": "service_account",
+            "project_id": os.getenv('FIREBASE_PROJECT_ID'),
+            "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID'),
+            "private_key": os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n'),
+            "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
+            "client_id": os.getenv('FIREBASE_CLIENT_ID'),
+            "auth_uri": os.getenv('FIREBASE_AUTH_URI'),
+            "token_uri": os.getenv('FIREBASE_TOKEN_URI'),
+            "auth_provider_x509_cert_url": os.getenv('FIREBASE_AUTH_PROVIDER_X509_CERT_URL'),
+            "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_X509_CERT_URL')
+        })
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
 # Initialize Firebase
 try:
-    cred = credentials.Certificate({
-        "type": "service_account",
-        "project_id": os.getenv('FIREBASE_PROJECT_ID'),
-        "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID'),
-        "private_key": os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n'),
-        "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
-        "client_id": os.getenv('FIREBASE_CLIENT_ID'),
-        "auth_uri": os.getenv('FIREBASE_AUTH_URI'),
-        "token_uri": os.getenv('FIREBASE_TOKEN_URI'),
-        "auth_provider_x509_cert_url": os.getenv('FIREBASE_AUTH_PROVIDER_X509_CERT_URL'),
-        "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_X509_CERT_URL')
-    })
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
+    db = init_firebase()
     firebase_initialized = True
-    print("Firebase initialized successfully")
+    logger.info('Firebase initialized successfully')
 except Exception as e:
-    print(f"Firebase initialization failed: {e}")
+    logger.warning('Firebase initialization failed: %s', e)
+    db = None
     firebase_initialized = False
 
-def get_esp32_data():
-    """Fetch data from ESP32 sensor"""
+# Documents that cannot reach Firestore (no Firebase, queue full, or a batch
+# that failed every retry) are kept on disk and replayed later
+spool = Spool(SPOOL_DIR, fsync_interval=SPOOL_FSYNC_INTERVAL, max_bytes=SPOOL_MAX_MB * 1024 * 1024)
+atexit.register(spool.close)  # atexit is LIFO, so this runs after the queue flush below
+
+# Firestore writes go through a background batching queue so that sensor
+# POSTs never wait on a Firestore round trip
+def new_write_queue(client):
+    writes = FirestoreWriteQueue(
+        client,
+        max_size=WRITE_QUEUE_MAX_SIZE,
+        batch_size=FIRESTORE_BATCH_SIZE,
+        flush_interval=FIRESTORE_FLUSH_INTERVAL,
+        max_retries=FIRESTORE_MAX_RETRIES,
+        on_failure=lambda items: spool_documents(items),
+        on_flush=lambda items: on_firestore_flush(items),
+        on_commit=lambda seconds, count, error: firestore_commit_seconds.observe(
+            seconds, outcome='error' if error else 'ok')
+    )
+    atexit.register(writes.flush, 10)
+    return writes
+
+write_queue = new_write_queue(db) if firebase_initialized else None
+
+def connect_spool_replay():
+    """The write queue to replay the spool into, or None while Firebase is unavailable
+    
+    If Firebase failed at startup, it is initialized again on each call.
+    Only the spool replay uses a client connected this way; everything else
+    keeps the startup state until the next restart.
+    """
+    if write_queue is not None:
+        return write_queue
     try:
-        url = f"http://{ESP32_IP}:{ESP32_PORT}/status"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching ESP32 data: {e}")
+        client = init_firebase()
+    except Exception as e:
+        logger.warning('Firebase still unavailable for spool replay: %s', e)
         return None
+    logger.info('Firebase connected for spool replay')
+    return new_write_queue(client)
+
+spool_replayer = SpoolReplayer(spool, connect_spool_replay, rate=SPOOL_REPLAY_RATE)
+
+# Push and email notifications are delivered by background workers so alert
+# checks never wait on FCM or SMTP
+notifier = NotificationDispatcher(
+    on_batch=lambda channel, seconds, size, failures: notification_send_seconds.observe(seconds, channel=channel)
+)
+if firebase_initialized:
+    # FCM accepts up to 500 messages per send_each call
+    notifier.add_channel('push', lambda: FCMSender(messaging.send_each), workers=NOTIFY_PUSH_WORKERS,
+                         batch_size=500, max_retries=NOTIFY_MAX_RETRIES, max_queue_size=NOTIFY_QUEUE_SIZE)
+if ENABLE_EMAIL_ALERTS and ALERT_EMAIL and ALERT_EMAIL_PASSWORD:
+    notifier.add_channel('email', lambda: SMTPMailer(SMTP_SERVER, SMTP_PORT, ALERT_EMAIL, ALERT_EMAIL_PASSWORD),
+                         workers=NOTIFY_EMAIL_CONNECTIONS, batch_size=20, max_retries=NOTIFY_MAX_RETRIES,
+                         max_queue_size=NOTIFY_QUEUE_SIZE)
+
+# Readings that lie on a straight line with their neighbours, within the
+# tolerances, are not written to Firestore; local storage keeps them all
+compressor = ReadingCompressor(
+    COMPRESSION_MODE,
+    tolerances={'gallons': COMPRESSION_GALLONS_TOLERANCE, 'fill_percentage': COMPRESSION_FILL_TOLERANCE},
+    max_gap_seconds=COMPRESSION_MAX_GAP_SECONDS
+)
+
+def open_storage():
+    """Build the configured system of record for readings and alerts
+    
+    SQLite keeps readings with 1-minute/1-hour/1-day rollups on local disk,
+    so nothing waits on the cloud. With FIRESTORE_MIRROR and Firebase
+    configured, every write is also copied to Firestore in the background.
+    Readings written to Firestore, as the mirror or the only store, go
+    through the compressor first.
+    """
+    backend = STORAGE_BACKEND
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+    if backend == 'firestore' and not firebase_initialized:
+        logger.warning('STORAGE_BACKEND=firestore needs Firebase; using sqlite instead')
+        backend = 'sqlite'
+    
+    firestore_storage = None
+    if firebase_initialized:
+        firestore_storage = FirestoreStorage(
+            db, lambda collection, data, doc_id: persist_document(collection, data, doc_id),
+            on_query=lambda name, seconds: firestore_query_seconds.observe(seconds, query=name)
+        )
+    if backend == 'firestore':
+        if compressor.mode == 'off':
+            return firestore_storage
+        return CompressedStorage(firestore_storage, compressor)
+    
+    if backend == 'memory':
+        primary = MemoryStorage(raw_retention_days=RAW_RETENTION_DAYS, alert_retention_days=ALERT_RETENTION_DAYS,
+                                event_retention_days=EVENT_RETENTION_DAYS)
+    else:
+        primary = SQLiteStorage(os.path.join(DATA_DIR, 'readings.db'),
+                                raw_retention_days=RAW_RETENTION_DAYS,
+                                minute_retention_days=MINUTE_ROLLUP_RETENTION_DAYS,
+                                alert_retention_days=ALERT_RETENTION_DAYS,
+                                event_retention_days=EVENT_RETENTION_DAYS)
+    if FIRESTORE_MIRROR and firestore_storage:
+        return MirroredStorage(primary, firestore_storage, compressor)
+    return primary
+
+storage = open_storage()
+
+# Pooled, concurrent poller with a circuit breaker per sensor
+poller = DevicePoller(
+    ESP32_ENDPOINTS,
+    timeout=POLL_TIMEOUT_SECONDS,
+    max_workers=POLL_MAX_WORKERS,
+    jitter_seconds=POLL_JITTER_SECONDS,
+    failure_threshold=POLL_FAILURE_THRESHOLD,
+    open_seconds=POLL_CIRCUIT_OPEN_SECONDS,
+    on_fetch=lambda endpoint, path, seconds, ok: esp32_poll_seconds.observe(
+        seconds, path=path, outcome='ok' if ok else 'error')
+)
+
+def default_alert_rules():
+    """Alert rules equivalent to the threshold and cooldown settings"""
+    return {
+        'severity_levels': [
+            {'severity': 'emergency', 'when': [['fill_percentage', '<=', EMERGENCY_LEVEL_THRESHOLD]]},
+            {'severity': 'critical', 'when': [['fill_percentage', '<=', CRITICAL_LEVEL_THRESHOLD]]},
+            {'severity': 'low', 'when': [['fill_percentage', '<=', LOW_LEVEL_THRESHOLD]]},
+            {'severity': 'rapid_drop', 'when': [['drop', '>=', RAPID_DROP_THRESHOLD]]}
+        ],
+        'rules': [
+            {'name': 'rapid_drop', 'group': 'level', 'cooldown_minutes': DROP_COOLDOWN,
+             'when': [['drop', '>=', RAPID_DROP_THRESHOLD]]},
+            {'name': 'emergency_level', 'group': 'level', 'severity': 'emergency',
+             'cooldown_minutes': EMERGENCY_COOLDOWN,
+             'when': [['fill_percentage', '<=', EMERGENCY_LEVEL_THRESHOLD]]},
+            {'name': 'critical_level', 'group': 'level', 'severity': 'critical',
+             'cooldown_minutes': CRITICAL_COOLDOWN,
+             'when': [['fill_percentage', '<=', CRITICAL_LEVEL_THRESHOLD]]},
+            {'name': 'change', 'group': 'level', 'cooldown_minutes': NORMAL_COOLDOWN,
+             'when': [['change', '>=', ALERT_THRESHOLD]]},
+            {'name': 'low_level', 'group': 'level', 'cooldown_minutes': DROP_COOLDOWN,
+             'when': [['fill_percentage', '<=', LOW_LEVEL_THRESHOLD]]},
+            {'name': 'low_battery', 'severity': 'normal', 'cooldown_minutes': NORMAL_COOLDOWN,
+             'when': [['battery_voltage', '>', 0], ['battery_voltage', '<', LOW_BATTERY_VOLTAGE]]}
+        ]
+    }
+
+alert_engine = RuleEngine(load_rules(ALERT_RULES_FILE) if ALERT_RULES_FILE else default_alert_rules(),
+                          on_suppressed=lambda device_id, rule: alerts_suppressed.inc(rule=rule.name))
+
+# Gauges and counters read from the components above at snapshot time
+metrics.gauge('wellsensor_write_queue_depth', 'Documents waiting for a Firestore batch',
+              collect=lambda: write_queue.stats()['queue_depth'] if write_queue else None)
+metrics.gauge('wellsensor_notification_queue_depth', 'Notifications waiting to be sent, including retries',
+              ('channel',), collect=lambda: {name: stats['queue_depth'] + stats['retry_depth']
+                                            for name, stats in notifier.stats().items()})
+metrics.counter('wellsensor_notifications_failed_total', 'Notifications given up after every retry or dropped',
+                ('channel',), collect=lambda: {name: stats['failed'] + stats['dropped']
+                                               for name, stats in notifier.stats().items()})
+# Every worker sees the same spool directory, so take one worker's figure
+metrics.gauge('wellsensor_spool_bytes', 'Size of the offline spool on disk', mode='max',
+              collect=lambda: spool.stats()['bytes'])
+metrics.gauge('wellsensor_stream_subscribers', 'Open /stream connections', collect=lambda: len(events))
+metrics.gauge('wellsensor_device_fill_percentage', 'Latest fill percentage per device', ('device_id',),
+              mode='max', collect=lambda: {device.device_id: (device.last_reading or {}).get('fill_percentage')
+                                           for device in devices} if coordinator.is_leader else None)
+
+def get_esp32_data(endpoint=None):
+    """Fetch data from an ESP32 sensor (the first configured one by default)"""
+    return poller.fetch(endpoint or ESP32_ENDPOINTS[0])
+
+# Background jobs for /force-reading, coalesced per sensor
+force_reading_jobs = JobManager(max_workers=FORCE_READING_WORKERS)
 
 def send_email_alert(subject, body):
-    """Send email alert"""
+    """Queue an email alert; returns a Future for its delivery, or None if email is off"""
     if not ENABLE_EMAIL_ALERTS or not ALERT_EMAIL or not ALERT_EMAIL_PASSWORD:
-        return False
+        return None
     
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = ALERT_EMAIL
-        msg['To'] = ALERT_EMAIL
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(ALERT_EMAIL, ALERT_EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(ALERT_EMAIL, ALERT_EMAIL, text)
-        server.quit()
-        
-        print(f"Email alert sent: {subject}")
-        return True
-    except Exception as e:
-        print(f"Error sending email alert: {e}")
-        return False
-
-def get_alert_severity(current_percent, is_drop=False, percent_change=0):
-    """Determine alert severity based on current level and change"""
-    if current_percent <= EMERGENCY_LEVEL_THRESHOLD:
-        return 'emergency'
-    elif current_percent <= CRITICAL_LEVEL_THRESHOLD:
-        return 'critical'
-    elif current_percent <= LOW_LEVEL_THRESHOLD:
-        return 'low'
-    elif is_drop and percent_change >= RAPID_DROP_THRESHOLD:
-        return 'rapid_drop'
-    else:
-        return 'normal'
+    msg = MIMEMultipart()
+    msg['From'] = ALERT_EMAIL
+    msg['To'] = ALERT_EMAIL
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'plain'))
+    
+    logger.info('Email alert queued: %s', subject)
+    return notifier.submit('email', msg)
+
+def send_push(message):
+    """Queue an FCM message; returns a Future for its delivery, or None without Firebase"""
+    if not firebase_initialized:
+        return None
+    return notifier.submit('push', message)
 
 def get_cooldown_for_severity(severity):
     """Get appropriate cooldown time based on severity"""
@@ -150,137 +516,129 @@ def should_send_alert(severity, last_alert_time_for_type):
     
     return datetime.now() - last_alert_time_for_type > timedelta(minutes=cooldown_minutes)
 
-def calculate_usage_rate():
-    """Calculate water usage rate from historical data"""
-    if len(usage_history) < 2:
-        return 0
-    
-    # Get last 24 hours of data
-    recent_data = [r for r in usage_history if 
-                  datetime.now() - r['timestamp'] <= timedelta(hours=24)]
-    
-    if len(recent_data) < 2:
-        return 0
-    
-    # Calculate gallons used per hour
-    time_diff = (recent_data[-1]['timestamp'] - recent_data[0]['timestamp']).total_seconds() / 3600
-    gallon_diff = recent_data[0]['gallons'] - recent_data[-1]['gallons']
-    
-    if time_diff > 0:
-        return gallon_diff / time_diff
-    return 0
+def publish_event(event_type, data):
+    """Push an event to /stream subscribers and drop cached responses"""
+    response_cache.clear()
+    events.publish({'type': event_type, 'data': data})
 
-def calculate_days_remaining(current_gallons):
-    """Calculate estimated days until tank is empty"""
-    usage_rate = calculate_usage_rate()
-    
-    if usage_rate <= 0:
-        return None
+def spool_documents(items):
+    """Write (collection, doc_id, data) documents to the offline spool"""
+    now = datetime.now(timezone.utc)
+    try:
+        # Server timestamps cannot be resolved offline; use the time we gave up
+        spool.append_many([
+            (collection, doc_id,
+             {k: now if v is firestore.SERVER_TIMESTAMP else v for k, v in data.items()})
+            for collection, doc_id, data in items
+        ])
+    except Exception:
+        logger.exception('Error spooling %d documents', len(items))
+
+def persist_document(collection, data, doc_id=None):
+    """Queue a document for Firestore, spooling it if it cannot be queued"""
+    doc_id = doc_id or uuid.uuid4().hex
+    if write_queue is None or write_queue.enqueue(collection, data, doc_id) is None:
+        spool_documents([(collection, doc_id, data)])
+    return doc_id
+
+def on_firestore_flush(items):
+    """Invalidate cached /alerts responses once new alerts reach Firestore"""
+    if any(collection == 'alerts' for collection, _, _ in items):
+        publish_event('stored', {'collection': 'alerts'})
+
+def publish_alert(alert_type, severity, current_data, **extra):
+    """Announce a fired alert on the live event stream"""
+    alert = {
+        'type': alert_type,
+        'severity': severity,
+        'device_id': current_data.get('device_id', 'unknown'),
+        'fill_percentage': current_data.get('fill_percentage', 0),
+        'gallons': current_data.get('gallons', 0),
+        'timestamp': datetime.now().isoformat()
+    }
+    alert.update(extra)
+    publish_event('alert', alert)
+
+def calculate_usage_rate(device):
+    """Calculate a device's water usage rate (gallons per hour) from recent readings"""
+    return device.usage_estimator.rate()
+
+def calculate_days_remaining(device, current_gallons):
+    """Estimated days until the device's tank is empty, or None
     
-    # Calculate gallons per day
-    gallons_per_day = usage_rate * 24
+    Comes from the hour-of-week forecast once the device has a profile, and
+    from the recent usage rate until then.
+    """
+    forecast = forecaster.forecast(device.device_id, current_gallons)
+    if forecast is None:
+        return device.usage_estimator.days_remaining(current_gallons)
+    hours = forecast['hours_to_empty']
+    return hours / 24 if hours is not None else None
+
+def evaluate_alerts(rows):
+    """Run the alert rules over (device, ts, current_data, previous_data) rows and send what fires
     
-    if gallons_per_day <= 0:
-        return None
+    All rows are matched against the rules in one vectorized pass, however
+    many devices they come from.
+    """
+    if not rows or not alerts_enabled:
+        return
     
-    return current_gallons / gallons_per_day
+    features = features_from_readings([row[2] for row in rows], [row[3] for row in rows])
+    firings = alert_engine.evaluate([row[0].device_id for row in rows], [row[1] for row in rows], features)
+    for firing in firings:
+        device, _, current_data, previous_data = rows[firing.row]
+        fire_alert(device, firing.rule.alert_type, firing.severity, current_data, previous_data)
 
-def check_for_alerts(current_data, previous_data):
-    """Enhanced alert checking with multiple severity levels and drop detection"""
-    global last_alert_time, last_critical_alert_time, last_emergency_alert_time, usage_history, alerts_enabled
+def fire_alert(device, alert_type, severity, current_data, previous_data):
+    """Notify, store and publish one alert raised by the rule engine"""
+    now = datetime.now()
+    if severity == 'emergency':
+        device.last_emergency_alert_time = now
+    elif severity == 'critical':
+        device.last_critical_alert_time = now
+    device.last_alert_time = now
+    alerts_fired.inc(type=alert_type, severity=severity)
     
-    if not previous_data or not firebase_initialized or not alerts_enabled:
+    if alert_type == 'low_battery':
+        battery_voltage = current_data.get('battery_voltage', 0)
+        send_battery_alert(current_data, battery_voltage)
+        store_battery_alert(current_data, battery_voltage)
+        publish_alert('low_battery', severity, current_data, battery_voltage=battery_voltage)
         return
     
-    current_percent = current_data.get('fill_percentage', 0)
-    previous_percent = previous_data.get('fill_percentage', 0)
-    current_gallons = current_data.get('gallons', 0)
-    
-    # Update usage history
-    usage_history.append({
-        'timestamp': datetime.now(),
-        'gallons': current_gallons,
-        'fill_percentage': current_percent
-    })
+    percent_change = abs(current_data.get('fill_percentage', 0) - previous_data.get('fill_percentage', 0))
+    send_enhanced_alert(current_data, previous_data, percent_change, severity, alert_type)
+    store_enhanced_alert(device, current_data, previous_data, percent_change, severity, alert_type)
+    publish_alert(alert_type, severity, current_data, percent_change=percent_change)
+
+def check_for_alerts(device, current_data, previous_data, ts=None):
+    """Evaluate the alert rules and predictive alerts for one new reading"""
+    if not previous_data:
+        return
     
-    # Keep only last 48 hours of usage data
-    cutoff_time = datetime.now() - timedelta(hours=48)
-    usage_history = [r for r in usage_history if r['timestamp'] > cutoff_time]
-    
-    # Calculate changes
-    percent_change = abs(current_percent - previous_percent)
-    is_drop = current_percent < previous_percent
-    
-    # Determine severity
-    severity = get_alert_severity(current_percent, is_drop, percent_change)
-    
-    # Check if we should send alerts based on different criteria
-    should_alert = False
-    alert_type = 'change'
-    
-    # 1. Check for rapid drops
-    if is_drop and percent_change >= RAPID_DROP_THRESHOLD:
-        should_alert = should_send_alert('rapid_drop', last_alert_time)
-        alert_type = 'rapid_drop'
-    
-    # 2. Check for critical/emergency levels
-    elif severity in ['emergency', 'critical']:
-        last_time = last_emergency_alert_time if severity == 'emergency' else last_critical_alert_time
-        should_alert = should_send_alert(severity, last_time)
-        alert_type = f'{severity}_level'
-    
-    # 3. Check for regular threshold changes
-    elif percent_change >= ALERT_THRESHOLD:
-        should_alert = should_send_alert('normal', last_alert_time)
-        alert_type = 'change'
-    
-    # 4. Check for low level alerts
-    elif current_percent <= LOW_LEVEL_THRESHOLD:
-        should_alert = should_send_alert('low', last_alert_time)
-        alert_type = 'low_level'
-    
-    if should_alert:
-        # Send alerts
-        send_enhanced_alert(current_data, previous_data, percent_change, severity, alert_type)
-        
-        # Update alert times
-        now = datetime.now()
-        if severity == 'emergency':
-            last_emergency_alert_time = now
-        elif severity == 'critical':
-            last_critical_alert_time = now
-        last_alert_time = now
-        
-        # Store alert in Firebase
-        store_enhanced_alert(current_data, previous_data, percent_change, severity, alert_type)
-    
-    # Check for predictive alerts
-    check_predictive_alerts(current_gallons)
-    
-    # Check for low battery alert (unchanged)
-    battery_voltage = current_data.get('battery_voltage', 0)
-    if battery_voltage > 0 and battery_voltage < 11.0:
-        if should_send_alert('normal', last_alert_time):
-            send_battery_alert(current_data, battery_voltage)
-            last_alert_time = datetime.now()
-            store_battery_alert(current_data, battery_voltage)
-
-def check_predictive_alerts(current_gallons):
+    evaluate_alerts([(device, ts if ts is not None else time.time(), current_data, previous_data)])
+    check_predictive_alerts(device, current_data)
+
+def check_predictive_alerts(device, current_data):
     """Check if predictive alerts should be sent"""
-    global last_critical_alert_time, alerts_enabled
-    
     if not alerts_enabled:
         return
         
-    days_remaining = calculate_days_remaining(current_gallons)
+    current_gallons = current_data.get('gallons', 0)
+    days_remaining = calculate_days_remaining(device, current_gallons)
     
     if days_remaining is not None and days_remaining <= 1:
         # Send predictive alert if less than 24 hours remaining
-        if should_send_alert('critical', last_critical_alert_time):
-            send_predictive_alert(current_gallons, days_remaining)
-            last_critical_alert_time = datetime.now()
+        if should_send_alert('critical', device.last_critical_alert_time):
+            send_predictive_alert(device.device_id, current_gallons, days_remaining)
+            device.last_critical_alert_time = datetime.now()
+            alerts_fired.inc(type='predictive', severity='critical')
+            publish_alert('predictive', 'critical', current_data, days_remaining=days_remaining)
+        else:
+            alerts_suppressed.inc(rule='predictive')
 
-def send_predictive_alert(current_gallons, days_remaining):
+def send_predictive_alert(device_id, current_gallons, days_remaining):
     """Send predictive alert for low water estimate"""
     try:
         hours_remaining = days_remaining * 24
@@ -293,6 +651,7 @@ def send_predictive_alert(current_gallons, days_remaining):
             ),
             data={
                 'type': 'predictive',
+                'device_id': str(device_id),
                 'current_gallons': str(current_gallons),
                 'days_remaining': str(days_remaining),
                 'hours_remaining': str(hours_remaining),
@@ -301,8 +660,8 @@ def send_predictive_alert(current_gallons, days_remaining):
             topic='tank_alerts'
         )
         
-        response = messaging.send(message)
-        print(f"Predictive alert sent: {response}")
+        send_push(message)
+        logger.info('Predictive alert queued', extra={'device_id': device_id})
         
         # Email alert
         if ENABLE_EMAIL_ALERTS:
@@ -311,6 +670,7 @@ def send_predictive_alert(current_gallons, days_remaining):
 Well Tank Water Alert
 
 Current Status:
+- Tank: {device_id}
 - Water Level: {current_gallons:.0f} gallons
 - Estimated Time Remaining: {hours_remaining:.1f} hours ({days_remaining:.1f} days)
 
@@ -320,8 +680,8 @@ Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
             send_email_alert(subject, body)
         
-    except Exception as e:
-        print(f"Error sending predictive alert: {e}")
+    except Exception:
+        logger.exception('Error sending predictive alert')
 
 def send_enhanced_alert(current_data, previous_data, percent_change, severity, alert_type):
     """Send enhanced alert with severity-based messaging"""
@@ -340,14 +700,16 @@ def send_enhanced_alert(current_data, previous_data, percent_change, severity, a
         }
         
         titles = {
-            'rapid_drop': f"{icons[severity]} Rapid Water Level Drop",
-            'emergency_level': f"{icons['emergency']} EMERGENCY - Tank Nearly Empty",
-            'critical_level': f"{icons['critical']} CRITICAL - Very Low Water Level",
-            'low_level': f"{icons['low']} Low Water Level Warning",
-            'change': f"{icons['normal']} Water Level Change"
+            'rapid_drop': (severity, 'Rapid Water Level Drop'),
+            'emergency_level': ('emergency', 'EMERGENCY - Tank Nearly Empty'),
+            'critical_level': ('critical', 'CRITICAL - Very Low Water Level'),
+            'low_level': ('low', 'Low Water Level Warning'),
+            'change': ('normal', 'Water Level Change')
         }
         
-        title = titles.get(alert_type, f"{icons['normal']} Tank Alert")
+        # Rules may use any severity name; unknown ones get the normal icon
+        icon_name, text = titles.get(alert_type, ('normal', 'Tank Alert'))
+        title = f"{icons.get(icon_name, icons['normal'])} {text}"
         
         if current_percent > previous_percent:
             direction = "increased"
@@ -365,6 +727,7 @@ def send_enhanced_alert(current_data, previous_data, percent_change, severity, a
             data={
                 'type': alert_type,
                 'severity': severity,
+                'device_id': str(current_data.get('device_id', 'unknown')),
                 'current_level': str(current_percent),
                 'previous_level': str(previous_percent),
                 'change': str(percent_change),
@@ -374,8 +737,8 @@ def send_enhanced_alert(current_data, previous_data, percent_change, severity, a
             topic='tank_alerts'
         )
         
-        response = messaging.send(message)
-        print(f"Enhanced alert sent ({severity}): {response}")
+        send_push(message)
+        logger.info('Enhanced alert queued (%s)', severity)
         
         # Send email for critical/emergency alerts
         if severity in ['emergency', 'critical'] and ENABLE_EMAIL_ALERTS:
@@ -397,14 +760,13 @@ Please check your well tank immediately.
 """
             send_email_alert(subject, email_body)
         
-    except Exception as e:
-        print(f"Error sending enhanced alert: {e}")
+    except Exception:
+        logger.exception('Error sending enhanced alert')
 
-def store_enhanced_alert(current_data, previous_data, percent_change, severity, alert_type):
-    """Store enhanced alert data in Firebase Firestore"""
+def store_enhanced_alert(device, current_data, previous_data, percent_change, severity, alert_type):
+    """Store enhanced alert data in storage"""
     try:
         alert_data = {
-            'timestamp': firestore.SERVER_TIMESTAMP,
             'type': alert_type,
             'severity': severity,
             'current_level': current_data.get('fill_percentage', 0),
@@ -413,19 +775,19 @@ def store_enhanced_alert(current_data, previous_data, percent_change, severity,
             'current_gallons': current_data.get('gallons', 0),
             'previous_gallons': previous_data.get('gallons', 0),
             'device_id': current_data.get('device_id', 'unknown'),
-            'usage_rate': calculate_usage_rate()
+            'usage_rate': calculate_usage_rate(device)
         }
         
         # Add days remaining if available
-        days_remaining = calculate_days_remaining(current_data.get('gallons', 0))
+        days_remaining = calculate_days_remaining(device, current_data.get('gallons', 0))
         if days_remaining is not None:
             alert_data['days_remaining'] = days_remaining
         
-        db.collection('alerts').add(alert_data)
-        print(f"Enhanced alert stored in Firestore: {alert_type} - {severity}")
+        storage.append_alert(alert_data)
+        logger.info('Enhanced alert stored: %s - %s', alert_type, severity)
         
-    except Exception as e:
-        print(f"Error storing enhanced alert: {e}")
+    except Exception:
+        logger.exception('Error storing enhanced alert')
 
 def send_alert(current_data, previous_data, percent_change):
     """Send push notification via Firebase"""
@@ -455,17 +817,16 @@ def send_alert(current_data, previous_data, percent_change):
             topic='tank_alerts'  # You'll need to subscribe devices to this topic
         )
         
-        response = messaging.send(message)
-        print(f"Alert sent successfully: {response}")
+        send_push(message)
+        logger.info('Alert queued')
         
-    except Exception as e:
-        print(f"Error sending alert: {e}")
+    except Exception:
+        logger.exception('Error sending alert')
 
 def store_alert(current_data, previous_data, percent_change):
-    """Store alert in Firebase Firestore"""
+    """Store alert in storage"""
     try:
         alert_data = {
-            'timestamp': firestore.SERVER_TIMESTAMP,
             'current_level': current_data.get('fill_percentage', 0),
             'previous_level': previous_data.get('fill_percentage', 0),
             'percent_change': percent_change,
@@ -474,11 +835,82 @@ def store_alert(current_data, previous_data, percent_change):
             'device_id': current_data.get('device_id', 'unknown')
         }
         
-        db.collection('alerts').add(alert_data)
-        print("Alert stored in Firestore")
+        storage.append_alert(alert_data)
+        logger.info('Alert stored')
         
-    except Exception as e:
-        print(f"Error storing alert: {e}")
+    except Exception:
+        logger.exception('Error storing alert')
+
+def raise_leak_alert(device, leak):
+    """Notify, store and publish a leak found by the nightly check, unless one was raised recently"""
+    if not alerts_enabled:
+        return
+    now = datetime.now()
+    if device.last_leak_alert_time is not None and \
+            now - device.last_leak_alert_time < timedelta(hours=LEAK_COOLDOWN_HOURS):
+        alerts_suppressed.inc(rule='leak')
+        return
+    device.last_leak_alert_time = now
+    device.last_alert_time = now
+    alerts_fired.inc(type='leak', severity='normal')
+    send_leak_alert(device.device_id, leak)
+    store_leak_alert(device.device_id, leak)
+    publish_alert('leak', 'normal', device.last_reading or {'device_id': device.device_id},
+                  night_flow_gph=leak['night_flow_gph'], baseline_gph=leak['baseline_gph'])
+
+def send_leak_alert(device_id, leak):
+    """Send leak push notification via Firebase"""
+    try:
+        message = messaging.Message(
+            notification=messaging.Notification(
+                title='💧 Possible Leak',
+                body=f"Water use overnight was {leak['night_flow_gph']:.1f} gal/h, "
+                     f"usually {leak['baseline_gph']:.1f} gal/h"
+            ),
+            data={
+                'type': 'leak',
+                'device_id': str(device_id),
+                'night': leak['night'],
+                'night_flow_gph': str(leak['night_flow_gph']),
+                'baseline_gph': str(leak['baseline_gph']),
+                'timestamp': str(datetime.now().isoformat())
+            },
+            topic='tank_alerts'
+        )
+        
+        send_push(message)
+        logger.info('Leak alert queued', extra={'device_id': device_id})
+        
+        # Email alert
+        if ENABLE_EMAIL_ALERTS:
+            subject = f"Well Tank - Possible Leak ({leak['night_flow_gph']:.1f} gal/h overnight)"
+            body = f"""
+Well Tank Leak Alert
+
+- Tank: {device_id}
+- Average overnight use ({leak['night']}): {leak['night_flow_gph']:.1f} gallons/hour
+- Usual average overnight use: {leak['baseline_gph']:.1f} gallons/hour
+
+Water kept draining at night when none is normally used, for
+{LEAK_CONFIRM_NIGHTS} nights in a row. Check for running toilets, dripping
+taps and leaking pipes.
+
+Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+"""
+            send_email_alert(subject, body)
+        
+    except Exception:
+        logger.exception('Error sending leak alert')
+
+def store_leak_alert(device_id, leak):
+    """Store leak alert in storage"""
+    try:
+        alert_data = dict(leak, type='leak', severity='normal', device_id=device_id)
+        del alert_data['leak']
+        storage.append_alert(alert_data)
+        logger.info('Leak alert stored: %.2f gal/h', leak['night_flow_gph'])
+    except Exception:
+        logger.exception('Error storing leak alert')
 
 def send_battery_alert(current_data, battery_voltage):
     """Send battery low push notification via Firebase"""
@@ -489,6 +921,7 @@ def send_battery_alert(current_data, battery_voltage):
                 body=f'Well sensor battery is low: {battery_voltage:.1f}V. Please check power source.'
             ),
             data={
+                'device_id': str(current_data.get('device_id', 'unknown')),
                 'battery_voltage': str(battery_voltage),
                 'gallons': str(current_data.get('gallons', 0)),
                 'timestamp': str(datetime.now().isoformat())
@@ -496,16 +929,15 @@ def send_battery_alert(current_data, battery_voltage):
             topic='tank_alerts'
         )
         
-        response = messaging.send(message)
-        print(f'Battery alert sent: {response}')
-    except Exception as e:
-        print(f'Error sending battery alert: {e}')
+        send_push(message)
+        logger.info('Battery alert queued')
+    except Exception:
+        logger.exception('Error sending battery alert')
 
 def store_battery_alert(current_data, battery_voltage):
-    """Store battery alert in Firebase Firestore"""
+    """Store battery alert in storage"""
     try:
         alert_data = {
-            'timestamp': firestore.SERVER_TIMESTAMP,
             'type': 'low_battery',
             'battery_voltage': battery_voltage,
             'gallons': current_data.get('gallons', 0),
@@ -513,53 +945,355 @@ def store_battery_alert(current_data, battery_voltage):
             'device_id': current_data.get('device_id', 'unknown')
         }
         
-        db.collection('alerts').add(alert_data)
-        print(f"Battery alert stored in Firestore: {battery_voltage:.1f}V")
-    except Exception as e:
-        print(f"Error storing battery alert: {e}")
+        storage.append_alert(alert_data)
+        logger.info('Battery alert stored: %.1fV', battery_voltage)
+    except Exception:
+        logger.exception('Error storing battery alert')
 
-def store_reading(data):
-    """Store sensor reading in Firebase Firestore"""
-    if not firebase_initialized:
-        return
+def store_reading(data, ts=None):
+    """Store one sensor reading"""
+    store_readings([(ts, data)])
+
+def store_readings(timestamped_readings):
+    """Store (ts, reading) pairs in one write
     
+    A ts of None means the reading was taken just now.
+    """
+    now = time.time()
     try:
-        reading_data = {
-            'timestamp': firestore.SERVER_TIMESTAMP,
-            'distance_cm': data.get('distance_cm', 0),
-            'water_level_cm': data.get('water_level_cm', 0),
-            'gallons': data.get('gallons', 0),
-            'fill_percentage': data.get('fill_percentage', 0),
-            'battery_voltage': data.get('battery_voltage', 0),
-            'wifi_rssi': data.get('wifi_rssi', 0),
-            'device_id': data.get('device_id', 'unknown')
-        }
-        
-        db.collection('readings').add(reading_data)
-        
-    except Exception as e:
-        print(f"Error storing reading: {e}")
+        storage.append_many([(ts if ts is not None else now, data) for ts, data in timestamped_readings])
+    except Exception:
+        logger.exception('Error storing %d readings', len(timestamped_readings))
 
-def scheduled_reading():
-    """Scheduled function to fetch and process sensor data"""
-    global last_reading
+def flush_held_readings(before=None):
+    """Write readings the compressor is holding back, those taken before `before` if given"""
+    if not isinstance(storage, (CompressedStorage, MirroredStorage)):
+        return
+    try:
+        storage.flush_held(before)
+    except Exception:
+        logger.exception('Error writing held readings')
+
+def store_events(events):
+    """Store closed refill, draw and idle events"""
+    if not events:
+        return
+    try:
+        storage.append_events(events)
+    except Exception:
+        logger.exception('Error storing %d events', len(events))
+
+def clean_reading(device, data, ts):
+    """Pass a reading through the device's filter; None if it is rejected as a glitch
+    
+    Returns the smoothed reading, for display and forecasting. Alert checks
+    and storage keep using the accepted raw reading, since smoothing would
+    shrink a real step in the level below the drop thresholds.
+    """
+    if device.reading_filter is None:
+        return data
+    cleaned = device.reading_filter.update(data, ts)
+    if cleaned is None:
+        readings_dropped.inc(reason='outlier')
+        logger.info('Rejected outlier reading: %s%% at %s cm', data.get('fill_percentage'),
+                    data.get('distance_cm'), extra={'event': 'outlier', 'device_id': device.device_id})
+    return cleaned
+
+def process_reading(data):
+    """Filter a polled reading, run alert checks, store it and make it the device's latest one
+    
+    A device that pushes its readings also pushes this one from its
+    buffer, so the polled copy is only shown, not ingested twice.
+    """
+    device = devices.get(data.get('device_id', 'unknown'))
     
-    data = get_esp32_data()
-    if data:
-        # Check for alerts
-        if last_reading:
-            check_for_alerts(data, last_reading)
+    with device.lock:
+        now = time.time()
+        if device.last_pushed_time is not None:
+            device.show_reading(data, now)
+            publish_event('reading', data)
+            return
+        raw = data
+        data = clean_reading(device, raw, now)
+        if data is None:
+            return
+        
+        # Update usage estimates before alert checks so they see this reading
+        device.usage_estimator.add(data.get('gallons', 0), now)
+        forecaster.add(device.device_id, now, data.get('gallons'))
+        closed_events = segmenter.add(device.device_id, now, data.get('gallons'))
+        
+        # Check for alerts on the raw levels
+        if device.last_raw_reading:
+            check_for_alerts(device, raw, device.last_raw_reading, now)
         
         # Store reading
-        store_reading(data)
+        store_reading(raw, now)
         
         # Update last reading
-        last_reading = data
-        
-        print(f"Scheduled reading completed: {data.get('fill_percentage', 0):.1f}%")
+        device.update_reading(data, now, raw)
+    
+    store_events(closed_events)
+    readings_ingested.inc(device_id=device.device_id)
+    publish_event('reading', data)
+
+def process_batch(timestamped_readings):
+    """Ingest a time-ordered list of [ts, reading] pairs as one batch
+    
+    Readings are filtered, then each accepted raw reading is compared with
+    the one before it from the same device and the alert rules run over the whole batch in
+    one pass, in reading time, so cooldowns stop a catch-up upload from
+    raising the same alert for every reading. Readings older than the
+    newest one the device pushed before are stored unfiltered but not
+    alert-checked, and rejected glitches are dropped. Everything is written
+    in one transaction and only the newest reading per device is published
+    to live clients.
+    """
+    by_device = {}
+    for ts, data in timestamped_readings:
+        by_device.setdefault(data.get('device_id', 'unknown'), []).append((ts, data))
+    
+    rows = []
+    latest = []
+    to_store = []
+    closed_events = []
+    for device_id, readings in by_device.items():
+        device = devices.get(device_id)
+        newest = None
+        accepted = 0
+        with device.lock:
+            for ts, data in readings:
+                # Polls set the shown reading's time, so only pushed readings say what is stale
+                if device.last_pushed_time is not None and ts < device.last_pushed_time:
+                    readings_dropped.inc(reason='stale')
+                    to_store.append((ts, data))
+                    continue
+                raw = data
+                data = clean_reading(device, raw, ts)
+                if data is None:
+                    continue
+                device.last_pushed_time = ts
+                to_store.append((ts, raw))
+                device.usage_estimator.add(data.get('gallons', 0), ts)
+                forecaster.add(device_id, ts, data.get('gallons'))
+                closed_events.extend(segmenter.add(device_id, ts, data.get('gallons')))
+                if device.last_raw_reading:
+                    rows.append((device, ts, raw, device.last_raw_reading))
+                device.update_reading(data, ts, raw)
+                newest = data
+                accepted += 1
+        if newest is not None:
+            latest.append((device, newest))
+        if accepted:
+            readings_ingested.inc(accepted, device_id=device_id)
+    
+    evaluate_alerts(rows)
+    for device, data in latest:
+        check_predictive_alerts(device, data)
+    
+    store_readings(to_store)
+    store_events(closed_events)
+    
+    for _, data in latest:
+        publish_event('reading', data)
+    return {'stored': len(to_store), 'devices': len(by_device)}
+
+def get_state_snapshot(device_id=None):
+    """Return the leader's view of a device's state for other workers
+    
+    Without a device_id, describes the device that reported most recently.
+    """
+    device = devices.find(device_id) if device_id is not None else devices.latest()
+    last_reading = device.last_reading if device else None
+    last_alert_time = device.last_alert_time if device else None
+    current_gallons = last_reading.get('gallons', 0) if last_reading else 0
+    return {
+        'device_id': device.device_id if device else device_id,
+        'last_reading': last_reading,
+        'last_reading_time': device.last_reading_time if device else None,
+        'compression': compressor.stats(),
+        'write_queue': write_queue.stats() if write_queue else None,
+        'notifications': notifier.stats(),
+        'spool': dict(spool.stats(), replayed=spool_replayer.replayed),
+        'poller': poller.status(),
+        'last_alert_time': last_alert_time.isoformat() if last_alert_time else None,
+        'alerts_enabled': alerts_enabled,
+        'usage_rate': calculate_usage_rate(device) if device else 0,
+        'days_remaining': calculate_days_remaining(device, current_gallons) if device else None,
+        'forecast': forecaster.forecast(device.device_id, current_gallons) if device else None,
+        'current_event': segmenter.current(device.device_id) if device else None,
+        'leak_check': leak_checks.get(device.device_id) if device else None
+    }
+
+def run_force_reading(endpoint):
+    """Take a fresh reading on one ESP32 and ingest it (runs as a job)"""
+    # /reading measures synchronously, then redirects to /status, so the
+    # response already carries the new reading
+    data = poller.fetch(endpoint, '/reading')
+    if not data:
+        raise RuntimeError(f'Failed to get updated reading from {endpoint}')
+    process_reading(data)
+    return data
+
+def start_force_reading(endpoint):
+    """Queue a forced reading for endpoint, joining one already in flight"""
+    if endpoint not in ESP32_ENDPOINTS:
+        raise ValueError(f"Unknown ESP32 endpoint: {endpoint}")
+    job, coalesced = force_reading_jobs.submit(endpoint, run_force_reading, endpoint)
+    job['coalesced'] = coalesced
+    return job
+
+def list_devices():
+    """Summarize every known device for the /devices endpoint"""
+    summaries = []
+    for device in devices:
+        reading = device.last_reading or {}
+        summaries.append({
+            'device_id': device.device_id,
+            'last_seen': datetime.fromtimestamp(device.last_reading_time).isoformat() if device.last_reading_time else None,
+            'gallons': reading.get('gallons'),
+            'fill_percentage': reading.get('fill_percentage'),
+            'usage_rate': calculate_usage_rate(device),
+            'rejected_readings': device.reading_filter.rejected if device.reading_filter else 0
+        })
+    return summaries
+
+def set_alerts_enabled(enabled):
+    """Enable or disable alerts, toggling when enabled is None"""
+    global alerts_enabled
+    
+    alerts_enabled = (not alerts_enabled) if enabled is None else bool(enabled)
+    publish_event('status', {'alerts_enabled': alerts_enabled})
+    return alerts_enabled
+
+def scheduled_reading():
+    """Scheduled function to fetch and process data from every sensor"""
+    start = time.monotonic()
+    count = 0
+    for endpoint, data in poller.poll_all():
+        try:
+            process_reading(data)
+            count += 1
+        except Exception:
+            logger.exception('Error processing reading from %s', endpoint)
+    
+    elapsed = time.monotonic() - start
+    logger.info('Scheduled reading completed: %d/%d devices in %.1fs', count, len(ESP32_ENDPOINTS), elapsed,
+                extra={'event': 'poll', 'devices': count, 'duration_ms': round(elapsed * 1000)})
+
+def prune_storage():
+    """Drop readings and alerts past their retention period"""
+    try:
+        storage.prune()
+    except Exception:
+        logger.exception('Error pruning stored readings')
+
+def rebuild_forecasts():
+    """Load the saved usage profiles and catch them up with readings stored since
+    
+    Without a saved file, profiles are built from the last FORECAST_HISTORY_DAYS
+    of stored readings. Live readings keep updating the profiles meanwhile.
+    """
+    started = time.monotonic()
+    rebuilt = new_forecaster()
+    try:
+        saved = rebuilt.load(FORECAST_FILE)
+        last = [ts for ts in rebuilt.last_timestamps().values() if ts is not None]
+        start = min(last) if saved and last else time.time() - FORECAST_HISTORY_DAYS * 86400
+        count = 0
+        for row in storage.iter_raw(start=start):
+            rebuilt.add(row['device_id'], row['ts'], row['gallons'])
+            count += 1
+        forecaster.adopt(rebuilt)
+        logger.info('Usage profiles rebuilt from %d stored readings in %.1fs', count, time.monotonic() - started)
+    except Exception:
+        logger.exception('Error rebuilding usage profiles')
+
+def save_forecasts():
+    """Save the leader's usage profiles so a restart does not rebuild them from scratch"""
+    if not coordinator.is_leader:
+        return
+    try:
+        forecaster.save(FORECAST_FILE)
+    except Exception:
+        logger.exception('Error saving usage profiles')
+
+def rebuild_segments():
+    """Load the open events and segment the readings stored since
+    
+    Without a saved file, every stored reading is segmented. Each device's
+    history goes through in one vectorized pass; live readings wait and are
+    applied on top once it is done.
+    """
+    started = time.monotonic()
+    rebuilt = new_segmenter()
+    try:
+        saved = rebuilt.load(SEGMENTS_FILE)
+        last = list(rebuilt.last_timestamps().values())
+        start = min(last) if saved and last else None
+        count = 0
+        for device_id, rows in itertools.groupby(storage.iter_raw(start=start), key=lambda row: row['device_id']):
+            timestamps = []
+            gallons = []
+            for row in rows:
+                timestamps.append(row['ts'])
+                gallons.append(row['gallons'])
+            count += len(timestamps)
+            store_events(rebuilt.backfill(device_id, timestamps, gallons))
+        logger.info('Pump events rebuilt from %d stored readings in %.1fs', count, time.monotonic() - started)
+    except Exception:
+        logger.exception('Error rebuilding pump events')
+    finally:
+        store_events(segmenter.adopt(rebuilt))
+
+def save_segments():
+    """Save the leader's open events so a restart only segments newer readings"""
+    if not coordinator.is_leader:
+        return
+    try:
+        segmenter.save(SEGMENTS_FILE)
+    except Exception:
+        logger.exception('Error saving pump events')
+
+# The leak check reads hourly rollups; other backends would bucket every
+# raw reading in its window, which on Firestore means reading each document
+leak_detection = LEAK_DETECTION and storage.rollups
+if LEAK_DETECTION and not leak_detection:
+    logger.warning('LEAK_DETECTION needs STORAGE_BACKEND=sqlite for its hourly rollups; leak checks are off')
+
+def check_leaks():
+    """Compare each device's minimum night flow with its baseline and raise leak alerts
+    
+    Reads one device's hourly buckets at a time, never raw readings.
+    """
+    start, end, points = leak_detector.window()
+    for device in devices:
+        try:
+            _, buckets = storage.query_buckets(start, end, points, device.device_id)
+            result = leak_detector.check(buckets)
+        except Exception:
+            logger.exception('Error checking for leaks')
+            continue
+        if result is None:
+            continue
+        leak_checks[device.device_id] = result
+        logger.info('Night flow %.2f gal/h, baseline %.2f gal/h', result['night_flow_gph'], result['baseline_gph'],
+                    extra={'event': 'leak_check', 'device_id': device.device_id, 'leak': result['leak']})
+        if result['leak']:
+            raise_leak_alert(device, result)
 
 # Schedule readings every 5 minutes
 schedule.every(5).minutes.do(scheduled_reading)
+schedule.every().day.at('03:00').do(prune_storage)
+if leak_detection:
+    schedule.every().day.at(LEAK_CHECK_TIME).do(check_leaks)
+# A sensor that stops reporting still gets its last reading written to Firestore
+schedule.every(5).minutes.do(lambda: flush_held_readings(time.time() - COMPRESSION_MAX_GAP_SECONDS))
+atexit.register(flush_held_readings)
+schedule.every().hour.do(save_forecasts)
+atexit.register(save_forecasts)
+schedule.every().hour.do(save_segments)
+atexit.register(save_segments)
 
 def run_scheduler():
     """Run the scheduler in a separate thread"""
@@ -567,172 +1301,438 @@ def run_scheduler():
         schedule.run_pending()
         time.sleep(60)
 
-# Start scheduler thread
-scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-scheduler_thread.start()
+def leader_events(follower_pid):
+    """Stream this leader's events to a follower worker"""
+    if follower_pid == os.getpid():
+        # Our own relay raced the election; the leader publishes directly
+        return iter(())
+    return events.listen(heartbeat_seconds=SSE_HEARTBEAT_SECONDS)
+
+def relay_leader_events():
+    """Forward the leader's events to this worker's /stream subscribers"""
+    while not coordinator.is_leader:
+        try:
+            for event in coordinator.stream('events', os.getpid()):
+                # None is the leader's heartbeat
+                if event is not None:
+                    response_cache.clear()
+                    events.publish(event)
+        except CoordinatorUnavailable:
+            pass
+        time.sleep(LEADER_RETRY_SECONDS)
+
+def start_scheduler():
+    """Start the leader's background work; only the elected leader polls the sensor"""
+    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread.start()
+    threading.Thread(target=rebuild_forecasts, daemon=True).start()
+    threading.Thread(target=rebuild_segments, daemon=True).start()
+    
+    # Drain anything spooled while Firestore was unreachable, even if
+    # Firebase is not up yet
+    spool_replayer.start()
+
+# Elect a single leader across gunicorn workers. The leader polls the ESP32,
+# runs alert checks and owns the shared state; other workers forward to it.
+coordinator = Coordinator(RUN_DIR, retry_interval=LEADER_RETRY_SECONDS)
+coordinator.register('ingest', process_reading)
+coordinator.register('ingest_batch', process_batch)
+coordinator.register('snapshot', get_state_snapshot)
+coordinator.register('devices', list_devices)
+coordinator.register('force_reading', start_force_reading)
+coordinator.register('force_reading_status', force_reading_jobs.get)
+coordinator.register('set_alerts_enabled', set_alerts_enabled)
+coordinator.register('storage', lambda method, *args: query_storage_local(method, *args))
+coordinator.register_stream('events', lambda follower_pid: leader_events(follower_pid))
+coordinator.on_elected(start_scheduler)
+coordinator.start()
+
+threading.Thread(target=relay_leader_events, daemon=True).start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def observe_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        request_seconds.observe(time.monotonic() - started,
+                                endpoint=request.endpoint or 'unmatched', method=request.method)
+    return response
+
+def cached_response(view):
+    """Serve a read endpoint from the response cache with ETag/304 support"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.full_path
+        cached = response_cache.get(key)
+        if cached:
+            body, etag, mimetype = cached
+            response = app.response_class(body, mimetype=mimetype)
+        else:
+            generation = response_cache.generation
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            etag = response_cache.set(key, response.get_data(), response.mimetype, generation)
+        
+        response.set_etag(etag)
+        # Clients may keep the body but must revalidate it on every use
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    return wrapper
+
+def query_storage_local(method, *args):
+    """Run one of STORAGE_QUERIES against this process's storage"""
+    if method not in STORAGE_QUERIES:
+        raise ValueError(f"Unknown storage query: {method}")
+    return getattr(storage, method)(*args)
+
+def query_storage(method, *args):
+    """Run a storage query here, or on the leader when storage is in its memory"""
+    if storage.shared:
+        return query_storage_local(method, *args)
+    return coordinator.call_or_local('storage', method, *args)
+
+def get_shared_state(device_id=None):
+    """Fetch shared state from the leader, or from this process if none"""
+    return coordinator.call_or_local('snapshot', device_id)
 
 @app.route('/')
 def health_check():
     """Health check endpoint"""
+    state = get_shared_state()
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'firebase_connected': firebase_initialized
+        'firebase_connected': firebase_initialized,
+        'storage': STORAGE_BACKEND,
+        'write_queue': state['write_queue'],
+        'compression': state['compression'],
+        'notifications': state['notifications'],
+        'spool': state['spool'],
+        'poller': state['poller']
     })
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics, merged across all workers"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/current')
+@cached_response
 def get_current_reading():
-    """Get current sensor reading"""
-    global last_reading
+    """Get current sensor reading, optionally for one device_id"""
+    device_id = request.args.get('device_id')
+    reading = get_shared_state(device_id)['last_reading']
     
-    if not last_reading:
+    if not reading and device_id:
+        return jsonify({'error': f'No sensor data available for {device_id}'}), 404
+    
+    if not reading:
         # Try to fetch fresh data if none available
-        data = get_esp32_data()
-        if data:
-            last_reading = data
-            store_reading(data)
+        reading = get_esp32_data()
+        if reading:
+            coordinator.call_or_local('ingest', reading)
         else:
             return jsonify({'error': 'No sensor data available'}), 404
     
-    return jsonify(last_reading)
+    return jsonify(reading)
+
+def parse_time_param(value):
+    """Parse a query parameter given as epoch seconds or ISO 8601"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+@app.route('/stream')
+def stream_events():
+    """Server-Sent Events stream of new readings and alerts (?device_id= to filter)"""
+    device_id = request.args.get('device_id')
+    subscriber = events.subscribe()
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                if event['type'] not in STREAM_EVENT_TYPES:
+                    continue
+                if device_id and event['data'].get('device_id') != device_id:
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            events.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/history')
+@cached_response
 def get_history():
-    """Get historical readings from Firebase"""
-    if not firebase_initialized:
-        # Return empty list if Firebase not connected
-        return jsonify([])
+    """Get historical readings from storage
+    
+    With from/to/points, returns a fixed number of evenly spaced buckets
+    aggregated server-side; without them, the latest raw readings. Without
+    a device_id, reads the device that reported most recently, like /current.
+    """
+    # Readings from different tanks do not add up to one series
+    device_id = request.args.get('device_id') or get_shared_state()['device_id']
+    if any(param in request.args for param in ('from', 'to', 'points')):
+        return get_bucketed_history(device_id)
+    
+    # Get last 24 hours of readings
+    yesterday = datetime.now() - timedelta(days=1)
     
     try:
-        # Get last 24 hours of readings
-        yesterday = datetime.now() - timedelta(days=1)
-        
-        readings = db.collection('readings')\
-            .where('timestamp', '>=', yesterday)\
-            .order_by('timestamp', direction=firestore.Query.DESCENDING)\
-            .limit(100)\
-            .stream()
-        
-        history = []
-        for reading in readings:
-            data = reading.to_dict()
-            data['id'] = reading.id
-            history.append(data)
-        
-        return jsonify(history)
-        
-    except Exception as e:
-        print(f"Firebase error: {e}")
-        # Return empty list on error
-        return jsonify([])
+        readings = query_storage('query_raw', device_id, yesterday.timestamp(), None, 100, True)
+    except Exception:
+        logger.exception('History error')
+        readings = []
+    
+    for reading in readings:
+        reading['timestamp'] = datetime.fromtimestamp(reading.pop('ts')).isoformat()
+    return jsonify(readings)
+
+def history_end_points(device_id, start, end):
+    """The last stored reading before start and the device's current one, for interpolation"""
+    if device_id is None:
+        return []
+    points = [(row['ts'], row) for row in
+              query_storage('query_raw', device_id, start - COMPRESSION_MAX_GAP_SECONDS, start, 1, True)]
+    state = get_shared_state(device_id)
+    current_ts = state['last_reading_time']
+    if state['last_reading'] and current_ts is not None and current_ts < end + COMPRESSION_MAX_GAP_SECONDS:
+        points.append((current_ts, state['last_reading']))
+    return points
+
+def get_bucketed_history(device_id=None):
+    """Downsample [from, to) into `points` buckets of min/max/mean/last"""
+    try:
+        end = parse_time_param(request.args['to']) if 'to' in request.args else time.time()
+        start = parse_time_param(request.args['from']) if 'from' in request.args else end - 86400
+        points = int(request.args.get('points', HISTORY_DEFAULT_POINTS))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid history parameters: {e}'}), 400
+    
+    if start >= end:
+        return jsonify({'error': "'from' must be before 'to'"}), 400
+    points = max(1, min(points, HISTORY_MAX_POINTS))
+    
+    try:
+        source, buckets = query_storage('query_buckets', start, end, points, device_id)
+    except Exception:
+        logger.exception('History error')
+        return jsonify({'error': 'History unavailable'}), 500
+    
+    if isinstance(storage, CompressedStorage):
+        try:
+            interpolate_buckets(buckets, (end - start) / points, history_end_points(device_id, start, end),
+                                max_gap_seconds=COMPRESSION_MAX_GAP_SECONDS)
+        except Exception:
+            logger.exception('History interpolation error')
+    
+    for bucket in buckets:
+        bucket['timestamp'] = datetime.fromtimestamp(bucket.pop('ts')).isoformat()
+    
+    return jsonify({
+        'device_id': device_id,
+        'from': datetime.fromtimestamp(start).isoformat(),
+        'to': datetime.fromtimestamp(end).isoformat(),
+        'points': points,
+        'bucket_seconds': (end - start) / points,
+        'source': source,
+        'buckets': buckets
+    })
 
 @app.route('/alerts')
+@cached_response
 def get_alerts():
-    """Get recent alerts"""
-    if not firebase_initialized:
-        # Return empty list if Firebase not connected
-        return jsonify([])
-    
+    """Get the last 7 days of alerts, optionally for one device_id"""
+    week_ago = time.time() - 7 * 86400
     try:
-        # Get last 7 days of alerts
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        alerts = db.collection('alerts')\
-            .where('timestamp', '>=', week_ago)\
-            .order_by('timestamp', direction=firestore.Query.DESCENDING)\
-            .limit(50)\
-            .stream()
-        
-        alert_list = []
-        for alert in alerts:
-            data = alert.to_dict()
-            data['id'] = alert.id
-            alert_list.append(data)
-        
-        return jsonify(alert_list)
-        
-    except Exception as e:
-        print(f"Firebase error: {e}")
+        alerts = query_storage('query_alerts', request.args.get('device_id'), week_ago, None, 50)
+    except Exception:
+        logger.exception('Alerts error')
         # Return empty list on error
         return jsonify([])
+    
+    for alert in alerts:
+        alert['timestamp'] = datetime.fromtimestamp(alert.pop('ts')).isoformat()
+    return jsonify(alerts)
+
+@app.route('/events')
+@cached_response
+def get_events():
+    """Refill, draw and idle events newest first, with totals and the event in progress
+    
+    Covers [from, to), the last 7 days by default. `kind` narrows the list
+    but not the totals.
+    """
+    device_id = request.args.get('device_id')
+    kind = request.args.get('kind')
+    try:
+        end = parse_time_param(request.args['to']) if 'to' in request.args else time.time()
+        start = parse_time_param(request.args['from']) if 'from' in request.args else end - 7 * 86400
+        limit = int(request.args.get('limit', EVENTS_DEFAULT_LIMIT))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid event parameters: {e}'}), 400
+    if kind is not None and kind not in EVENT_KINDS:
+        return jsonify({'error': f"'kind' must be one of {', '.join(EVENT_KINDS)}"}), 400
+    if start >= end:
+        return jsonify({'error': "'from' must be before 'to'"}), 400
+    limit = max(1, min(limit, EVENTS_MAX_LIMIT))
+    
+    try:
+        events = query_storage('query_events', device_id, start, end, None, None)
+        current = get_shared_state(device_id)['current_event'] if device_id else None
+    except Exception:
+        logger.exception('Events error')
+        return jsonify({'error': 'Events unavailable'}), 500
+    
+    summary = summarize_events(events)
+    if kind is not None:
+        events = [event for event in events if event['kind'] == kind]
+    events = events[:limit]
+    for event in events + ([current] if current else []):
+        event['start'] = datetime.fromtimestamp(event['start']).isoformat()
+        event['end'] = datetime.fromtimestamp(event['end']).isoformat()
+    
+    return jsonify({
+        'device_id': device_id,
+        'from': datetime.fromtimestamp(start).isoformat(),
+        'to': datetime.fromtimestamp(end).isoformat(),
+        'summary': summary,
+        'current': current,
+        'events': events
+    })
+
+@app.route('/devices')
+@cached_response
+def get_devices():
+    """List every device that has reported, with its latest level"""
+    return jsonify(coordinator.call_or_local('devices'))
 
 @app.route('/force-reading')
 def force_reading():
-    """Force a new reading from ESP32"""
-    try:
-        # Trigger new reading on ESP32
-        url = f"http://{ESP32_IP}:{ESP32_PORT}/reading"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        # Wait a moment for the reading to complete
-        time.sleep(2)
-        
-        # Get the updated data
-        data = get_esp32_data()
-        if data:
-            global last_reading
-            if last_reading:
-                check_for_alerts(data, last_reading)
-            store_reading(data)
-            last_reading = data
-            
-            return jsonify({
-                'success': True,
-                'data': data
-            })
-        else:
-            return jsonify({'error': 'Failed to get updated reading'}), 500
-            
-    except requests.exceptions.RequestException as e:
-        return jsonify({'error': f'Failed to trigger reading: {str(e)}'}), 500
+    """Start a new reading on an ESP32 (?endpoint=host:port, default the first)
+    
+    Only endpoints from ESP32_DEVICES are accepted. Returns a job id
+    straight away; poll /force-reading/<job_id> for the result. Clicks
+    while a reading is in flight join the same job.
+    """
+    requested = parse_endpoints(request.args.get('endpoint'), ESP32_PORT)
+    endpoint = requested[0] if requested else (ESP32_ENDPOINTS[0] if ESP32_ENDPOINTS else None)
+    if endpoint not in ESP32_ENDPOINTS:
+        return jsonify({'error': 'Unknown ESP32 endpoint; expected one of ESP32_DEVICES'}), 400
+    
+    try:
+        job = coordinator.call_or_local('force_reading', endpoint)
+    except Exception as e:
+        return jsonify({'error': f'Failed to start reading: {str(e)}'}), 500
+    
+    response = jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'coalesced': job['coalesced']
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/force-reading/{job['id']}"
+    return response
+
+@app.route('/force-reading/<job_id>')
+def force_reading_status(job_id):
+    """Get the status, and once finished the result, of a forced reading"""
+    job = coordinator.call_or_local('force_reading_status', job_id)
+    if not job:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    return jsonify({
+        'job_id': job['id'],
+        'endpoint': job['key'],
+        'status': job['status'],
+        'success': job['status'] == 'succeeded',
+        'data': job['result'],
+        'error': job['error']
+    })
 
 @app.route('/tank-data', methods=['POST'])
 def receive_tank_data():
-    """Receive tank data from ESP32"""
-    global last_reading
+    """Receive one reading, or a batch of buffered readings, from an ESP32
     
+    The body may be JSON or CBOR (Content-Type: application/cbor) and may
+    be gzip compressed (Content-Encoding: gzip).
+    """
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'No JSON data received'}), 400
-        
-        # Validate required fields
-        required_fields = ['device_id', 'distance_cm', 'water_level_cm', 'gallons', 'fill_percentage']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        payload = decode_body(request.get_data(), request.mimetype,
+                              request.headers.get('Content-Encoding'), MAX_TANK_DATA_BYTES)
         
-        # Check for alerts
-        if last_reading:
-            check_for_alerts(data, last_reading)
+        # A single reading keeps the original request and response
+        if isinstance(payload, dict) and 'readings' not in payload:
+            accepted, rejected = normalize_batch(payload)
+            if rejected:
+                readings_dropped.inc(reason='invalid')
+                return jsonify({'error': rejected[0]['error']}), 400
+            
+            # A pushed reading, so it is ingested as a batch of one on the
+            # leader; the ingest handler is for polled readings
+            coordinator.call_or_local('ingest_batch', accepted)
+            
+            logger.info('Received tank data: %.1f%%', payload.get('fill_percentage', 0),
+                        extra={'event': 'reading', 'device_id': payload.get('device_id', 'unknown')})
+            
+            return jsonify({
+                'success': True,
+                'message': 'Data received successfully'
+            })
         
-        # Store reading
-        store_reading(data)
+        accepted, rejected = normalize_batch(payload, max_readings=MAX_BATCH_READINGS)
+        if rejected:
+            readings_dropped.inc(len(rejected), reason='invalid')
+        if not accepted:
+            return jsonify({'error': rejected[0]['error'], 'rejected': rejected}), 400
         
-        # Update last reading
-        last_reading = data
+        # Alert checks and storage for the whole batch run on the leader
+        result = coordinator.call_or_local('ingest_batch', accepted)
         
-        print(f"Received tank data: {data.get('fill_percentage', 0):.1f}%")
+        logger.info('Received batch of %d readings from %d device(s), %d rejected',
+                    len(accepted), result['devices'], len(rejected),
+                    extra={'event': 'batch', 'accepted': len(accepted), 'rejected': len(rejected)})
         
         return jsonify({
             'success': True,
-            'message': 'Data received successfully'
+            'message': 'Batch received successfully',
+            'accepted': len(accepted),
+            'rejected': rejected
         })
         
+    except PayloadError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
-        print(f"Error processing tank data: {e}")
+        logger.exception('Error processing tank data')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/config')
+@cached_response
 def get_config():
-    """Get current configuration"""
-    current_gallons = last_reading.get('gallons', 0) if last_reading else 0
-    usage_rate = calculate_usage_rate()
-    days_remaining = calculate_days_remaining(current_gallons)
+    """Get current configuration and usage stats, optionally for one device_id"""
+    state = get_shared_state(request.args.get('device_id'))
+    usage_rate = state['usage_rate']
+    days_remaining = state['days_remaining']
     
     return jsonify({
         'esp32_ip': ESP32_IP,
+        'esp32_endpoints': ESP32_ENDPOINTS,
         'alert_threshold': ALERT_THRESHOLD,
         'alert_cooldown': ALERT_COOLDOWN,
         'firebase_connected': firebase_initialized,
@@ -741,11 +1741,15 @@ def get_config():
             'critical_level_threshold': CRITICAL_LEVEL_THRESHOLD,
             'emergency_level_threshold': EMERGENCY_LEVEL_THRESHOLD,
             'rapid_drop_threshold': RAPID_DROP_THRESHOLD,
+            'leak_detection_enabled': leak_detection,
             'email_alerts_enabled': ENABLE_EMAIL_ALERTS
         },
         'usage_stats': {
+            'device_id': state['device_id'],
             'current_usage_rate_gph': usage_rate,
-            'days_remaining': days_remaining
+            'days_remaining': days_remaining,
+            'forecast': state['forecast'],
+            'leak_check': state['leak_check']
         }
     })
 
@@ -780,7 +1784,7 @@ def test_push_notification():
         })
         
     except Exception as e:
-        print(f"Error sending test push notification: {e}")
+        logger.exception('Error sending test push notification')
         return jsonify({'error': f'Failed to send test notification: {str(e)}'}), 500
 
 @app.route('/test-email', methods=['POST'])
@@ -793,6 +1797,7 @@ def test_email():
         return jsonify({'error': 'No alert email configured'}), 400
     
     try:
+        reading = get_shared_state()['last_reading'] or {}
         subject = 'Test Alert - Well Tank Monitor'
         body = f"""
 Test Email Alert
@@ -801,7 +1806,7 @@ This is a test email from your well tank monitoring system.
 
 Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 System Status: Operational
-Current Water Level: {last_reading.get('fill_percentage', 0):.1f}% (if available)
+Current Water Level: {reading.get('fill_percentage', 0):.1f}% (if available)
 
 This email confirms that your email alert system is working correctly.
 
@@ -809,29 +1814,33 @@ This email confirms that your email alert system is working correctly.
 Well Tank Monitor System
         """
         
-        success = send_email_alert(subject, body)
+        delivery = send_email_alert(subject, body)
+        if delivery is None:
+            return jsonify({'error': 'Email credentials are not configured'}), 400
         
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'Test email sent successfully'
-            })
-        else:
-            return jsonify({'error': 'Failed to send test email'}), 500
+        # Wait for delivery through the same pooled connection alerts use
+        delivery.result(timeout=120)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Test email sent successfully'
+        })
             
     except Exception as e:
-        print(f"Error sending test email: {e}")
+        logger.exception('Error sending test email')
         return jsonify({'error': f'Failed to send test email: {str(e)}'}), 500
 
 @app.route('/alerts/status', methods=['GET'])
+@cached_response
 def get_alerts_status():
-    """Get current alert system status"""
-    print(f"Alert status endpoint called. Alerts enabled: {alerts_enabled}")
+    """Get current alert system status, optionally for one device_id"""
+    state = get_shared_state(request.args.get('device_id'))
+    logger.debug('Alert status endpoint called. Alerts enabled: %s', state['alerts_enabled'])
     return jsonify({
-        'alerts_enabled': alerts_enabled,
+        'alerts_enabled': state['alerts_enabled'],
         'firebase_connected': firebase_initialized,
         'email_alerts_enabled': ENABLE_EMAIL_ALERTS,
-        'last_alert_time': last_alert_time.isoformat() if last_alert_time else None,
+        'last_alert_time': state['last_alert_time'],
         'alert_threshold': ALERT_THRESHOLD,
         'enhanced_thresholds': {
             'low_level': LOW_LEVEL_THRESHOLD,
@@ -844,38 +1853,79 @@ def get_alerts_status():
 @app.route('/alerts/toggle', methods=['POST'])
 def toggle_alerts():
     """Toggle alert system on/off"""
-    global alerts_enabled
-    
     try:
-        print(f"Toggle alerts endpoint called. Current state: {alerts_enabled}")
         data = request.get_json()
-        print(f"Request data: {data}")
+        logger.debug('Toggle alerts endpoint called. Request data: %s', data)
         
         if data and 'enabled' in data:
-            alerts_enabled = bool(data['enabled'])
-            status = 'enabled' if alerts_enabled else 'disabled'
-            print(f"Alert system set to {status}")
-            
-            return jsonify({
-                'success': True,
-                'alerts_enabled': alerts_enabled,
-                'message': f'Alert system {status}'
-            })
+            enabled = coordinator.call_or_local('set_alerts_enabled', bool(data['enabled']))
+            status = 'enabled' if enabled else 'disabled'
+            logger.info('Alert system set to %s', status)
         else:
             # Toggle current state if no data provided
-            alerts_enabled = not alerts_enabled
-            status = 'enabled' if alerts_enabled else 'disabled'
-            print(f"Alert system toggled to {status}")
-            
-            return jsonify({
-                'success': True,
-                'alerts_enabled': alerts_enabled,
-                'message': f'Alert system {status}'
-            })
+            enabled = coordinator.call_or_local('set_alerts_enabled', None)
+            status = 'enabled' if enabled else 'disabled'
+            logger.info('Alert system toggled to %s', status)
+        
+        return jsonify({
+            'success': True,
+            'alerts_enabled': enabled,
+            'message': f'Alert system {status}'
+        })
             
     except Exception as e:
-        print(f"Error toggling alerts: {e}")
+        logger.exception('Error toggling alerts')
         return jsonify({'error': f'Failed to toggle alerts: {str(e)}'}), 500
 
+@app.route('/alerts/replay', methods=['POST'])
+def replay_alerts():
+    """Dry-run the alert rules over stored readings and report what would have fired
+    
+    Takes from/to (default: the last 7 days), device_id, source ('local' for
+    the configured storage, or 'firestore'), an optional rule set under 'rules' (default: the live
+    rules) and a limit on the alerts listed. Nothing is sent or stored.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        end = parse_time_param(str(data['to'])) if 'to' in data else time.time()
+        start = parse_time_param(str(data['from'])) if 'from' in data else end - 7 * 86400
+        limit = max(0, min(int(data.get('limit', 1000)), 10000))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid replay parameters: {e}'}), 400
+    
+    device_id = data.get('device_id')
+    source = data.get('source', 'local')
+    # Firestore only has the readings the compressor kept
+    compressed = compressor.mode != 'off' and (
+        isinstance(storage, CompressedStorage) or (source == 'firestore' and isinstance(storage, MirroredStorage)))
+    if source == 'firestore':
+        if not firebase_initialized:
+            return jsonify({'error': 'Firebase not connected'}), 400
+        readings = firestore_readings(db, start, end, device_id)
+    elif source == 'local' and storage.shared:
+        readings = local_readings(storage, start, end, device_id)
+    elif source == 'local':
+        # In-memory storage lives on the leader
+        readings = ((row['ts'], row) for row in query_storage('query_raw', device_id, start, end))
+    else:
+        return jsonify({'error': f'Unknown replay source: {source}'}), 400
+    
+    try:
+        replay = Replay(data.get('rules') or alert_engine.rule_set,
+                        usage_window_seconds=USAGE_WINDOW_HOURS * 3600,
+                        usage_method=USAGE_RATE_METHOD,
+                        predictive_cooldown_seconds=CRITICAL_COOLDOWN * 60,
+                        max_gap_seconds=MIRROR_REPLAY_MAX_GAP_SECONDS if compressed else None,
+                        new_filter=new_reading_filter if READING_FILTER else None,
+                        new_forecaster=new_forecaster)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid rule set: {e}'}), 400
+    
+    try:
+        return jsonify(replay.run(readings, limit=limit))
+    except Exception as e:
+        logger.exception('Replay error')
+        return jsonify({'error': f'Replay failed: {str(e)}'}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
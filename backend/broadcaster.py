@@ -0,0 +1,52 @@
+import queue
+import threading
+
+
+class Broadcaster:
+    """Fan out events to any number of subscriber queues.
+
+    ``publish`` costs one ``put_nowait`` per subscriber and never blocks:
+    a subscriber whose queue is full (a stalled client) loses the event
+    rather than holding up ingestion.
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Return a new queue that receives every published event"""
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        """Deliver event to every subscriber that has room for it"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def listen(self, heartbeat_seconds=None):
+        """Yield published events; yields None every heartbeat_seconds of silence"""
+        subscriber = self.subscribe()
+        try:
+            while True:
+                try:
+                    yield subscriber.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield None
+        finally:
+            self.unsubscribe(subscriber)
+
+    def __len__(self):
+        return len(self._subscribers)
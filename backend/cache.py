@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Short-lived cache of serialized read responses with strong ETags.
+
+    Entries are keyed by endpoint and query string and live for at most
+    ``ttl_seconds``; ``clear`` drops everything and is called whenever new
+    data is ingested. The least recently used entry is evicted once
+    ``max_entries`` is reached. A response computed while ``clear`` ran is
+    not stored, so a slow request cannot re-insert data that was already
+    stale.
+    """
+
+    def __init__(self, ttl_seconds=60, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_etag(body):
+        """Strong ETag for a response body"""
+        return hashlib.sha1(body).hexdigest()
+
+    def get(self, key):
+        """Return (body, etag, mimetype) for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1:]
+
+    def set(self, key, body, mimetype, generation=None):
+        """Cache body for key and return its ETag
+
+        Pass the ``generation`` read before building the response; if the
+        cache was cleared since then the body is not stored.
+        """
+        etag = self.make_etag(body)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return etag
+            self._entries[key] = (time.monotonic(), body, etag, mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
@@ -0,0 +1,200 @@
+import math
+import threading
+
+import numpy as np
+
+MODES = ('off', 'deadband', 'swinging_door')
+
+BUCKET_VALUE_COLUMNS = {
+    'gallons': ('gallons_min', 'gallons_max', 'gallons_mean', 'gallons_last'),
+    'fill_percentage': ('fill_min', 'fill_max', 'fill_mean', 'fill_last')
+}
+
+
+class _Series:
+    __slots__ = ('anchor_ts', 'anchor', 'held_ts', 'held', 'upper', 'lower')
+
+    def __init__(self):
+        self.anchor_ts = None
+        self.anchor = None
+        self.held_ts = None
+        self.held = None
+        self.upper = None
+        self.lower = None
+
+
+class ReadingCompressor:
+    """Drop readings that add nothing to the stored series, per device.
+
+    ``tolerances`` maps reading fields to the largest error allowed when
+    the series is rebuilt by linear interpolation between stored points.
+    In ``swinging_door`` mode a reading is stored only when no straight
+    line from the last stored point stays within tolerance of every
+    reading since; the one before it is stored and becomes the new start.
+    In ``deadband`` mode a reading is stored, with the one before it, once
+    any field moves too far from the last stored value.
+    Either way a reading is stored at least every ``max_gap_seconds``.
+
+    ``compress`` takes (ts, reading) pairs and returns the ones to store.
+    The latest reading of each device is held back until a later one
+    decides whether it is needed; ``flush`` returns held readings.
+    Readings older than a device's latest pass straight through.
+    """
+
+    def __init__(self, mode='swinging_door', tolerances=None, max_gap_seconds=3600):
+        if mode not in MODES:
+            raise ValueError(f"Unknown compression mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.mode = mode
+        self.tolerances = tolerances or {'gallons': 5.0, 'fill_percentage': 0.5}
+        self.max_gap_seconds = max_gap_seconds
+        self._series = {}
+        self._lock = threading.Lock()
+        self._offered = 0
+        self._stored = 0
+
+    def compress(self, timestamped_readings):
+        """Return the (ts, reading) pairs that need to be stored"""
+        if self.mode == 'off':
+            return list(timestamped_readings)
+        kept = []
+        with self._lock:
+            for ts, reading in timestamped_readings:
+                series = self._series.setdefault(reading.get('device_id', 'unknown'), _Series())
+                self._offer(series, ts, reading, kept)
+                self._offered += 1
+            self._stored += len(kept)
+        return kept
+
+    def flush(self, before=None):
+        """Return and store held readings, only those taken before ``before`` if given"""
+        kept = []
+        with self._lock:
+            for series in self._series.values():
+                if series.held is not None and (before is None or series.held_ts < before):
+                    kept.append((series.held_ts, series.held))
+                    self._restart(series, series.held_ts, series.held)
+            self._stored += len(kept)
+        return kept
+
+    def stats(self):
+        """Readings offered and stored so far, and how many are held"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'offered': self._offered,
+                'stored': self._stored,
+                'held': sum(series.held is not None for series in self._series.values())
+            }
+
+    def _values(self, reading):
+        values = {}
+        for field in self.tolerances:
+            value = reading.get(field)
+            values[field] = float(value) if value is not None else math.nan
+        return values
+
+    def _restart(self, series, ts, reading):
+        series.anchor_ts = ts
+        series.anchor = self._values(reading)
+        series.held_ts = series.held = None
+        series.upper = dict.fromkeys(self.tolerances, math.inf)
+        series.lower = dict.fromkeys(self.tolerances, -math.inf)
+
+    def _offer(self, series, ts, reading, kept):
+        if series.anchor is None:
+            kept.append((ts, reading))
+            self._restart(series, ts, reading)
+            return
+        latest = series.held_ts if series.held is not None else series.anchor_ts
+        if ts <= latest:
+            kept.append((ts, reading))
+            return
+
+        values = self._values(reading)
+        if self._breaks(series, ts, values):
+            if series.held is not None:
+                # The held reading is the last one the old line could reach
+                kept.append((series.held_ts, series.held))
+                self._restart(series, series.held_ts, series.held)
+                if self.mode == 'swinging_door' and not self._breaks(series, ts, values):
+                    series.held_ts, series.held = ts, reading
+                    self._heartbeat(series, ts, reading, kept)
+                    return
+            kept.append((ts, reading))
+            self._restart(series, ts, reading)
+            return
+
+        series.held_ts, series.held = ts, reading
+        self._heartbeat(series, ts, reading, kept)
+
+    def _heartbeat(self, series, ts, reading, kept):
+        if ts - series.anchor_ts >= self.max_gap_seconds:
+            kept.append((ts, reading))
+            self._restart(series, ts, reading)
+
+    def _breaks(self, series, ts, values):
+        """Whether the reading falls outside the tolerance; narrows the door if not
+
+        Both modes work to half the tolerance: stored points are actual
+        readings, so a line between two of them can be off by twice that.
+        """
+        if self.mode == 'deadband':
+            return any(not abs(values[field] - series.anchor[field]) <= tolerance / 2
+                       for field, tolerance in self.tolerances.items())
+
+        dt = ts - series.anchor_ts
+        upper = {}
+        lower = {}
+        for field, tolerance in self.tolerances.items():
+            tolerance /= 2
+            value = values[field]
+            if math.isnan(value) or math.isnan(series.anchor[field]):
+                return True
+            upper[field] = min(series.upper[field], (value + tolerance - series.anchor[field]) / dt)
+            lower[field] = max(series.lower[field], (value - tolerance - series.anchor[field]) / dt)
+            if lower[field] > upper[field]:
+                return True
+        series.upper = upper
+        series.lower = lower
+        return False
+
+
+def interpolate_buckets(buckets, width, points=(), max_gap_seconds=None):
+    """Fill empty buckets between stored points by linear interpolation
+
+    ``buckets`` are query_buckets results in time order (``ts`` at each
+    bucket's start). ``points`` are extra (ts, reading) pairs known to lie
+    on the series, such as the last stored reading before the range and
+    the device's current one, so the ends of the range can be filled too.
+    Filled buckets keep a count of 0 and are marked ``interpolated``.
+    Gaps between known points longer than ``max_gap_seconds`` (plus a
+    bucket) are left empty, since the sensor was not reporting.
+    """
+    if not buckets:
+        return buckets
+    for field, columns in BUCKET_VALUE_COLUMNS.items():
+        last_column = columns[3]
+        xs = [ts for ts, reading in points if reading.get(field) is not None]
+        ys = [float(reading[field]) for _, reading in points if reading.get(field) is not None]
+        for bucket in buckets:
+            if bucket['count'] and bucket[last_column] is not None:
+                xs.append(bucket['ts'] + width / 2)
+                ys.append(bucket[last_column])
+        if len(xs) < 2:
+            continue
+
+        order = np.argsort(xs, kind='stable')
+        xs = np.asarray(xs)[order]
+        ys = np.asarray(ys)[order]
+        for bucket in buckets:
+            middle = bucket['ts'] + width / 2
+            if bucket['count'] or not xs[0] <= middle <= xs[-1]:
+                continue
+            right = min(int(np.searchsorted(xs, middle)), len(xs) - 1)
+            if max_gap_seconds is not None and xs[right] - xs[max(right - 1, 0)] > max_gap_seconds + width:
+                continue
+            value = float(np.interp(middle, xs, ys))
+            for column in columns:
+                bucket[column] = value
+            bucket['interpolated'] = True
+    return buckets
@@ -0,0 +1,183 @@
+import os
+import json
+import fcntl
+import socket
+import threading
+import time
+import logging
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger(__name__)
+
+
+class CoordinatorUnavailable(Exception):
+    """Raised when no leader process can be reached"""
+
+
+class Coordinator:
+    """Elect one leader process with a file lock and route calls to it.
+
+    Every gunicorn worker creates a Coordinator. The worker that wins the
+    flock on ``leader.lock`` becomes the leader: it runs the callbacks
+    registered with ``on_elected`` (the sensor scheduler) and serves
+    ``call()`` requests from the other workers over a unix socket. Calls
+    are JSON encoded, so handlers must take and return JSON-safe values.
+    Streams registered with ``register_stream`` keep the connection open
+    and send every item their iterator yields, which lets followers relay
+    the leader's live events. If the leader dies the kernel drops its lock
+    and another worker picks it up on its next retry.
+    """
+
+    def __init__(self, run_dir, retry_interval=5, call_timeout=10):
+        self.run_dir = run_dir
+        self.lock_path = os.path.join(run_dir, 'leader.lock')
+        self.socket_path = os.path.join(run_dir, 'leader.sock')
+        self.retry_interval = retry_interval
+        self.call_timeout = call_timeout
+        self.is_leader = False
+        self._handlers = {}
+        self._streams = {}
+        self._elected_callbacks = []
+        self._lock_file = None
+        self._thread = None
+
+    def register(self, name, handler):
+        """Expose a handler that other workers can invoke on the leader"""
+        self._handlers[name] = handler
+
+    def register_stream(self, name, iterator_factory):
+        """Expose an iterator that other workers can follow with stream()"""
+        self._streams[name] = iterator_factory
+
+    def on_elected(self, callback):
+        """Run callback once this process becomes the leader"""
+        self._elected_callbacks.append(callback)
+
+    def start(self):
+        """Start competing for leadership in a background thread"""
+        if self._thread is not None:
+            return
+        os.makedirs(self.run_dir, mode=0o700, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        try:
+            return Client(self.socket_path, family='AF_UNIX')
+        except (FileNotFoundError, ConnectionRefusedError, socket.error) as e:
+            raise CoordinatorUnavailable(f"Leader not reachable: {e}")
+
+    def call(self, name, *args):
+        """Invoke a registered handler on the leader and return its result"""
+        if self.is_leader:
+            return self._handlers[name](*args)
+
+        conn = self._connect()
+
+        try:
+            conn.send_bytes(json.dumps({'name': name, 'args': args}).encode())
+            if not conn.poll(self.call_timeout):
+                raise CoordinatorUnavailable(f"Leader did not answer '{name}' in {self.call_timeout}s")
+            response = json.loads(conn.recv_bytes())
+        except (EOFError, OSError) as e:
+            raise CoordinatorUnavailable(f"Leader connection lost: {e}")
+        finally:
+            conn.close()
+
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def stream(self, name, *args):
+        """Yield items from a stream registered on the leader
+
+        Raises CoordinatorUnavailable when the leader goes away; callers
+        are expected to reconnect.
+        """
+        conn = self._connect()
+        try:
+            conn.send_bytes(json.dumps({'name': name, 'args': args, 'stream': True}).encode())
+            while True:
+                yield json.loads(conn.recv_bytes())
+        except (EOFError, OSError) as e:
+            raise CoordinatorUnavailable(f"Leader stream lost: {e}")
+        finally:
+            conn.close()
+
+    def call_or_local(self, name, *args):
+        """Call the leader, falling back to this process if none is reachable"""
+        try:
+            return self.call(name, *args)
+        except CoordinatorUnavailable as e:
+            logger.warning("Coordinator unavailable, handling '%s' locally: %s", name, e)
+            return self._handlers[name](*args)
+
+    def _try_acquire(self):
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._try_acquire():
+            time.sleep(self.retry_interval)
+
+        # We hold the lock, so any socket left behind belongs to a dead leader
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = Listener(self.socket_path, family='AF_UNIX')
+
+        self.is_leader = True
+        logger.info('Process %d elected leader', os.getpid())
+        for callback in self._elected_callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('Error in leader callback %s', callback.__name__)
+
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                logger.error('Coordinator accept failed: %s', e)
+                time.sleep(1)
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            request = json.loads(conn.recv_bytes())
+            if request.get('stream'):
+                self._serve_stream(conn, request)
+                return
+            handler = self._handlers.get(request.get('name'))
+            if handler is None:
+                response = {'error': f"Unknown call: {request.get('name')}"}
+            else:
+                try:
+                    response = {'result': handler(*request.get('args', []))}
+                except Exception as e:
+                    response = {'error': str(e)}
+            conn.send_bytes(json.dumps(response, default=str).encode())
+        except (EOFError, OSError, ValueError) as e:
+            logger.warning('Coordinator request failed: %s', e)
+        finally:
+            conn.close()
+
+    def _serve_stream(self, conn, request):
+        factory = self._streams.get(request.get('name'))
+        if factory is None:
+            return
+        iterator = factory(*request.get('args', []))
+        try:
+            for item in iterator:
+                conn.send_bytes(json.dumps(item, default=str).encode())
+        finally:
+            # Let the iterator clean up (e.g. unsubscribe) once the follower is gone
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
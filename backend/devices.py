@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+class DeviceState:
+    """Everything the backend tracks for one sensor.
+
+    Holds the device's latest reading (smoothed, for display) and the raw
+    reading it came from (for alert checks), the time of the newest reading
+    it pushed, its usage estimator, its reading filter (None when filtering
+    is off) and the alert cooldown timestamps, so alerts for one tank never
+    suppress or trigger alerts for another. ``lock`` serializes ingestion
+    for this device only.
+    """
+
+    __slots__ = ('device_id', 'last_reading', 'last_raw_reading', 'last_reading_time', 'last_pushed_time',
+                 'usage_estimator', 'reading_filter',
+                 'last_alert_time', 'last_critical_alert_time', 'last_emergency_alert_time', 'last_leak_alert_time',
+                 'lock')
+
+    def __init__(self, device_id, usage_estimator, reading_filter=None):
+        self.device_id = device_id
+        self.last_reading = None
+        self.last_raw_reading = None
+        self.last_reading_time = None
+        self.last_pushed_time = None
+        self.usage_estimator = usage_estimator
+        self.reading_filter = reading_filter
+        self.last_alert_time = None
+        self.last_critical_alert_time = None
+        self.last_emergency_alert_time = None
+        self.last_leak_alert_time = None
+        self.lock = threading.RLock()
+
+    def update_reading(self, data, ts=None, raw=None):
+        """Record an ingested reading; raw is the unsmoothed one, if different
+
+        The raw reading is always the one the next reading is compared
+        with. ``data`` is only shown if it is not older than the reading
+        shown now, which may have come from a poll.
+        """
+        ts = ts if ts is not None else time.time()
+        self.last_raw_reading = raw if raw is not None else data
+        self.show_reading(data, ts)
+
+    def show_reading(self, data, ts):
+        """Make data the reading shown for the device, unless a newer one is shown"""
+        if self.last_reading_time is None or ts >= self.last_reading_time:
+            self.last_reading = data
+            self.last_reading_time = ts
+
+
+class DeviceRegistry:
+    """Keyed registry of DeviceState objects, created on first use"""
+
+    def __init__(self, estimator_factory, filter_factory=None):
+        self._estimator_factory = estimator_factory
+        self._filter_factory = filter_factory
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        """Return the state for device_id, creating it if needed"""
+        device = self._devices.get(device_id)
+        if device is None:
+            with self._lock:
+                device = self._devices.get(device_id)
+                if device is None:
+                    device = DeviceState(device_id, self._estimator_factory(),
+                                         self._filter_factory() if self._filter_factory else None)
+                    self._devices[device_id] = device
+        return device
+
+    def find(self, device_id):
+        """Return the state for device_id, or None if it was never seen"""
+        return self._devices.get(device_id)
+
+    def latest(self):
+        """Return the device that reported most recently, or None"""
+        reporting = [d for d in list(self._devices.values()) if d.last_reading_time is not None]
+        return max(reporting, key=lambda d: d.last_reading_time, default=None)
+
+    def __iter__(self):
+        return iter(list(self._devices.values()))
+
+    def __len__(self):
+        return len(self._devices)
@@ -0,0 +1,100 @@
+import time
+from collections import deque
+
+
+class UsageEstimator:
+    """Rolling water usage rate over a fixed time window.
+
+    Points are kept in a deque in arrival order together with running sums
+    (n, sum t, sum g, sum t^2, sum t*g). Appending adds one point to the
+    sums and eviction subtracts expired points from the front, so both are
+    amortized O(1) and a rate query never rescans the window.
+
+    Times are stored in hours relative to ``_origin`` to keep the squared
+    sums small; the origin is moved forward (and the sums rebuilt from the
+    window) only once it falls more than ``REBASE_HOURS`` behind.
+    """
+
+    REBASE_HOURS = 24 * 30
+
+    def __init__(self, window_seconds=24 * 3600, method='least_squares'):
+        if method not in ('least_squares', 'endpoints'):
+            raise ValueError(f"Unknown usage rate method: {method}")
+        self.window_seconds = window_seconds
+        self.method = method
+        self._points = deque()
+        self._origin = None
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._n = 0
+        self._sum_t = 0.0
+        self._sum_g = 0.0
+        self._sum_tt = 0.0
+        self._sum_tg = 0.0
+
+    def _add_to_sums(self, t, gallons, sign=1):
+        self._n += sign
+        self._sum_t += sign * t
+        self._sum_g += sign * gallons
+        self._sum_tt += sign * t * t
+        self._sum_tg += sign * t * gallons
+
+    def add(self, gallons, ts=None):
+        """Record a reading taken at ts (epoch seconds, default now)"""
+        ts = ts if ts is not None else time.time()
+        if self._origin is None:
+            self._origin = ts
+        elif (ts - self._origin) / 3600 > self.REBASE_HOURS:
+            self._rebase(ts)
+        t = (ts - self._origin) / 3600
+        self._points.append((ts, t, gallons))
+        self._add_to_sums(t, gallons)
+        self._evict(ts)
+
+    def _evict(self, now):
+        cutoff = now - self.window_seconds
+        while self._points and self._points[0][0] < cutoff:
+            _, t, gallons = self._points.popleft()
+            self._add_to_sums(t, gallons, sign=-1)
+        if not self._points:
+            self._reset_sums()
+
+    def _rebase(self, ts):
+        self._origin = ts
+        self._reset_sums()
+        rebased = deque()
+        for point_ts, _, gallons in self._points:
+            t = (point_ts - ts) / 3600
+            rebased.append((point_ts, t, gallons))
+            self._add_to_sums(t, gallons)
+        self._points = rebased
+
+    def __len__(self):
+        return len(self._points)
+
+    def rate(self, now=None):
+        """Gallons consumed per hour over the window; 0 if not enough data"""
+        self._evict(now if now is not None else time.time())
+        if self._n < 2:
+            return 0
+
+        if self.method == 'endpoints':
+            first_ts, _, first_gallons = self._points[0]
+            last_ts, _, last_gallons = self._points[-1]
+            hours = (last_ts - first_ts) / 3600
+            return (first_gallons - last_gallons) / hours if hours > 0 else 0
+
+        # Least-squares slope of gallons over hours; usage is the negated slope
+        denominator = self._n * self._sum_tt - self._sum_t * self._sum_t
+        if denominator <= 0:
+            return 0
+        slope = (self._n * self._sum_tg - self._sum_t * self._sum_g) / denominator
+        return -slope
+
+    def days_remaining(self, current_gallons, now=None):
+        """Estimated days until empty at the current rate, or None"""
+        usage_rate = self.rate(now)
+        if usage_rate <= 0:
+            return None
+        return current_gallons / (usage_rate * 24)
@@ -0,0 +1,119 @@
+import math
+from collections import deque
+from statistics import median
+
+SMOOTHING_METHODS = ('kalman', 'ema', 'off')
+
+# 1.4826 * MAD estimates the standard deviation of normally distributed noise
+MAD_SCALE = 1.4826
+
+
+class ReadingFilter:
+    """Reject echo glitches and smooth the level for one device, in constant memory.
+
+    Readings with a distance of 0 or less (no echo) are rejected outright.
+    The rest go through a Hampel filter on fill_percentage: a reading is an
+    outlier when it is more than ``n_sigmas`` robust standard deviations,
+    and at least ``min_deviation`` percentage points, from the median of
+    the last ``window`` readings. The window holds rejected readings too,
+    so a real step in the level is accepted once it has lasted for half
+    the window.
+
+    Accepted readings are smoothed with a random-walk Kalman filter (or an
+    exponential moving average with time constant ``ema_seconds``), and
+    gallons, water level and distance are rescaled to the smoothed fill.
+    ``measurement_noise`` is the sensor's standard deviation and
+    ``process_noise`` how far the level may wander per hour, both in
+    percentage points.
+    """
+
+    __slots__ = ('window', 'n_sigmas', 'min_deviation', 'smoothing', 'process_noise',
+                 'measurement_noise', 'ema_seconds', '_recent', '_level', '_variance', '_last_ts',
+                 'accepted', 'rejected')
+
+    def __init__(self, window=5, n_sigmas=3.0, min_deviation=3.0, smoothing='kalman',
+                 process_noise=5.0, measurement_noise=0.5, ema_seconds=120):
+        if smoothing not in SMOOTHING_METHODS:
+            raise ValueError(f"Unknown smoothing method {smoothing!r}; expected one of "
+                             f"{', '.join(SMOOTHING_METHODS)}")
+        self.window = window
+        self.n_sigmas = n_sigmas
+        self.min_deviation = min_deviation
+        self.smoothing = smoothing
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.ema_seconds = ema_seconds
+        self._recent = deque(maxlen=window)
+        self._level = None
+        self._variance = None
+        self._last_ts = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def update(self, reading, ts):
+        """Return the cleaned reading, or None if it is rejected as a glitch"""
+        fill = reading.get('fill_percentage')
+        distance = reading.get('distance_cm')
+        if fill is None or (distance is not None and distance <= 0):
+            self.rejected += 1
+            return None
+
+        fill = float(fill)
+        if self._is_outlier(fill):
+            self._recent.append(fill)
+            self.rejected += 1
+            return None
+        self._recent.append(fill)
+        self.accepted += 1
+
+        smoothed = self._smooth(fill, ts)
+        if smoothed == fill:
+            return reading
+        return self._rescale(reading, fill, smoothed)
+
+    def _is_outlier(self, fill):
+        if len(self._recent) < 3:
+            return False
+        center = median(self._recent)
+        mad = median(abs(value - center) for value in self._recent)
+        threshold = max(self.n_sigmas * MAD_SCALE * mad, self.min_deviation)
+        return abs(fill - center) > threshold
+
+    def _smooth(self, fill, ts):
+        if self.smoothing == 'off':
+            return fill
+        if self._level is None or self._last_ts is None or ts <= self._last_ts:
+            dt = None
+        else:
+            dt = ts - self._last_ts
+        self._last_ts = ts if self._last_ts is None else max(ts, self._last_ts)
+        if self._level is None:
+            self._level = fill
+            self._variance = self.measurement_noise ** 2
+            return fill
+        if dt is None:
+            # Same or older timestamp: keep the estimate, nothing to learn
+            return self._level
+
+        if self.smoothing == 'ema':
+            alpha = 1 - math.exp(-dt / self.ema_seconds)
+        else:
+            self._variance += self.process_noise ** 2 * dt / 3600
+            alpha = self._variance / (self._variance + self.measurement_noise ** 2)
+            self._variance *= 1 - alpha
+        self._level += alpha * (fill - self._level)
+        return self._level
+
+    @staticmethod
+    def _rescale(reading, fill, smoothed):
+        cleaned = dict(reading, fill_percentage=round(smoothed, 2))
+        if fill > 0:
+            ratio = smoothed / fill
+            if reading.get('gallons') is not None:
+                cleaned['gallons'] = round(reading['gallons'] * ratio, 1)
+            water_level = reading.get('water_level_cm')
+            if water_level is not None:
+                cleaned['water_level_cm'] = round(water_level * ratio, 1)
+                if reading.get('distance_cm') is not None:
+                    cleaned['distance_cm'] = round(reading['distance_cm'] - (cleaned['water_level_cm'] - water_level), 1)
+        return cleaned
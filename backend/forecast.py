@@ -0,0 +1,237 @@
+import json
+import math
+import os
+import threading
+import time
+from statistics import NormalDist
+
+HOURS_PER_WEEK = 168
+
+
+def hour_of_week(ts):
+    """Local hour of the week, 0 (Monday 00:00) to 167"""
+    local = time.localtime(ts)
+    return local.tm_wday * 24 + local.tm_hour
+
+
+class _Profile:
+    """One device's hour-of-week usage profile and the hour being accumulated"""
+
+    __slots__ = ('counts', 'means', 'variances', 'last_ts', 'last_gallons',
+                 'hour_start', 'hour_used', 'hour_seconds', 'observed_hours', 'version')
+
+    def __init__(self):
+        self.counts = [0] * HOURS_PER_WEEK
+        self.means = [0.0] * HOURS_PER_WEEK
+        self.variances = [0.0] * HOURS_PER_WEEK
+        self.last_ts = None
+        self.last_gallons = None
+        self.hour_start = None
+        self.hour_used = 0.0
+        self.hour_seconds = 0.0
+        self.observed_hours = 0
+        self.version = 0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'version'}
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(profile, name, data[name])
+        return profile
+
+
+class ConsumptionForecaster:
+    """Per-device hour-of-week water usage profiles and depletion forecasts.
+
+    Each reading adds the gallons used since the previous one to the hour
+    it fell in. Refills, when the level rises, and gaps longer than
+    ``max_interval_seconds`` are left out. When an hour is over and at
+    least half of it was observed, its usage rate updates one of 168
+    hour-of-week slots with an exponentially weighted mean and variance.
+    ``decay`` is the weight of the newest week, so the profile follows
+    seasonal change. Adding a reading is O(1).
+
+    ``forecast`` walks the profile forward from now, hour by hour, to
+    estimate when the tank runs dry. Bounds come from the slot variances,
+    which are treated as independent. Slots not seen yet use the average
+    of the others. No history is read.
+    """
+
+    def __init__(self, decay=0.2, min_hours=24, horizon_hours=14 * 24, confidence=0.8,
+                 max_interval_seconds=6 * 3600):
+        self.decay = decay
+        self.min_hours = min_hours
+        self.horizon_hours = horizon_hours
+        self.confidence = confidence
+        self.max_interval_seconds = max_interval_seconds
+        self._z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self._profiles = {}
+        self._forecasts = {}
+        self._lock = threading.Lock()
+
+    def add(self, device_id, ts, gallons):
+        """Fold one reading into the device's profile"""
+        if gallons is None:
+            return
+        with self._lock:
+            profile = self._profiles.get(device_id)
+            if profile is None:
+                profile = self._profiles[device_id] = _Profile()
+            self._add(profile, ts, float(gallons))
+
+    def _add(self, profile, ts, gallons):
+        if profile.last_ts is not None and ts <= profile.last_ts:
+            return
+        previous_ts, previous_gallons = profile.last_ts, profile.last_gallons
+        profile.last_ts, profile.last_gallons = ts, gallons
+        if previous_ts is None:
+            profile.hour_start = ts // 3600 * 3600
+            return
+
+        used = previous_gallons - gallons
+        duration = ts - previous_ts
+        if used < 0 or duration > self.max_interval_seconds:
+            # A refill or a gap: nothing to attribute, just move to this hour
+            self._move_to_hour(profile, ts)
+            return
+        t = previous_ts
+        while t < ts:
+            self._move_to_hour(profile, t)
+            segment_end = min(ts, profile.hour_start + 3600)
+            profile.hour_used += used * (segment_end - t) / duration
+            profile.hour_seconds += segment_end - t
+            t = segment_end
+        self._move_to_hour(profile, ts)
+
+    def _move_to_hour(self, profile, ts):
+        hour_start = ts // 3600 * 3600
+        if hour_start != profile.hour_start:
+            self._close_hour(profile)
+            profile.hour_start = hour_start
+
+    def _close_hour(self, profile):
+        if profile.hour_start is not None and profile.hour_seconds >= 1800:
+            rate = profile.hour_used / (profile.hour_seconds / 3600)
+            slot = hour_of_week(profile.hour_start)
+            profile.counts[slot] += 1
+            weight = max(self.decay, 1 / profile.counts[slot])
+            delta = rate - profile.means[slot]
+            profile.means[slot] += weight * delta
+            profile.variances[slot] = (1 - weight) * (profile.variances[slot] + weight * delta * delta)
+            profile.observed_hours += 1
+            profile.version += 1
+        profile.hour_used = 0.0
+        profile.hour_seconds = 0.0
+
+    def forecast(self, device_id, gallons, now=None):
+        """Hours until empty with lower/upper bounds, or None while the profile is too short
+
+        Returns a dict with ``hours_to_empty`` (None if not within the
+        horizon), ``earliest_hours`` and ``latest_hours`` at the configured
+        confidence, the expected use over the next 24 hours and how many
+        hours the profile is built from. Results are cached until the
+        profile, the level or the hour changes.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            profile = self._profiles.get(device_id)
+            if profile is None or profile.observed_hours < self.min_hours or gallons is None:
+                return None
+            key = (profile.version, gallons, now // 3600)
+            cached = self._forecasts.get(device_id)
+            if cached and cached[0] == key:
+                return cached[1]
+            means, variances = self._filled_slots(profile)
+            result = self._project(means, variances, float(gallons), now)
+            result['profile_hours'] = profile.observed_hours
+            self._forecasts[device_id] = (key, result)
+            return result
+
+    @staticmethod
+    def _filled_slots(profile):
+        seen = [slot for slot in range(HOURS_PER_WEEK) if profile.counts[slot]]
+        mean = sum(profile.means[slot] for slot in seen) / len(seen)
+        variance = sum(profile.variances[slot] for slot in seen) / len(seen)
+        means = [profile.means[slot] if profile.counts[slot] else mean for slot in range(HOURS_PER_WEEK)]
+        variances = [profile.variances[slot] if profile.counts[slot] else variance
+                     for slot in range(HOURS_PER_WEEK)]
+        return means, variances
+
+    def _project(self, means, variances, gallons, now):
+        crossings = {'hours_to_empty': None, 'earliest_hours': None, 'latest_hours': None}
+        expected_24h = None
+        used = 0.0
+        variance = 0.0
+        elapsed = 0.0
+        previous = {name: 0.0 for name in crossings}
+        t = now
+        while elapsed < self.horizon_hours and (None in crossings.values() or expected_24h is None):
+            hours = (t // 3600 * 3600 + 3600 - t) / 3600
+            slot = hour_of_week(t)
+            used += max(means[slot], 0.0) * hours
+            variance += variances[slot] * hours * hours
+            spread = self._z * math.sqrt(variance)
+            current = {'hours_to_empty': used, 'earliest_hours': used + spread,
+                       'latest_hours': max(used - spread, 0.0)}
+            for name, value in current.items():
+                if crossings[name] is None and value >= gallons:
+                    # Interpolate within the hour
+                    step = value - previous[name]
+                    fraction = (gallons - previous[name]) / step if step > 0 else 1.0
+                    crossings[name] = round(elapsed + hours * fraction, 2)
+            previous = current
+            elapsed += hours
+            t += hours * 3600
+            if expected_24h is None and elapsed >= 24:
+                expected_24h = round(used, 1)
+        return dict(crossings, confidence=self.confidence, expected_usage_24h=expected_24h,
+                    horizon_hours=self.horizon_hours)
+
+    def last_timestamps(self):
+        """Time of the latest reading folded in, per device"""
+        with self._lock:
+            return {device_id: profile.last_ts for device_id, profile in self._profiles.items()}
+
+    def adopt(self, other):
+        """Take over another forecaster's profiles, e.g. one rebuilt from storage
+
+        Where this forecaster has seen a newer reading of a device, the
+        newer position is kept, so live readings added meanwhile are not
+        counted twice.
+        """
+        with other._lock:
+            profiles = dict(other._profiles)
+        with self._lock:
+            for device_id, profile in profiles.items():
+                live = self._profiles.get(device_id)
+                if live is not None and live.last_ts is not None and (
+                        profile.last_ts is None or live.last_ts > profile.last_ts):
+                    for name in ('last_ts', 'last_gallons', 'hour_start', 'hour_used', 'hour_seconds'):
+                        setattr(profile, name, getattr(live, name))
+                profile.version += 1
+                self._profiles[device_id] = profile
+
+    def save(self, path):
+        """Write the profiles to a JSON file, atomically"""
+        with self._lock:
+            data = {device_id: profile.to_dict() for device_id, profile in self._profiles.items()}
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Read profiles saved by ``save``; returns False if there is no file"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._profiles = {device_id: _Profile.from_dict(profile) for device_id, profile in data.items()}
+            self._forecasts.clear()
+        return True
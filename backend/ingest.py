@@ -0,0 +1,180 @@
+import json
+import math
+import time
+import zlib
+
+from . import wire
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+REQUIRED_FIELDS = ('device_id', 'distance_cm', 'water_level_cm', 'gallons', 'fill_percentage')
+# Measurements that must be finite numbers; battery_voltage only when given
+NUMERIC_FIELDS = ('distance_cm', 'water_level_cm', 'gallons', 'fill_percentage')
+OPTIONAL_NUMERIC_FIELDS = ('battery_voltage',)
+
+
+class PayloadError(Exception):
+    """Raised when a /tank-data body cannot be decoded"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_body(body, content_type=None, content_encoding=None, max_bytes=1048576):
+    """Decode a request body into Python objects according to its Content-Type
+
+    Besides JSON, bodies may be the packed binary format from ``wire``,
+    CBOR (with cbor2) or MessagePack (with msgpack), and any of them may be
+    gzip compressed. The decompressed size is capped at ``max_bytes`` so a
+    small gzip body cannot expand without bound.
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, max_bytes)
+        except zlib.error as e:
+            raise PayloadError(f"Invalid gzip body: {e}")
+        if decompressor.unconsumed_tail:
+            raise PayloadError(f"Decompressed body exceeds {max_bytes} bytes", 413)
+    elif encoding not in ('', 'identity'):
+        raise PayloadError(f"Unsupported Content-Encoding: {encoding}", 415)
+
+    if len(body) > max_bytes:
+        raise PayloadError(f"Body exceeds {max_bytes} bytes", 413)
+    if not body:
+        raise PayloadError('No JSON data received')
+
+    if content_type == wire.CONTENT_TYPE:
+        try:
+            return wire.decode(body)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise PayloadError(f"Invalid binary body: {e}")
+
+    if content_type in ('application/msgpack', 'application/x-msgpack'):
+        if msgpack is None:
+            raise PayloadError('MessagePack bodies need the msgpack package', 415)
+        try:
+            return msgpack.unpackb(body)
+        except Exception as e:
+            raise PayloadError(f"Invalid MessagePack body: {e}")
+
+    if content_type == 'application/cbor':
+        if cbor2 is None:
+            raise PayloadError('CBOR bodies need the cbor2 package', 415)
+        try:
+            return cbor2.loads(body)
+        except Exception as e:
+            raise PayloadError(f"Invalid CBOR body: {e}")
+
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise PayloadError(f"Invalid JSON body: {e}")
+
+
+def validate_reading(reading):
+    """Return an error message for a malformed reading, or None"""
+    if not isinstance(reading, dict):
+        return 'Reading must be an object'
+    for field in REQUIRED_FIELDS:
+        if field not in reading:
+            return f'Missing required field: {field}'
+    for field in NUMERIC_FIELDS:
+        if not _is_finite_number(reading[field]):
+            return f'{field} must be a finite number'
+    for field in OPTIONAL_NUMERIC_FIELDS:
+        if reading.get(field) is not None and not _is_finite_number(reading[field]):
+            return f'{field} must be a finite number'
+    return None
+
+
+def _is_finite_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _millis(value, name):
+    """A device millis() value as an int; floats are accepted if they are whole"""
+    if not _is_finite_number(value) or value != int(value):
+        raise ValueError(f'{name} must be an integer')
+    return int(value)
+
+
+def normalize_batch(payload, now=None, max_readings=1000):
+    """Split a decoded body into timestamped readings and rejections
+
+    Accepts a single reading, a list of readings, or an envelope
+    ``{"readings": [...], "sent_at": ..., ...}`` whose other fields (such as
+    ``device_id``) are defaults for every reading. Readings carry the
+    device's ``millis()`` as ``timestamp``; with the envelope's ``sent_at``
+    (``millis()`` when the batch was sent) that gives each reading's age and
+    so its wall-clock time. A reading may instead give epoch seconds in
+    ``ts``. Returns ``(accepted, rejected)`` where accepted is a list of
+    ``(ts, reading)`` sorted by time and rejected is a list of
+    ``{'index', 'error'}``.
+    """
+    now = now if now is not None else time.time()
+    defaults = {}
+    sent_at = None
+
+    if isinstance(payload, dict) and 'readings' in payload:
+        readings = payload['readings']
+        defaults = {k: v for k, v in payload.items() if k not in ('readings', 'sent_at')}
+        sent_at = payload.get('sent_at')
+    elif isinstance(payload, list):
+        readings = payload
+    else:
+        readings = [payload]
+
+    if not isinstance(readings, list):
+        raise PayloadError('readings must be a list')
+    if not readings:
+        raise PayloadError('No readings in batch')
+    if len(readings) > max_readings:
+        raise PayloadError(f"Batch of {len(readings)} readings exceeds the limit of {max_readings}", 413)
+
+    accepted = []
+    rejected = []
+    for index, reading in enumerate(readings):
+        if isinstance(reading, dict) and defaults:
+            reading = {**defaults, **reading}
+        error = validate_reading(reading)
+        if error is None:
+            try:
+                ts = _reading_time(reading, sent_at, now)
+            except (TypeError, ValueError) as e:
+                error = f'Invalid timestamp: {e}'
+        if error is not None:
+            rejected.append({'index': index, 'error': error})
+            continue
+        accepted.append((ts, reading))
+
+    accepted.sort(key=lambda item: item[0])
+    return accepted, rejected
+
+
+def _reading_time(reading, sent_at, now):
+    if 'ts' in reading:
+        if not _is_finite_number(reading['ts']):
+            raise ValueError('ts must be a finite number')
+        ts = float(reading['ts'])
+    elif sent_at is not None and 'timestamp' in reading:
+        # millis() is a uint32 that wraps every 49.7 days
+        age_ms = (_millis(sent_at, 'sent_at') - _millis(reading['timestamp'], 'timestamp')) % 2 ** 32
+        if age_ms >= 2 ** 31:
+            raise ValueError('reading is newer than sent_at')
+        ts = now - age_ms / 1000
+    else:
+        return now
+    # Never accept readings from the future; clocks drift
+    return min(ts, now)
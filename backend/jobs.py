@@ -0,0 +1,77 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobManager:
+    """Run slow actions in the background and hand out job IDs to poll.
+
+    Jobs are keyed (e.g. by sensor endpoint): submitting a key that already
+    has a pending or running job returns that job instead of starting a new
+    one, so repeated clicks collapse into a single request to the device.
+    Finished jobs are kept for ``ttl_seconds`` so clients can collect the
+    result.
+    """
+
+    def __init__(self, max_workers=4, ttl_seconds=600):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Start fn(*args) as a job for key, or join the one in flight
+
+        Returns (job, coalesced) where job is a JSON-safe dict.
+        """
+        with self._lock:
+            self._expire()
+            job_id = self._active.get(key)
+            if job_id is not None:
+                return dict(self._jobs[job_id]), True
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'status': 'pending',
+                'created': time.time(),
+                'finished': None,
+                'result': None,
+                'error': None
+            }
+            self._jobs[job['id']] = job
+            self._active[key] = job['id']
+            snapshot = dict(job)
+
+        self._executor.submit(self._run, job['id'], fn, args)
+        return snapshot, False
+
+    def get(self, job_id):
+        """Return a copy of the job, or None if unknown or expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            self._jobs[job_id]['status'] = 'running'
+        try:
+            result = fn(*args)
+            status, error = 'succeeded', None
+        except Exception as e:
+            result, status, error = None, 'failed', str(e)
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=status, result=result, error=error, finished=time.time())
+            if self._active.get(job['key']) == job_id:
+                del self._active[job['key']]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished'] is not None and job['finished'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
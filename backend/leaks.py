@@ -0,0 +1,104 @@
+import time
+from datetime import date
+from statistics import median
+
+# 1.4826 * MAD estimates the standard deviation of normally distributed noise
+MAD_SCALE = 1.4826
+
+
+class LeakDetector:
+    """Spot slow leaks from the flow during each night's quiet hours.
+
+    Nobody draws water between ``night_start_hour`` and ``night_end_hour``
+    (local time), so the average hourly drop in level then, the minimum
+    night flow, is what the plumbing loses on its own. Averaging over the
+    window rather than taking the lowest single hour keeps sensor noise
+    from hiding a small leak. Hours in which the
+    level rose by more than ``refill_gallons`` are left out, since the pump
+    ran. A night needs ``min_night_hours`` usable hours.
+
+    The baseline is the median minimum night flow of up to
+    ``baseline_nights`` earlier nights, at least ``min_baseline_nights`` of
+    them. A leak is reported when each of the last ``confirm_nights``
+    nights is above the baseline by ``n_sigmas`` robust standard
+    deviations, and by at least ``min_excess_gph``.
+
+    Only hourly buckets are read, so a check costs the same however much
+    history is stored. A leak that lasts longer than the baseline window
+    becomes the new baseline.
+    """
+
+    def __init__(self, night_start_hour=1, night_end_hour=5, baseline_nights=14, min_baseline_nights=5,
+                 confirm_nights=2, min_excess_gph=2.0, n_sigmas=3.0, min_night_hours=2, refill_gallons=10.0):
+        if not 0 <= night_start_hour < night_end_hour <= 24:
+            raise ValueError('The night window must be within one day, with start before end')
+        self.night_start_hour = night_start_hour
+        self.night_end_hour = night_end_hour
+        self.baseline_nights = baseline_nights
+        self.min_baseline_nights = min_baseline_nights
+        self.confirm_nights = confirm_nights
+        self.min_excess_gph = min_excess_gph
+        self.n_sigmas = n_sigmas
+        self.min_night_hours = min_night_hours
+        self.refill_gallons = refill_gallons
+
+    def window(self, now=None):
+        """(start, end, points) of the hourly buckets a check needs"""
+        now = now if now is not None else time.time()
+        end = int(now // 3600) * 3600
+        # One extra hour so the first night hour has a level to start from
+        start = end - (self.baseline_nights + self.confirm_nights + 1) * 86400 - 3600
+        return start, end, (end - start) // 3600
+
+    def night_flows(self, buckets):
+        """Average night flow in gallons per hour per complete night, oldest first
+
+        ``buckets`` are consecutive one-hour query_buckets results. Nights
+        without enough usable hours have a flow of None.
+        """
+        nights = {}
+        last_hours = {}
+        for previous, bucket in zip(buckets, buckets[1:]):
+            local = time.localtime(bucket['ts'])
+            if not self.night_start_hour <= local.tm_hour < self.night_end_hour:
+                continue
+            night = date(local.tm_year, local.tm_mon, local.tm_mday)
+            flows = nights.setdefault(night, [])
+            last_hours[night] = local.tm_hour
+            before, after = previous['gallons_last'], bucket['gallons_last']
+            if before is None or after is None:
+                continue
+            if bucket['gallons_max'] is not None and bucket['gallons_max'] > before + self.refill_gallons:
+                continue
+            flows.append(before - after)
+        # The first night may be cut short by the start of the range, the last by its end
+        return [(night, sum(flows) / len(flows) if len(flows) >= self.min_night_hours else None)
+                for night, flows in sorted(nights.items())
+                if last_hours[night] == self.night_end_hour - 1]
+
+    def check(self, buckets):
+        """Compare the latest nights with the baseline; None if there is not enough history
+
+        Returns the latest night, its flow, the baseline, the threshold
+        and whether it is a ``leak``.
+        """
+        nights = self.night_flows(buckets)
+        recent = nights[-self.confirm_nights:]
+        if len(recent) < self.confirm_nights or any(flow is None for _, flow in recent):
+            return None
+        earlier = [flow for _, flow in nights[:-self.confirm_nights][-self.baseline_nights:] if flow is not None]
+        if len(earlier) < self.min_baseline_nights:
+            return None
+
+        baseline = median(earlier)
+        spread = MAD_SCALE * median(abs(flow - baseline) for flow in earlier)
+        threshold = baseline + max(self.n_sigmas * spread, self.min_excess_gph)
+        night, flow = recent[-1]
+        return {
+            'night': night.isoformat(),
+            'night_flow_gph': round(flow, 2),
+            'baseline_gph': round(baseline, 2),
+            'threshold_gph': round(threshold, 2),
+            'baseline_nights': len(earlier),
+            'leak': all(recent_flow > threshold for _, recent_flow in recent)
+        }
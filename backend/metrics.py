@@ -0,0 +1,282 @@
+import bisect
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a fast local call to a slow network timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+
+class _Metric:
+    def __init__(self, name, help, labels, kind, mode='sum', buckets=None, collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self.mode = mode
+        self.buckets = tuple(buckets) if buckets else None
+        self.collect = collect
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _samples(self):
+        """[(label values, value)] for this process"""
+        if self.collect is None:
+            with self._lock:
+                return [(list(key), value) for key, value in self._values.items()]
+        result = self.collect()
+        if not isinstance(result, dict):
+            return [([], result)] if result is not None else []
+        return [([str(v) for v in key] if isinstance(key, tuple) else [str(key)], value)
+                for key, value in result.items() if value is not None]
+
+
+class Counter(_Metric):
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum and the count
+                counts = self._values[key] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            return [(list(key), list(counts)) for key, counts in self._values.items()]
+
+
+class Metrics:
+    """Counters, gauges and histograms shared across gunicorn workers.
+
+    Each process records into memory, which costs a lock and a dict update,
+    and a background thread writes a snapshot to ``<pid>-<start>.json`` in
+    ``directory`` every ``flush_interval`` seconds. ``render`` merges the
+    snapshots of every process into the Prometheus text format: counters
+    and histograms are summed, gauges are summed or maxed according to
+    their ``mode``. A snapshot that has not been rewritten for
+    ``stale_seconds`` belongs to a process that has exited; its counters
+    and histograms are folded into ``archive.json`` so totals never go
+    backwards, and its gauges are dropped.
+
+    Metrics may take a ``collect`` callable instead of being updated
+    directly. It is called at snapshot time and returns a value, or a dict
+    of label value (or tuple of label values) to value, which suits queue
+    depths and counters that another component already keeps.
+    """
+
+    def __init__(self, directory, flush_interval=1.0, stale_seconds=10):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.stale_seconds = stale_seconds
+        self._metrics = {}
+        os.makedirs(directory, exist_ok=True)
+        self._start()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def counter(self, name, help, labels=(), collect=None):
+        return self._add(Counter(name, help, labels, 'counter', collect=collect))
+
+    def gauge(self, name, help, labels=(), mode='sum', collect=None):
+        if mode not in ('sum', 'max'):
+            raise ValueError(f"Unknown gauge mode: {mode}")
+        return self._add(Gauge(name, help, labels, 'gauge', mode=mode, collect=collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, 'histogram', buckets=sorted(buckets)))
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _start(self):
+        self._path = os.path.join(self.directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # A forked worker starts from zero with its own snapshot file
+        for metric in self._metrics.values():
+            metric._reset()
+        self._start()
+
+    def snapshot(self):
+        """This process's metrics as a JSON-safe dict"""
+        snapshot = {}
+        for name, metric in list(self._metrics.items()):
+            try:
+                samples = metric._samples()
+            except Exception as e:
+                logger.warning('Metric %s could not be collected: %s', name, e)
+                continue
+            snapshot[name] = {
+                'type': metric.kind,
+                'help': metric.help,
+                'labels': list(metric.labels),
+                'mode': metric.mode,
+                'buckets': metric.buckets,
+                'samples': samples
+            }
+        return snapshot
+
+    def write(self):
+        """Replace this process's snapshot file"""
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, separators=(',', ':'))
+        os.replace(tmp_path, self._path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write()
+            except (OSError, TypeError, ValueError) as e:
+                logger.error('Metrics snapshot failed: %s', e)
+
+    def render(self):
+        """Prometheus text exposition of every process's metrics"""
+        self.write()
+        with open(os.path.join(self.directory, 'archive.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            snapshots = [self._archive_stale()]
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.json') and entry.name != 'archive.json':
+                    snapshot = self._load(entry.path)
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+        return _format(_merge(snapshots))
+
+    def _archive_stale(self):
+        """Fold snapshots of exited processes into the archive and return it"""
+        archive_path = os.path.join(self.directory, 'archive.json')
+        archive = self._load(archive_path) or {}
+        now = time.time()
+        stale = []
+        for entry in os.scandir(self.directory):
+            if (entry.name.endswith('.json') and entry.name != 'archive.json'
+                    and entry.path != self._path and now - entry.stat().st_mtime > self.stale_seconds):
+                stale.append(entry.path)
+        if not stale:
+            return archive
+
+        snapshots = [archive] + [self._load(path) or {} for path in stale]
+        archive = _merge(snapshots, keep_gauges=False)
+        tmp_path = archive_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(archive, f, separators=(',', ':'))
+        os.replace(tmp_path, archive_path)
+        for path in stale:
+            os.unlink(path)
+        return archive
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('Skipping unreadable metrics snapshot %s', os.path.basename(path))
+            return None
+
+
+def _merge(snapshots, keep_gauges=True):
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not keep_gauges:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            samples = target['samples']
+            for labels, value in (metric['samples'].items() if isinstance(metric['samples'], dict)
+                                  else ((json.dumps(labels), value) for labels, value in metric['samples'])):
+                current = samples.get(labels)
+                if current is None:
+                    samples[labels] = value
+                elif metric['type'] == 'histogram':
+                    samples[labels] = [a + b for a, b in zip(current, value)]
+                elif metric['type'] == 'gauge' and metric['mode'] == 'max':
+                    samples[labels] = max(current, value)
+                else:
+                    samples[labels] = current + value
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format(merged):
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        help_text = metric['help'].replace('\\', '\\\\').replace('\n', '\\n')
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric['samples']):
+            values = json.loads(key)
+            value = metric['samples'][key]
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_label_text(metric['labels'], values)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], value):
+                cumulative += count
+                labels = _label_text(metric['labels'], values, [('le', bound)])
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(metric['labels'], values)} {value[-2]}")
+            lines.append(f"{name}_count{_label_text(metric['labels'], values)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
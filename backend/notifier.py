@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import logging
+import queue
+import random
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPMailer:
+    """One persistent, authenticated SMTP connection.
+
+    The connection is opened on first use and reused for later messages.
+    After ``keepalive_seconds`` without traffic it is checked with NOOP
+    before sending, and a dropped connection is reopened once per message.
+    ``close`` is called by the dispatcher when the channel has been idle.
+    """
+
+    def __init__(self, server, port, username, password, timeout=30, keepalive_seconds=60):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.keepalive_seconds = keepalive_seconds
+        self.connects = 0
+        self._smtp = None
+        self._last_used = 0
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        smtp.starttls()
+        smtp.login(self.username, self.password)
+        self._smtp = smtp
+        self.connects += 1
+
+    def _ensure_connected(self):
+        if self._smtp is not None and time.monotonic() - self._last_used > self.keepalive_seconds:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected('NOOP failed')
+            except (smtplib.SMTPException, OSError):
+                self._discard()
+        if self._smtp is None:
+            self._connect()
+
+    def _discard(self):
+        try:
+            self._smtp.close()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def send(self, message):
+        """Send an email.message.Message, reconnecting once if the server hung up"""
+        for attempt in range(2):
+            self._ensure_connected()
+            try:
+                self._smtp.send_message(message)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._discard()
+                if attempt:
+                    raise
+
+    def send_batch(self, messages):
+        errors = []
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+class _Channel:
+    def __init__(self, name, batch_size, max_retries, base_backoff, max_queue_size):
+        self.name = name
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.retry_heap = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.batches = 0
+        self.send_seconds = 0.0
+        self.last_error = None
+
+
+class NotificationDispatcher:
+    """Deliver push and email notifications from background worker pools.
+
+    Each channel has its own bounded queue, retry queue and workers.
+    ``submit`` only enqueues, so alert checks never wait on FCM or SMTP.
+    Workers take up to ``batch_size`` messages at a time and hand them to
+    the channel's sender, which returns one error (or None) per message.
+    Failed messages are retried with jittered exponential backoff up to
+    ``max_retries`` times, then dropped. ``submit`` returns a Future that
+    resolves once the message is delivered or given up. ``on_batch`` is
+    called after every send with the channel name, elapsed seconds, batch
+    size and number of failed messages.
+    """
+
+    def __init__(self, idle_seconds=300, on_batch=None):
+        self.idle_seconds = idle_seconds
+        self.on_batch = on_batch
+        self._channels = {}
+        self._counter = itertools.count()
+
+    def add_channel(self, name, sender_factory, workers=1, batch_size=1, max_retries=3,
+                    base_backoff=2.0, max_queue_size=1000):
+        """Start workers for a channel
+
+        ``sender_factory`` is called once per worker and returns an object
+        with ``send_batch(items) -> errors`` and, optionally, ``close()``,
+        which is called when the worker has been idle for ``idle_seconds``.
+        """
+        channel = _Channel(name, batch_size, max_retries, base_backoff, max_queue_size)
+        self._channels[name] = channel
+        for i in range(workers):
+            threading.Thread(target=self._work, args=(channel, sender_factory()),
+                             name=f"notify-{name}-{i}", daemon=True).start()
+
+    def submit(self, channel_name, item):
+        """Queue an item for delivery; returns a Future"""
+        channel = self._channels[channel_name]
+        future = Future()
+        try:
+            channel.queue.put_nowait((item, 0, future))
+        except queue.Full:
+            with channel.lock:
+                channel.dropped += 1
+            logger.warning("Notification queue '%s' full, dropping message", channel_name)
+            future.set_exception(RuntimeError(f"Notification queue '{channel_name}' is full"))
+        return future
+
+    def stats(self):
+        """Delivery counters and queue depths per channel"""
+        result = {}
+        for name, channel in self._channels.items():
+            with channel.lock:
+                result[name] = {
+                    'queue_depth': channel.queue.qsize(),
+                    'retry_depth': len(channel.retry_heap),
+                    'sent': channel.sent,
+                    'failed': channel.failed,
+                    'retried': channel.retried,
+                    'dropped': channel.dropped,
+                    'avg_batch_ms': (channel.send_seconds / channel.batches * 1000) if channel.batches else None,
+                    'last_error': channel.last_error
+                }
+        return result
+
+    def _next_batch(self, channel, sender):
+        """Collect due retries and queued items, waiting until there is work"""
+        idle_since = time.monotonic()
+        while True:
+            batch = []
+            with channel.lock:
+                now = time.monotonic()
+                while channel.retry_heap and channel.retry_heap[0][0] <= now and len(batch) < channel.batch_size:
+                    batch.append(heapq.heappop(channel.retry_heap)[2])
+                wait = channel.retry_heap[0][0] - now if channel.retry_heap else 1.0
+            while len(batch) < channel.batch_size:
+                try:
+                    batch.append(channel.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                return batch
+
+            try:
+                return [channel.queue.get(timeout=max(0.01, min(wait, 1.0)))]
+            except queue.Empty:
+                if time.monotonic() - idle_since >= self.idle_seconds:
+                    close = getattr(sender, 'close', None)
+                    if close:
+                        close()
+                    idle_since = time.monotonic()
+
+    def _work(self, channel, sender):
+        while True:
+            batch = self._next_batch(channel, sender)
+            started = time.monotonic()
+            try:
+                errors = sender.send_batch([item for item, _, _ in batch])
+            except Exception as e:
+                errors = [e] * len(batch)
+            elapsed = time.monotonic() - started
+            if self.on_batch:
+                try:
+                    self.on_batch(channel.name, elapsed, len(batch), sum(1 for error in errors if error is not None))
+                except Exception:
+                    logger.exception('Error in notification batch callback')
+
+            with channel.lock:
+                channel.batches += 1
+                channel.send_seconds += elapsed
+                for (item, attempts, future), error in zip(batch, errors):
+                    if error is None:
+                        channel.sent += 1
+                        future.set_result(True)
+                        continue
+                    channel.last_error = str(error)
+                    if attempts < channel.max_retries:
+                        channel.retried += 1
+                        delay = channel.base_backoff * (2 ** attempts) * random.uniform(0.5, 1.5)
+                        heapq.heappush(channel.retry_heap,
+                                       (time.monotonic() + delay, next(self._counter), (item, attempts + 1, future)))
+                    else:
+                        channel.failed += 1
+                        logger.error("Notification on '%s' failed after %d attempts: %s",
+                                     channel.name, attempts + 1, error)
+                        future.set_exception(error if isinstance(error, Exception) else RuntimeError(str(error)))
+
+
+class FCMSender:
+    """Send a batch of FCM messages with a single send_each call"""
+
+    def __init__(self, send_each):
+        self._send_each = send_each
+
+    def send_batch(self, messages):
+        response = self._send_each(messages)
+        return [None if r.success else r.exception for r in response.responses]
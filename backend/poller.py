@@ -0,0 +1,167 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_endpoints(value, default_port='80'):
+    """Parse a comma separated list of host[:port] entries"""
+    endpoints = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if ':' not in entry:
+            entry = f"{entry}:{default_port}"
+        endpoints.append(entry)
+    return endpoints
+
+
+class CircuitBreaker:
+    """Stop polling a device after repeated failures, then probe it again.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    requests are skipped for ``open_seconds``. The next request after that
+    is a trial: success closes the circuit, failure reopens it with the
+    wait doubled (up to ``max_open_seconds``).
+    """
+
+    def __init__(self, failure_threshold=3, open_seconds=60, max_open_seconds=1800):
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.failures = 0
+        self.open_seconds = open_seconds
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.open_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Whether a request may be attempted now"""
+        return self.state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.open_seconds = self.base_open_seconds
+
+    def record_failure(self):
+        with self._lock:
+            was_trial = self.opened_at is not None
+            self.failures += 1
+            if was_trial:
+                self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+                self.opened_at = time.monotonic()
+            elif self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class DevicePoller:
+    """Poll many ESP32 sensors concurrently over pooled keep-alive sessions.
+
+    Each endpoint has its own ``requests.Session`` (so its TCP connection is
+    reused between cycles), its own timeout and its own circuit breaker. A
+    poll cycle fans out over a thread pool, so it lasts as long as the
+    slowest responsive device rather than the sum of all of them. Start
+    times are spread by up to ``jitter_seconds`` so a large fleet is not
+    hit in the same instant. ``on_fetch`` is called after every request
+    with the endpoint, path, elapsed seconds and whether it succeeded.
+    """
+
+    def __init__(self, endpoints, timeout=5, connect_timeout=3, max_workers=16,
+                 jitter_seconds=2, failure_threshold=3, open_seconds=60, on_fetch=None):
+        self.endpoints = list(endpoints)
+        self.timeout = (connect_timeout, timeout)
+        self.jitter_seconds = jitter_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='esp32-poll')
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.on_fetch = on_fetch
+        self._sessions = {}
+        self._breakers = {}
+        self._register_lock = threading.Lock()
+        for endpoint in self.endpoints:
+            self._ensure(endpoint)
+
+    def _ensure(self, endpoint):
+        if endpoint in self._sessions:
+            return
+        with self._register_lock:
+            if endpoint not in self._sessions:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0))
+                self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.open_seconds)
+                self._sessions[endpoint] = session
+
+    def fetch(self, endpoint, path='/status', timeout=None):
+        """GET path from one device and return its JSON, or None on failure"""
+        self._ensure(endpoint)
+        breaker = self._breakers[endpoint]
+        if not breaker.allow():
+            return None
+
+        started = time.monotonic()
+        try:
+            response = self._sessions[endpoint].get(f"http://{endpoint}{path}",
+                                                    timeout=timeout or self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._observe(endpoint, path, started, False)
+            breaker.record_failure()
+            logger.warning('Error fetching %s from ESP32 %s: %s', path, endpoint, e)
+            if breaker.state == 'open':
+                logger.error('Circuit open for ESP32 %s after %d failures', endpoint, breaker.failures)
+            return None
+
+        self._observe(endpoint, path, started, True)
+        breaker.record_success()
+        return data
+
+    def _observe(self, endpoint, path, started, ok):
+        if self.on_fetch:
+            self.on_fetch(endpoint, path, time.monotonic() - started, ok)
+
+    def _fetch_with_jitter(self, endpoint, delay):
+        if delay:
+            time.sleep(delay)
+        return self.fetch(endpoint)
+
+    def poll_all(self):
+        """Fetch /status from every endpoint concurrently
+
+        Yields (endpoint, data) as each device answers; devices that fail
+        or whose circuit is open are skipped.
+        """
+        futures = {}
+        for endpoint in self.endpoints:
+            if not self._breakers[endpoint].allow():
+                continue
+            delay = random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0
+            futures[self._executor.submit(self._fetch_with_jitter, endpoint, delay)] = endpoint
+
+        for future in as_completed(futures):
+            data = future.result()
+            if data:
+                yield futures[future], data
+
+    def status(self):
+        """Circuit state per endpoint"""
+        return {
+            endpoint: {'state': breaker.state, 'consecutive_failures': breaker.failures}
+            for endpoint, breaker in self._breakers.items()
+        }
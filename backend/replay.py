@@ -0,0 +1,310 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from .estimator import UsageEstimator
+from .filters import ReadingFilter
+from .forecast import ConsumptionForecaster
+from .rules import RuleEngine, features_from_readings, load_rules
+
+
+def to_epoch(value):
+    """Epoch seconds from a datetime, a number, or an ISO 8601 / numeric string"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def local_readings(store, start=None, end=None, device_id=None):
+    """Yield (ts, reading) from the local time-series store"""
+    for row in store.iter_raw(device_id=device_id, start=start, end=end):
+        yield row['ts'], row
+
+
+def firestore_readings(db, start=None, end=None, device_id=None):
+    """Yield (ts, reading) from the Firestore readings collection, oldest first"""
+    query = db.collection('readings')
+    if device_id:
+        query = query.where('device_id', '==', device_id)
+    if start is not None:
+        query = query.where('timestamp', '>=', datetime.fromtimestamp(start, timezone.utc))
+    if end is not None:
+        query = query.where('timestamp', '<', datetime.fromtimestamp(end, timezone.utc))
+    for doc in query.order_by('timestamp').stream():
+        data = doc.to_dict()
+        if data.get('timestamp') is not None:
+            yield data['timestamp'].timestamp(), data
+
+
+def export_readings(path, start=None, end=None, device_id=None):
+    """Yield (ts, reading) from a JSON-lines export of reading documents
+
+    Each line is one document with its time as ``ts`` (epoch seconds) or
+    ``timestamp`` (epoch seconds or ISO 8601). The file is expected in time
+    order; readings older than their device's previous one are skipped.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            ts = to_epoch(data['ts'] if 'ts' in data else data['timestamp'])
+            if (start is not None and ts < start) or (end is not None and ts >= end):
+                continue
+            if device_id and data.get('device_id') != device_id:
+                continue
+            yield ts, data
+
+
+def filter_from_env():
+    """A ReadingFilter with the FILTER_* settings the server uses"""
+    return ReadingFilter(window=int(os.getenv('FILTER_WINDOW', '5')),
+                         n_sigmas=float(os.getenv('FILTER_SIGMAS', '3')),
+                         min_deviation=float(os.getenv('FILTER_MIN_DEVIATION', '3')),
+                         smoothing=os.getenv('FILTER_SMOOTHING', 'kalman'),
+                         process_noise=float(os.getenv('FILTER_PROCESS_NOISE', '5')),
+                         measurement_noise=float(os.getenv('FILTER_MEASUREMENT_NOISE', '0.5')),
+                         ema_seconds=float(os.getenv('FILTER_EMA_SECONDS', '120')))
+
+
+def forecaster_from_env():
+    """A ConsumptionForecaster with the FORECAST_* settings the server uses"""
+    return ConsumptionForecaster(decay=float(os.getenv('FORECAST_DECAY', '0.2')),
+                                 min_hours=int(os.getenv('FORECAST_MIN_HOURS', '24')),
+                                 horizon_hours=int(os.getenv('FORECAST_HORIZON_DAYS', '14')) * 24,
+                                 confidence=float(os.getenv('FORECAST_CONFIDENCE', '0.8')))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Replay:
+    """Run readings through the alert rules with a simulated clock.
+
+    Readings flow through a generator pipeline, as they do live: each goes
+    through a per-device reading filter from ``new_filter`` (if given),
+    which drops glitches, then the accepted raw reading is paired with the
+    previous accepted one of its device. Pairs are grouped into batches of
+    ``batch_size``, and each batch is matched by the rule engine in one
+    vectorized pass. Cooldowns are kept in reading time in a dict private
+    to the replay. Predictive alerts are simulated with a forecaster from
+    ``new_forecaster`` fed the smoothed readings, falling back to a usage
+    estimator until a device has a profile. Nothing is sent, stored or
+    published.
+
+    Compressed readings, such as the Firestore mirror's, leave out points
+    that were seen live. With ``max_gap_seconds``, a reading further than
+    that from its device's previous one is paired with itself, so level
+    rules still apply but no change is measured across the gap.
+    """
+
+    def __init__(self, rule_set, usage_window_seconds=24 * 3600, usage_method='least_squares',
+                 predictive_cooldown_seconds=300, batch_size=20000, max_gap_seconds=None,
+                 new_filter=None, new_forecaster=ConsumptionForecaster):
+        self.engine = RuleEngine(rule_set)
+        self.new_filter = new_filter
+        self.new_forecaster = new_forecaster
+        self.usage_window_seconds = usage_window_seconds
+        self.usage_method = usage_method
+        self.predictive_cooldown_seconds = predictive_cooldown_seconds
+        self.batch_size = batch_size
+        self.max_gap_seconds = max_gap_seconds
+
+    def run(self, readings, limit=1000):
+        """Replay (ts, reading) pairs and return a report of the alerts that would have fired
+
+        Counts cover every alert; only the earliest ``limit`` are listed.
+        """
+        started = time.monotonic()
+        state = {'readings': 0, 'skipped': 0, 'rejected': 0, 'devices': set(), 'first': None, 'last': None}
+        counts = Counter()
+        by_device = Counter()
+        alerts = []
+        cooldowns = {}
+
+        def record(ts, device_id, rule, alert_type, severity, current, previous):
+            counts[rule] += 1
+            by_device[device_id] += 1
+            if len(alerts) < limit:
+                alerts.append({
+                    'ts': ts,
+                    'time': datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                    'device_id': device_id,
+                    'rule': rule,
+                    'type': alert_type,
+                    'severity': severity,
+                    'fill_percentage': current.get('fill_percentage'),
+                    'previous_fill_percentage': previous.get('fill_percentage') if previous else None
+                })
+
+        predictive = []
+        pairs = self._pairs(readings, state, predictive)
+        for batch in _chunks(pairs, self.batch_size):
+            features = features_from_readings([row[2] for row in batch], [row[3] for row in batch])
+            firings = self.engine.evaluate([row[0] for row in batch], [row[1] for row in batch],
+                                           features, cooldowns=cooldowns)
+            found = []
+            for firing in firings:
+                device_id, ts, current, previous = batch[firing.row]
+                found.append((ts, device_id, firing.rule.name, firing.rule.alert_type, firing.severity,
+                              current, previous))
+            # Predictive alerts simulated while the batch filled, merged in
+            # reading time so the listed alerts are the earliest ones
+            found.extend(predictive)
+            predictive.clear()
+            found.sort(key=lambda alert: alert[0])
+            for alert in found:
+                record(*alert)
+        for alert in predictive:
+            record(*alert)
+
+        alerts.sort(key=lambda alert: alert['ts'])
+        total = sum(counts.values())
+        return {
+            'readings': state['readings'],
+            'skipped_out_of_order': state['skipped'],
+            'rejected_outliers': state['rejected'],
+            'devices': len(state['devices']),
+            'from': state['first'],
+            'to': state['last'],
+            'alerts_total': total,
+            'by_rule': dict(counts),
+            'by_device': dict(by_device),
+            'alerts': alerts,
+            'truncated': total > len(alerts),
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        }
+
+    def _pairs(self, readings, state, predictive):
+        """Yield (device_id, ts, current, previous), appending simulated predictive alerts to ``predictive``"""
+        previous = {}
+        filters = {}
+        estimators = {}
+        forecaster = self.new_forecaster()
+        last_predictive = {}
+        for ts, reading in readings:
+            device_id = reading.get('device_id', 'unknown')
+            last = previous.get(device_id)
+            if last is not None and ts < last[0]:
+                state['skipped'] += 1
+                continue
+
+            cleaned = reading
+            if self.new_filter is not None:
+                reading_filter = filters.get(device_id)
+                if reading_filter is None:
+                    reading_filter = filters[device_id] = self.new_filter()
+                cleaned = reading_filter.update(reading, ts)
+                if cleaned is None:
+                    state['rejected'] += 1
+                    continue
+            previous[device_id] = (ts, reading)
+            state['readings'] += 1
+            state['devices'].add(device_id)
+            state['first'] = ts if state['first'] is None else min(state['first'], ts)
+            state['last'] = ts if state['last'] is None else max(state['last'], ts)
+
+            estimator = estimators.get(device_id)
+            if estimator is None:
+                estimator = estimators[device_id] = UsageEstimator(self.usage_window_seconds, self.usage_method)
+            gallons = cleaned.get('gallons') or 0
+            estimator.add(gallons, ts)
+            forecaster.add(device_id, ts, cleaned.get('gallons'))
+
+            # Alerts are only checked once a device has a previous reading
+            if last is None:
+                continue
+            if self.max_gap_seconds is not None and ts - last[0] > self.max_gap_seconds:
+                last = (ts, reading)
+            yield device_id, ts, reading, last[1]
+
+            forecast = forecaster.forecast(device_id, gallons, now=ts)
+            if forecast is None:
+                days_remaining = estimator.days_remaining(gallons, now=ts)
+            else:
+                hours = forecast['hours_to_empty']
+                days_remaining = hours / 24 if hours is not None else None
+            if days_remaining is not None and days_remaining <= 1:
+                fired = last_predictive.get(device_id)
+                if fired is None or ts - fired > self.predictive_cooldown_seconds:
+                    last_predictive[device_id] = ts
+                    predictive.append((ts, device_id, 'predictive', 'predictive', 'critical', reading, last[1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report which alerts would have fired over stored readings')
+    parser.add_argument('--rules', default=os.getenv('ALERT_RULES_FILE'),
+                        help='Alert rule set JSON (default: $ALERT_RULES_FILE)')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--db', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'readings.db'),
+                        help='Local readings database (default: $DATA_DIR/readings.db)')
+    source.add_argument('--export', help='JSON-lines export of reading documents')
+    parser.add_argument('--from', dest='start', help='Start time, ISO 8601 or epoch seconds')
+    parser.add_argument('--to', dest='end', help='End time, ISO 8601 or epoch seconds')
+    parser.add_argument('--device', help='Only replay this device_id')
+    parser.add_argument('--limit', type=int, default=50, help='Alerts to list (default: 50)')
+    parser.add_argument('--usage-window-hours', type=float,
+                        default=float(os.getenv('USAGE_WINDOW_HOURS', '24')))
+    parser.add_argument('--predictive-cooldown-minutes', type=float,
+                        default=float(os.getenv('CRITICAL_COOLDOWN', '5')))
+    parser.add_argument('--no-filter', action='store_true',
+                        help='Replay readings without the outlier filter (default: READING_FILTER)')
+    parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+    args = parser.parse_args(argv)
+
+    if not args.rules:
+        parser.error('--rules is required when ALERT_RULES_FILE is not set '
+                     '(backend/alert_rules.example.json is a starting point)')
+
+    start = to_epoch(args.start) if args.start else None
+    end = to_epoch(args.end) if args.end else None
+    if args.export:
+        readings = export_readings(args.export, start, end, args.device)
+    else:
+        from .timeseries import TimeSeriesStore
+        readings = local_readings(TimeSeriesStore(args.db), start, end, args.device)
+
+    # The filter and forecaster take the same settings as the server
+    filtering = not args.no_filter and os.getenv('READING_FILTER', 'true').lower() == 'true'
+    replay = Replay(load_rules(args.rules),
+                    usage_window_seconds=args.usage_window_hours * 3600,
+                    usage_method=os.getenv('USAGE_RATE_METHOD', 'least_squares'),
+                    predictive_cooldown_seconds=args.predictive_cooldown_minutes * 60,
+                    new_filter=filter_from_env if filtering else None,
+                    new_forecaster=forecaster_from_env)
+    report = replay.run(readings, limit=args.limit)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"Replayed {report['readings']} readings from {report['devices']} device(s) "
+          f"in {report['elapsed_ms']:.0f} ms")
+    print(f"{report['alerts_total']} alerts would have fired")
+    for rule, count in sorted(report['by_rule'].items(), key=lambda item: -item[1]):
+        print(f"  {rule}: {count}")
+    for alert in report['alerts']:
+        print(f"{alert['time']}  {alert['device_id']}  {alert['rule']} ({alert['severity']})  "
+              f"{alert['fill_percentage']:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
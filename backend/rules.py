@@ -0,0 +1,191 @@
+import json
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Columns every rule condition can refer to
+FEATURES = ('fill_percentage', 'previous_fill_percentage', 'change', 'drop', 'rise',
+            'gallons', 'battery_voltage')
+
+OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal
+}
+
+Rule = namedtuple('Rule', 'name alert_type group severity cooldown_seconds conditions')
+Firing = namedtuple('Firing', 'row rule severity')
+
+
+def load_rules(path):
+    """Read a rule set ({"severity_levels": [...], "rules": [...]}) from a JSON file"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def features_from_readings(current_readings, previous_readings):
+    """Build the (n, len(FEATURES)) feature matrix for pairs of readings"""
+    n = len(current_readings)
+    fill = np.fromiter((r.get('fill_percentage') or 0 for r in current_readings), float, n)
+    previous = np.fromiter((r.get('fill_percentage') or 0 for r in previous_readings), float, n)
+    delta = fill - previous
+    columns = {
+        'fill_percentage': fill,
+        'previous_fill_percentage': previous,
+        'change': np.abs(delta),
+        'drop': np.maximum(-delta, 0),
+        'rise': np.maximum(delta, 0),
+        'gallons': np.fromiter((r.get('gallons') or 0 for r in current_readings), float, n),
+        'battery_voltage': np.fromiter((r.get('battery_voltage') or 0 for r in current_readings), float, n)
+    }
+    return np.column_stack([columns[name] for name in FEATURES]) if n else np.empty((0, len(FEATURES)))
+
+
+class _ConditionTable:
+    """Rules compiled to a condition table and a rule-by-condition matrix.
+
+    Every distinct (feature, operator, value) condition is evaluated once
+    per batch as a column operation; a rule matches a reading when all of
+    its conditions do, which is one matrix product for the whole batch.
+    """
+
+    def __init__(self, condition_lists):
+        conditions = []
+        index = {}
+        membership = []
+        for rule_conditions in condition_lists:
+            columns = []
+            for feature, op, value in rule_conditions:
+                if feature not in FEATURES:
+                    raise ValueError(f"Unknown alert rule feature: {feature}")
+                if op not in OPERATORS:
+                    raise ValueError(f"Unknown alert rule operator: {op}")
+                key = (FEATURES.index(feature), op, float(value))
+                if key not in index:
+                    index[key] = len(conditions)
+                    conditions.append(key)
+                columns.append(index[key])
+            membership.append(columns)
+
+        self.matrix = np.zeros((len(condition_lists), len(conditions)), dtype=np.int32)
+        for row, columns in enumerate(membership):
+            self.matrix[row, columns] = 1
+        self.counts = self.matrix.sum(axis=1)
+
+        # Group conditions by operator so each operator runs once per batch
+        self.by_operator = []
+        for op in OPERATORS:
+            ids = [i for i, (_, cond_op, _) in enumerate(conditions) if cond_op == op]
+            if ids:
+                self.by_operator.append((OPERATORS[op], np.array(ids),
+                                         np.array([conditions[i][0] for i in ids]),
+                                         np.array([conditions[i][2] for i in ids])))
+        self.size = len(conditions)
+
+    def match(self, features):
+        """Boolean (n, rules) matrix of which rules match which rows"""
+        results = np.zeros((len(features), self.size), dtype=np.int32)
+        for op, ids, feature_ids, values in self.by_operator:
+            results[:, ids] = op(features[:, feature_ids], values)
+        return (results @ self.matrix.T) == self.counts
+
+
+class RuleEngine:
+    """Evaluate declarative alert rules over batches of readings.
+
+    A rule set has ``severity_levels`` and ``rules``. Each entry has a list
+    of ``[feature, operator, value]`` conditions under ``when`` that must
+    all hold (features are listed in FEATURES). Severity levels are tried
+    in order and the first match names the reading's level severity,
+    ``default_severity`` otherwise. Rules share a ``group``; within a group
+    the first matching rule wins, as in an if/elif chain, and fires unless
+    it is cooling down for that device. A rule's ``severity`` is either a
+    fixed name or ``"level"`` for the level severity.
+
+    Matching is vectorized across the whole batch. Cooldowns are tracked
+    per rule and device in reading time, so only rows that matched a rule
+    are visited in Python. ``on_suppressed`` is called with the device_id
+    and Rule whenever a cooldown holds a firing back.
+    """
+
+    def __init__(self, rule_set, default_severity='normal', on_suppressed=None):
+        self.rule_set = rule_set
+        self.on_suppressed = on_suppressed
+        self.default_severity = default_severity
+        levels = rule_set.get('severity_levels', [])
+        self.level_names = np.array([level['severity'] for level in levels] + [default_severity])
+        self._levels = _ConditionTable([level['when'] for level in levels])
+
+        self.rules = []
+        for spec in rule_set.get('rules', []):
+            self.rules.append(Rule(
+                name=spec['name'],
+                alert_type=spec.get('alert_type', spec['name']),
+                group=spec.get('group', spec['name']),
+                severity=spec.get('severity', 'level'),
+                cooldown_seconds=float(spec.get('cooldown_minutes', 0)) * 60,
+                conditions=[tuple(c) for c in spec['when']]
+            ))
+        self._rules = _ConditionTable([rule.conditions for rule in self.rules])
+
+        groups = []
+        for rule in self.rules:
+            if rule.group not in groups:
+                groups.append(rule.group)
+        self._groups = [np.array([i for i, rule in enumerate(self.rules) if rule.group == group])
+                        for group in groups]
+        self.cooldowns = {}
+        self._lock = threading.Lock()
+
+    def level_severity(self, features):
+        """Level severity name for each row"""
+        if self._levels.size == 0:
+            return np.full(len(features), self.default_severity)
+        matched = self._levels.match(features)
+        # argmax finds the first match; rows without one get the default
+        first = np.where(matched.any(axis=1), matched.argmax(axis=1), len(self.level_names) - 1)
+        return self.level_names[first]
+
+    def evaluate(self, device_ids, timestamps, features, cooldowns=None):
+        """Return the Firings for a batch, oldest first
+
+        ``cooldowns`` maps (device_id, rule name) to the time the rule last
+        fired; it defaults to the engine's own state, pass a fresh dict to
+        evaluate without touching it.
+        """
+        cooldowns = self.cooldowns if cooldowns is None else cooldowns
+        if not len(features) or not self.rules:
+            return []
+
+        matched = self._rules.match(features)
+        winners = np.zeros_like(matched)
+        for members in self._groups:
+            group_matched = matched[:, members]
+            rows = np.nonzero(group_matched.any(axis=1))[0]
+            winners[rows, members[group_matched[rows].argmax(axis=1)]] = True
+
+        rows, rule_ids = np.nonzero(winners)
+        if not len(rows):
+            return []
+        severities = self.level_severity(features[rows])
+        timestamps = np.asarray(timestamps, dtype=float)
+
+        firings = []
+        with self._lock:
+            for i in np.argsort(timestamps[rows], kind='stable'):
+                row, rule = int(rows[i]), self.rules[rule_ids[i]]
+                ts = timestamps[row]
+                key = (device_ids[row], rule.name)
+                last = cooldowns.get(key)
+                if rule.cooldown_seconds and last is not None and ts - last <= rule.cooldown_seconds:
+                    if self.on_suppressed:
+                        self.on_suppressed(device_ids[row], rule)
+                    continue
+                cooldowns[key] = ts
+                severity = str(severities[i]) if rule.severity == 'level' else rule.severity
+                firings.append(Firing(row, rule, severity))
+        return firings
@@ -0,0 +1,268 @@
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+KINDS = ('refill', 'draw', 'idle')
+
+
+class _Track:
+    """One device's open segment: where it started, its furthest point so far and the latest reading"""
+
+    __slots__ = ('kind', 'start_ts', 'start_gallons', 'pivot_ts', 'pivot_gallons', 'last_ts', 'last_gallons')
+
+    def __init__(self, ts, gallons):
+        self.last_ts = ts
+        self.last_gallons = gallons
+        self.open('idle', ts, gallons, ts, gallons)
+
+    def open(self, kind, start_ts, start_gallons, pivot_ts, pivot_gallons):
+        self.kind = kind
+        self.start_ts = start_ts
+        self.start_gallons = start_gallons
+        self.pivot_ts = pivot_ts
+        self.pivot_gallons = pivot_gallons
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        track = cls(data['last_ts'], data['last_gallons'])
+        for name in cls.__slots__:
+            setattr(track, name, data[name])
+        return track
+
+
+class EventSegmenter:
+    """Split each device's level into refill, draw and idle events.
+
+    A draw continues while the level keeps setting new lows, a refill while
+    it keeps setting new highs. Either one ends at its furthest point (the
+    pivot) when the level turns back by more than ``min_gallons``, which
+    starts the opposite event, or when no new low or high has come for
+    ``idle_seconds``, which starts an idle period. An idle period ends at
+    the last reading within ``min_gallons`` of its starting level. A gap
+    of more than ``max_gap_seconds`` between readings closes the open event
+    and starts over.
+
+    ``add`` takes one reading at a time in O(1). ``backfill`` takes a
+    device's stored history as arrays and finds each change point with one
+    vectorized scan, then applies the same step as ``add``, so both give
+    the same events. Both return the events they closed.
+    """
+
+    def __init__(self, min_gallons=10.0, idle_seconds=1800, max_gap_seconds=7200, ready=True):
+        self.min_gallons = min_gallons
+        self.idle_seconds = idle_seconds
+        self.max_gap_seconds = max_gap_seconds
+        self._tracks = {}
+        self._lock = threading.Lock()
+        # Readings that arrive before a rebuilt segmenter is adopted
+        self._ready = ready
+        self._pending = deque(maxlen=100000)
+
+    def add(self, device_id, ts, gallons):
+        """Fold one reading in; returns the events it closed"""
+        if gallons is None:
+            return []
+        with self._lock:
+            if not self._ready:
+                self._pending.append((device_id, ts, float(gallons)))
+                return []
+            return self._add(device_id, ts, float(gallons))
+
+    def _add(self, device_id, ts, gallons):
+        track = self._tracks.get(device_id)
+        if track is None:
+            self._tracks[device_id] = _Track(ts, gallons)
+            return []
+        if ts <= track.last_ts:
+            return []
+        closed = []
+        self._step(device_id, track, ts, gallons, closed)
+        return closed
+
+    def _step(self, device_id, track, ts, gallons, closed):
+        if ts - track.last_ts > self.max_gap_seconds:
+            if track.kind == 'idle':
+                self._close(device_id, track, track.last_ts, track.last_gallons, closed)
+            else:
+                self._close(device_id, track, track.pivot_ts, track.pivot_gallons, closed)
+            track.open('idle', ts, gallons, ts, gallons)
+        elif track.kind == 'idle':
+            if abs(gallons - track.start_gallons) > self.min_gallons:
+                self._close(device_id, track, track.last_ts, track.last_gallons, closed)
+                kind = 'draw' if gallons < track.start_gallons else 'refill'
+                track.open(kind, track.last_ts, track.last_gallons, ts, gallons)
+        else:
+            # How far past the pivot the level moved in this event's direction
+            progress = gallons - track.pivot_gallons if track.kind == 'refill' else track.pivot_gallons - gallons
+            if progress > 0:
+                track.pivot_ts, track.pivot_gallons = ts, gallons
+            elif -progress > self.min_gallons:
+                self._close(device_id, track, track.pivot_ts, track.pivot_gallons, closed)
+                kind = 'draw' if track.kind == 'refill' else 'refill'
+                track.open(kind, track.pivot_ts, track.pivot_gallons, ts, gallons)
+            elif ts - track.pivot_ts >= self.idle_seconds:
+                self._close(device_id, track, track.pivot_ts, track.pivot_gallons, closed)
+                track.open('idle', track.pivot_ts, track.pivot_gallons, track.pivot_ts, track.pivot_gallons)
+        track.last_ts, track.last_gallons = ts, gallons
+
+    @staticmethod
+    def _close(device_id, track, end_ts, end_gallons, closed):
+        if end_ts > track.start_ts:
+            closed.append(make_event(device_id, track.kind, track.start_ts, track.start_gallons,
+                                     end_ts, end_gallons))
+
+    def backfill(self, device_id, timestamps, gallons, chunk_size=256):
+        """Fold a device's readings in, as arrays in time order; returns the events closed"""
+        ts = np.asarray(timestamps, dtype=float)
+        values = np.asarray(gallons, dtype=float)
+        keep = ~np.isnan(values)
+        ts, values = ts[keep], values[keep]
+        closed = []
+        with self._lock:
+            track = self._tracks.get(device_id)
+            if track is not None:
+                newer = ts > track.last_ts
+                ts, values = ts[newer], values[newer]
+            elif len(ts):
+                track = self._tracks[device_id] = _Track(ts[0], values[0])
+                ts, values = ts[1:], values[1:]
+            # Out-of-order rows would be skipped by add, so skip them here too
+            if len(ts):
+                ordered = ts > np.maximum.accumulate(np.concatenate(([track.last_ts], ts[:-1])))
+                ts, values = ts[ordered], values[ordered]
+
+            i = 0
+            window = chunk_size
+            while i < len(ts):
+                j = self._scan(track, ts[i:i + window], values[i:i + window])
+                if j is None:
+                    i += window
+                    window *= 2
+                    continue
+                self._step(device_id, track, float(ts[i + j]), float(values[i + j]), closed)
+                i += j + 1
+                window = chunk_size
+        return closed
+
+    def _scan(self, track, ts, values):
+        """Offset of the first reading that changes the event, or None
+
+        Readings before it only move the pivot and the latest reading,
+        which are applied to ``track``.
+        """
+        gaps = np.diff(np.concatenate(([track.last_ts], ts))) > self.max_gap_seconds
+        if track.kind == 'idle':
+            changes = gaps | (np.abs(values - track.start_gallons) > self.min_gallons)
+            pivot_ts, pivot_gallons = track.pivot_ts, track.pivot_gallons
+        else:
+            sign = 1.0 if track.kind == 'refill' else -1.0
+            signed = sign * values
+            best_before = np.maximum.accumulate(np.concatenate(([sign * track.pivot_gallons], signed)))[:-1]
+            progress = signed > best_before
+            positions = np.where(progress, np.arange(len(ts)), -1)
+            last_progress = np.maximum.accumulate(positions)
+            pivot_times = np.where(last_progress >= 0, ts[np.maximum(last_progress, 0)], track.pivot_ts)
+            turned = ~progress & (best_before - signed > self.min_gallons)
+            stalled = ~progress & (ts - pivot_times >= self.idle_seconds)
+            changes = gaps | turned | stalled
+
+        hits = np.flatnonzero(changes)
+        end = hits[0] if len(hits) else len(ts)
+        if end > 0:
+            if track.kind != 'idle':
+                pivot_ts = pivot_times[end - 1]
+                pivot_gallons = sign * best_before[end] if end < len(ts) else sign * max(best_before[-1], signed[-1])
+            track.pivot_ts, track.pivot_gallons = float(pivot_ts), float(pivot_gallons)
+            track.last_ts, track.last_gallons = float(ts[end - 1]), float(values[end - 1])
+        return int(hits[0]) if len(hits) else None
+
+    def current(self, device_id):
+        """The device's open event, up to its latest reading, or None"""
+        with self._lock:
+            track = self._tracks.get(device_id)
+            if track is None or track.last_ts <= track.start_ts:
+                return None
+            end_ts, end_gallons = track.last_ts, track.last_gallons
+            if track.kind != 'idle':
+                end_ts, end_gallons = track.pivot_ts, track.pivot_gallons
+            return dict(make_event(device_id, track.kind, track.start_ts, track.start_gallons,
+                                   max(end_ts, track.start_ts), end_gallons), ongoing=True)
+
+    def last_timestamps(self):
+        """Time of the latest reading folded in, per device"""
+        with self._lock:
+            return {device_id: track.last_ts for device_id, track in self._tracks.items()}
+
+    def adopt(self, other):
+        """Take over another segmenter's devices, e.g. one rebuilt from storage
+
+        Readings that arrived while this one was waiting are replayed on
+        top; returns the events they closed.
+        """
+        with other._lock:
+            tracks = dict(other._tracks)
+        with self._lock:
+            self._tracks.update(tracks)
+            closed = []
+            while self._pending:
+                closed.extend(self._add(*self._pending.popleft()))
+            self._ready = True
+        return closed
+
+    def save(self, path):
+        """Write the open events to a JSON file, atomically"""
+        with self._lock:
+            data = {device_id: track.to_dict() for device_id, track in self._tracks.items()}
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Read state saved by ``save``; returns False if there is no file"""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._tracks = {device_id: _Track.from_dict(track) for device_id, track in data.items()}
+        return True
+
+
+def make_event(device_id, kind, start_ts, start_gallons, end_ts, end_gallons):
+    volume = abs(end_gallons - start_gallons)
+    hours = (end_ts - start_ts) / 3600
+    return {
+        'device_id': device_id,
+        'kind': kind,
+        'start': start_ts,
+        'end': end_ts,
+        'start_gallons': round(start_gallons, 1),
+        'end_gallons': round(end_gallons, 1),
+        'volume': round(volume, 1),
+        'rate': round(volume / hours, 2) if hours > 0 else 0.0
+    }
+
+
+def summarize_events(events):
+    """Count, volume and hours per kind, and the share of time the pump ran"""
+    summary = {kind: {'count': 0, 'volume': 0.0, 'hours': 0.0} for kind in KINDS}
+    for event in events:
+        totals = summary.get(event['kind'])
+        if totals is not None:
+            totals['count'] += 1
+            totals['volume'] += event['volume']
+            totals['hours'] += (event['end'] - event['start']) / 3600
+    covered = sum(totals['hours'] for totals in summary.values())
+    for totals in summary.values():
+        totals['volume'] = round(totals['volume'], 1)
+        totals['hours'] = round(totals['hours'], 2)
+    summary['pump_duty'] = round(summary['refill']['hours'] / covered, 4) if covered else None
+    return summary
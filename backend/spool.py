@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f"Cannot spool {type(value).__name__}")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    """Append-only on-disk spool for documents that could not be written.
+
+    Records go to segment files named ``<created ns>-<pid>.open``; one
+    process only ever appends to its own segment, so several gunicorn
+    workers can share the directory. Each record is one line holding a
+    CRC32 and the JSON document, written with a single unbuffered write so
+    a crash leaves at most one torn line, which is skipped on read.
+    ``fsync`` is batched: after ``fsync_batch`` records or every
+    ``fsync_interval`` seconds, whichever comes first. A segment is sealed
+    (renamed to ``.seg``) once it reaches ``segment_max_bytes`` or
+    ``segment_max_age`` seconds, and only sealed segments are handed out
+    for replay. When the spool grows past ``max_bytes`` the oldest sealed
+    segments are discarded.
+    """
+
+    def __init__(self, directory, segment_max_bytes=4194304, segment_max_age=60,
+                 fsync_interval=1.0, fsync_batch=100, max_bytes=536870912):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._opened_at = None
+        self._size = 0
+        self._unsynced = 0
+        self._spooled = 0
+        self._discarded_segments = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, collection, doc_id, data):
+        self.append_many([(collection, doc_id, data)])
+
+    def append_many(self, items):
+        """Durably record (collection, doc_id, data) documents"""
+        lines = []
+        for collection, doc_id, data in items:
+            record = json.dumps({'collection': collection, 'id': doc_id, 'data': data},
+                                default=_encode_value, separators=(',', ':')).encode()
+            lines.append(b'%08x %s\n' % (zlib.crc32(record), record))
+        if not lines:
+            return
+
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(b''.join(lines))
+            self._size += sum(len(line) for line in lines)
+            self._unsynced += len(lines)
+            self._spooled += len(lines)
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+            if self._size >= self.segment_max_bytes:
+                self._seal()
+
+    def segments(self):
+        """Sealed segment paths, oldest first
+
+        Open segments left behind by processes that no longer exist are
+        sealed first so their records are not stranded.
+        """
+        for name in os.listdir(self.directory):
+            if not name.endswith('.open'):
+                continue
+            pid = int(name[:-5].split('-')[1])
+            if pid != os.getpid() and not _pid_alive(pid):
+                path = os.path.join(self.directory, name)
+                try:
+                    os.replace(path, path[:-5] + '.seg')
+                except FileNotFoundError:
+                    pass  # Another worker sealed it first
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory) if name.endswith('.seg'))
+
+    def read(self, path):
+        """Yield (collection, doc_id, data) from a segment, skipping torn records"""
+        with open(path, 'rb') as f:
+            for line in f:
+                crc, _, record = line.rstrip(b'\n').partition(b' ')
+                try:
+                    if int(crc, 16) != zlib.crc32(record):
+                        raise ValueError('checksum mismatch')
+                    doc = json.loads(record, object_hook=_decode_object)
+                except ValueError:
+                    logger.warning('Skipping corrupt record in spool segment %s', os.path.basename(path))
+                    continue
+                yield doc['collection'], doc['id'], doc['data']
+
+    def remove(self, path):
+        """Delete a segment once all of its records have been written"""
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Sync and seal the current segment"""
+        with self._lock:
+            if self._file is not None:
+                self._seal()
+
+    def stats(self):
+        """Spooled document count and the size of the spool on disk"""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory)
+                 if entry.name.endswith(('.seg', '.open'))]
+        return {
+            'segments': len(sizes),
+            'bytes': sum(sizes),
+            'spooled': self._spooled,
+            'discarded_segments': self._discarded_segments
+        }
+
+    def _open_segment(self):
+        name = f"{time.time_ns():020d}-{os.getpid()}.open"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, 'ab', buffering=0)
+        self._opened_at = time.monotonic()
+        self._size = 0
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def _seal(self):
+        self._sync()
+        self._file.close()
+        os.replace(self._path, self._path[:-5] + '.seg')
+        self._file = None
+        self._path = None
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        segments = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.seg')),
+                          key=lambda entry: entry.name)
+        total = sum(entry.stat().st_size for entry in segments)
+        for entry in segments:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            self.remove(entry.path)
+            self._discarded_segments += 1
+            logger.error('Spool over %d bytes, discarded segment %s', self.max_bytes, entry.name)
+
+    def _run(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._file is None:
+                    continue
+                try:
+                    if self._unsynced:
+                        self._sync()
+                    if time.monotonic() - self._opened_at >= self.segment_max_age:
+                        self._seal()
+                except OSError as e:
+                    logger.error('Spool sync failed: %s', e)
+
+
+class SpoolReplayer:
+    """Drain sealed spool segments into Firestore at a limited rate.
+
+    Records are re-queued on the write queue with their original document
+    IDs, so a record that did reach Firestore before the outage, or is
+    replayed twice after a crash, overwrites itself instead of duplicating.
+    A segment is deleted only after every record has been committed or
+    handed back to the spool by the write queue's failure handler; if a
+    chunk fails the replayer backs off for ``retry_interval`` seconds and
+    resumes the segment where it stopped.
+
+    ``connect`` returns the write queue to replay into, or None while
+    Firestore cannot be reached; it is called again every
+    ``retry_interval`` seconds while there are segments to replay and no
+    queue yet.
+    """
+
+    def __init__(self, spool, connect, rate=50, chunk_size=100, retry_interval=30):
+        self.spool = spool
+        self.connect = connect
+        self.write_queue = None
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.retry_interval = retry_interval
+        self.replayed = 0
+        self._progress = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                segments = self.spool.segments()
+                if segments and self.write_queue is None:
+                    self.write_queue = self.connect()
+                if self.write_queue is not None:
+                    for path in segments:
+                        if not self._replay_segment(path):
+                            break
+            except Exception:
+                logger.exception('Spool replay failed')
+            time.sleep(self.retry_interval)
+
+    def _replay_segment(self, path):
+        done = self._progress.get(path, 0)
+        chunk = []
+        for index, item in enumerate(self.spool.read(path)):
+            if index < done:
+                continue
+            chunk.append(item)
+            if len(chunk) == self.chunk_size:
+                if not self._replay_chunk(path, chunk):
+                    return False
+                chunk = []
+        if chunk and not self._replay_chunk(path, chunk):
+            return False
+
+        self.spool.remove(path)
+        self._progress.pop(path, None)
+        logger.info('Replayed spool segment %s', os.path.basename(path))
+        return True
+
+    def _replay_chunk(self, path, chunk):
+        started = time.monotonic()
+        failed_before = self.write_queue.stats()['failed_batches']
+        for collection, doc_id, data in chunk:
+            if self.write_queue.enqueue(collection, data, doc_id) is None:
+                return False
+        self.write_queue.flush()
+
+        # Every record is now in Firestore or back in the spool
+        self._progress[path] = self._progress.get(path, 0) + len(chunk)
+        if self.write_queue.stats()['failed_batches'] > failed_before:
+            return False
+        self.replayed += len(chunk)
+
+        # Rate limit so a long outage does not turn into a write burst
+        remaining = len(chunk) / self.rate - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
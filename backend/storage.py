@@ -0,0 +1,481 @@
+import bisect
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from firebase_admin import firestore
+
+from .timeseries import READING_FIELDS, TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('sqlite', 'memory', 'firestore')
+
+BUCKET_COLUMNS = ('gallons_min', 'gallons_max', 'gallons_mean', 'gallons_last',
+                  'fill_min', 'fill_max', 'fill_mean', 'fill_last')
+
+ALERTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id TEXT PRIMARY KEY,
+    device_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+CREATE INDEX IF NOT EXISTS alerts_device_ts ON alerts (device_id, ts);
+"""
+
+# One row per refill, draw or idle event, keyed by where it starts so a
+# re-run over the same readings replaces rather than duplicates
+EVENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    device_id TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    start_gallons REAL,
+    end_gallons REAL,
+    volume REAL,
+    rate REAL,
+    PRIMARY KEY (device_id, start_ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_start ON events (start_ts);
+"""
+
+EVENT_FIELDS = ('kind', 'start_gallons', 'end_gallons', 'volume', 'rate')
+
+# Every backend implements the same methods:
+#
+#   append_many(timestamped_readings)    store (ts, reading) pairs
+#   append_alert(alert, ts, alert_id)    store an alert dict, returns its id
+#   append_events(events)                store refill/draw/idle event dicts
+#   query_raw(device_id, start, end, limit, descending)
+#   iter_raw(device_id, start, end)      readings in time order per device
+#   query_buckets(start, end, points, device_id) -> (source, buckets)
+#   query_alerts(device_id, start, end, limit)    newest first
+#   query_events(device_id, start, end, kind, limit)    by start, newest first
+#   latest(device_id)
+#   prune(now)
+#
+# Readings come back as dicts of device_id, ts and READING_FIELDS, and alerts
+# as the stored dict plus id and ts. Events are stored again under the same
+# device and start, replacing the old copy. ``shared`` says whether every process
+# sees the same data; when it is False, reads have to go to the process that
+# did the writes.
+
+
+def _reading_row(ts, reading):
+    row = {'device_id': reading.get('device_id', 'unknown'), 'ts': ts}
+    for field in READING_FIELDS:
+        row[field] = reading.get(field)
+    return row
+
+
+def bucket_readings(rows, start, end, points):
+    """Aggregate reading rows in [start, end) into ``points`` equal-width buckets
+
+    The same buckets TimeSeriesStore.query_buckets returns, computed from
+    raw rows in one vectorized pass for backends without rollups.
+    """
+    width = (end - start) / points
+    buckets = [dict({'ts': start + i * width, 'count': 0}, **dict.fromkeys(BUCKET_COLUMNS))
+               for i in range(points)]
+    if not rows:
+        return buckets
+
+    ts = np.fromiter((row['ts'] for row in rows), float, len(rows))
+    bins = np.minimum(((ts - start) / width).astype(int), points - 1)
+    counts = np.bincount(bins, minlength=points)
+    # Index of the newest row in each bin supplies the "last" values
+    order = np.argsort(ts, kind='stable')
+    reversed_bins = bins[order][::-1]
+    occupied, first = np.unique(reversed_bins, return_index=True)
+    last_rows = order[len(order) - 1 - first]
+
+    for prefix, field in (('gallons', 'gallons'), ('fill', 'fill_percentage')):
+        values = np.array([row.get(field) for row in rows], dtype=float)
+        present = ~np.isnan(values)
+        mins = np.full(points, np.inf)
+        maxs = np.full(points, -np.inf)
+        np.fmin.at(mins, bins[present], values[present])
+        np.fmax.at(maxs, bins[present], values[present])
+        sums = np.bincount(bins, weights=np.nan_to_num(values), minlength=points)
+        for b, row_index in zip(occupied, last_rows):
+            bucket = buckets[b]
+            bucket['count'] = int(counts[b])
+            if np.isfinite(mins[b]):
+                bucket[f'{prefix}_min'] = float(mins[b])
+                bucket[f'{prefix}_max'] = float(maxs[b])
+                bucket[f'{prefix}_mean'] = float(sums[b] / counts[b])
+            last = values[row_index]
+            bucket[f'{prefix}_last'] = None if np.isnan(last) else float(last)
+    return buckets
+
+
+class SQLiteStorage(TimeSeriesStore):
+    """The local time-series store plus an alerts table, in one SQLite file"""
+
+    shared = True
+    # Buckets come from precomputed rollups, not raw readings
+    rollups = True
+
+    def __init__(self, path, raw_retention_days=30, minute_retention_days=30, alert_retention_days=90,
+                 event_retention_days=365):
+        super().__init__(path, raw_retention_days=raw_retention_days,
+                         minute_retention_days=minute_retention_days)
+        self.alert_retention_days = alert_retention_days
+        self.event_retention_days = event_retention_days
+        self._connection().executescript(ALERTS_SCHEMA + EVENTS_SCHEMA)
+
+    def append_alert(self, alert, ts=None, alert_id=None):
+        alert_id = alert_id or uuid.uuid4().hex
+        ts = ts if ts is not None else time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO alerts (id, device_id, ts, data) VALUES (?, ?, ?, ?)',
+            (alert_id, alert.get('device_id', 'unknown'), ts, json.dumps(alert, default=str))
+        )
+        return alert_id
+
+    def query_alerts(self, device_id=None, start=None, end=None, limit=None):
+        where, params = self._range_clause(device_id, start, end)
+        sql = f"SELECT id, ts, data FROM alerts{where} ORDER BY ts DESC"
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(json.loads(row['data']), id=row['id'], ts=row['ts'])
+                for row in self._connection().execute(sql, params)]
+
+    def append_events(self, events):
+        conn = self._connection()
+        with self._transaction(conn):
+            conn.executemany(
+                'INSERT OR REPLACE INTO events (device_id, start_ts, end_ts, kind, start_gallons, '
+                'end_gallons, volume, rate) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(event['device_id'], event['start'], event['end'],
+                  *(event.get(field) for field in EVENT_FIELDS)) for event in events]
+            )
+
+    def query_events(self, device_id=None, start=None, end=None, kind=None, limit=None):
+        where, params = self._range_clause(device_id, start, end, column='start_ts')
+        if kind is not None:
+            where = (where + ' AND' if where else ' WHERE') + ' kind = ?'
+            params.append(kind)
+        sql = f"SELECT * FROM events{where} ORDER BY start_ts DESC"
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        events = []
+        for row in self._connection().execute(sql, params):
+            event = dict(row)
+            event['start'] = event.pop('start_ts')
+            event['end'] = event.pop('end_ts')
+            events.append(event)
+        return events
+
+    def prune(self, now=None):
+        now = now if now is not None else time.time()
+        super().prune(now)
+        self._connection().execute('DELETE FROM alerts WHERE ts < ?',
+                                   (now - self.alert_retention_days * 86400,))
+        self._connection().execute('DELETE FROM events WHERE start_ts < ?',
+                                   (now - self.event_retention_days * 86400,))
+
+
+class MemoryStorage:
+    """Readings, alerts and events held in this process only, for tests and benchmarks.
+
+    Each device's readings are kept in time order, so appends in order are
+    O(1) and range queries are a bisect. Buckets are computed from the raw
+    readings on every query. Nothing survives a restart.
+    """
+
+    shared = False
+    rollups = False
+
+    def __init__(self, raw_retention_days=30, alert_retention_days=90, event_retention_days=365):
+        self.raw_retention_days = raw_retention_days
+        self.alert_retention_days = alert_retention_days
+        self.event_retention_days = event_retention_days
+        self._readings = {}  # device_id -> ([ts, ...], [row, ...])
+        self._alerts = ([], [])
+        self._events = {}  # (device_id, start) -> event
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _insert(series, ts, item):
+        times, items = series
+        i = bisect.bisect_right(times, ts)
+        times.insert(i, ts)
+        items.insert(i, item)
+
+    @staticmethod
+    def _range(series, start, end):
+        times, items = series
+        lo = 0 if start is None else bisect.bisect_left(times, start)
+        hi = len(times) if end is None else bisect.bisect_left(times, end)
+        return items[lo:hi]
+
+    def append_many(self, timestamped_readings):
+        with self._lock:
+            for ts, reading in timestamped_readings:
+                row = _reading_row(ts, reading)
+                self._insert(self._readings.setdefault(row['device_id'], ([], [])), ts, row)
+
+    def append_alert(self, alert, ts=None, alert_id=None):
+        alert_id = alert_id or uuid.uuid4().hex
+        ts = ts if ts is not None else time.time()
+        with self._lock:
+            self._insert(self._alerts, ts, dict(alert, id=alert_id, ts=ts))
+        return alert_id
+
+    def append_events(self, events):
+        with self._lock:
+            for event in events:
+                self._events[(event['device_id'], event['start'])] = dict(event)
+
+    def _select(self, device_id, start, end):
+        with self._lock:
+            if device_id is not None:
+                series = self._readings.get(device_id)
+                return self._range(series, start, end) if series else []
+            rows = []
+            for series in self._readings.values():
+                rows.extend(self._range(series, start, end))
+        rows.sort(key=lambda row: row['ts'])
+        return rows
+
+    def query_raw(self, device_id=None, start=None, end=None, limit=None, descending=False):
+        rows = self._select(device_id, start, end)
+        if descending:
+            rows.reverse()
+        if limit:
+            rows = rows[:limit]
+        return [dict(row) for row in rows]
+
+    def iter_raw(self, device_id=None, start=None, end=None):
+        with self._lock:
+            device_ids = sorted(self._readings) if device_id is None else [device_id]
+        for name in device_ids:
+            for row in self._select(name, start, end):
+                yield dict(row)
+
+    def query_buckets(self, start, end, points, device_id=None):
+        return 'raw', bucket_readings(self._select(device_id, start, end), start, end, points)
+
+    def query_alerts(self, device_id=None, start=None, end=None, limit=None):
+        with self._lock:
+            alerts = self._range(self._alerts, start, end)
+        alerts = [dict(alert) for alert in reversed(alerts)
+                  if device_id is None or alert.get('device_id') == device_id]
+        return alerts[:limit] if limit else alerts
+
+    def query_events(self, device_id=None, start=None, end=None, kind=None, limit=None):
+        with self._lock:
+            events = [dict(event) for event in self._events.values()
+                      if (device_id is None or event['device_id'] == device_id)
+                      and (start is None or event['start'] >= start)
+                      and (end is None or event['start'] < end)
+                      and (kind is None or event['kind'] == kind)]
+        events.sort(key=lambda event: event['start'], reverse=True)
+        return events[:limit] if limit else events
+
+    def latest(self, device_id=None):
+        rows = self.query_raw(device_id=device_id, limit=1, descending=True)
+        return rows[0] if rows else None
+
+    def prune(self, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            for series in self._readings.values():
+                self._drop_before(series, now - self.raw_retention_days * 86400)
+            self._drop_before(self._alerts, now - self.alert_retention_days * 86400)
+            cutoff = now - self.event_retention_days * 86400
+            self._events = {key: event for key, event in self._events.items() if event['start'] >= cutoff}
+
+    @staticmethod
+    def _drop_before(series, cutoff):
+        times, items = series
+        i = bisect.bisect_left(times, cutoff)
+        del times[:i]
+        del items[:i]
+
+
+class FirestoreStorage:
+    """Readings, alerts and events in the Firestore collections of those names.
+
+    Writes go through ``persist(collection, data, doc_id)``, normally the
+    batching write queue with the offline spool behind it, so they never
+    wait on a round trip and show up in queries a moment later. Firestore
+    has no server-side aggregation, so buckets are computed from the raw
+    readings of the whole range. ``on_query(name, seconds)`` is called
+    after every query. Retention is left to Firestore TTL policies.
+    """
+
+    shared = True
+    rollups = False
+
+    def __init__(self, db, persist, on_query=None):
+        self.db = db
+        self.persist = persist
+        self.on_query = on_query
+
+    def append_many(self, timestamped_readings):
+        for ts, reading in timestamped_readings:
+            document = {field: reading.get(field, 0) for field in READING_FIELDS}
+            document['device_id'] = reading.get('device_id', 'unknown')
+            document['timestamp'] = datetime.fromtimestamp(ts, timezone.utc)
+            self.persist('readings', document, None)
+
+    def append_alert(self, alert, ts=None, alert_id=None):
+        ts = ts if ts is not None else time.time()
+        document = dict(alert, timestamp=datetime.fromtimestamp(ts, timezone.utc))
+        return self.persist('alerts', document, alert_id)
+
+    def append_events(self, events):
+        for event in events:
+            document = {field: event.get(field) for field in EVENT_FIELDS}
+            document.update(device_id=event['device_id'], end=event['end'],
+                            timestamp=datetime.fromtimestamp(event['start'], timezone.utc))
+            self.persist('events', document, f"{event['device_id']}_{event['start']:.0f}")
+
+    def _query(self, collection, device_id, start, end, limit=None, descending=False):
+        query = self.db.collection(collection)
+        if device_id:
+            query = query.where('device_id', '==', device_id)
+        if start is not None:
+            query = query.where('timestamp', '>=', datetime.fromtimestamp(start, timezone.utc))
+        if end is not None:
+            query = query.where('timestamp', '<', datetime.fromtimestamp(end, timezone.utc))
+        query = query.order_by('timestamp', direction=(firestore.Query.DESCENDING if descending
+                                                       else firestore.Query.ASCENDING))
+        if limit:
+            query = query.limit(limit)
+        return query.stream()
+
+    def _documents(self, name, stream):
+        started = time.monotonic()
+        try:
+            for doc in stream:
+                data = doc.to_dict()
+                timestamp = data.pop('timestamp', None)
+                if isinstance(timestamp, datetime):
+                    yield doc.id, timestamp.timestamp(), data
+        finally:
+            if self.on_query:
+                self.on_query(name, time.monotonic() - started)
+
+    def query_raw(self, device_id=None, start=None, end=None, limit=None, descending=False):
+        stream = self._query('readings', device_id, start, end, limit, descending)
+        return [_reading_row(ts, data) for _, ts, data in self._documents('readings', stream)]
+
+    def iter_raw(self, device_id=None, start=None, end=None):
+        stream = self._query('readings', device_id, start, end)
+        for _, ts, data in self._documents('readings', stream):
+            yield _reading_row(ts, data)
+
+    def query_buckets(self, start, end, points, device_id=None):
+        return 'raw', bucket_readings(self.query_raw(device_id, start, end), start, end, points)
+
+    def query_alerts(self, device_id=None, start=None, end=None, limit=None):
+        stream = self._query('alerts', device_id, start, end, limit, descending=True)
+        return [dict(data, id=doc_id, ts=ts) for doc_id, ts, data in self._documents('alerts', stream)]
+
+    def query_events(self, device_id=None, start=None, end=None, kind=None, limit=None):
+        # Filtering on kind in the query would need another composite index
+        stream = self._query('events', device_id, start, end, None if kind else limit, descending=True)
+        events = [dict(data, start=ts) for _, ts, data in self._documents('events', stream)
+                  if kind is None or data.get('kind') == kind]
+        return events[:limit] if limit else events
+
+    def latest(self, device_id=None):
+        rows = self.query_raw(device_id=device_id, limit=1, descending=True)
+        return rows[0] if rows else None
+
+    def prune(self, now=None):
+        pass
+
+
+class CompressedStorage:
+    """Write only the readings ``compressor`` keeps to ``store``
+
+    For when Firestore is the only store, so every reading would be a
+    billed write. Reads, alerts and events go to ``store`` unchanged, and
+    readings only hold the points needed to redraw the series within the
+    compressor's tolerances.
+    """
+
+    def __init__(self, store, compressor):
+        self.store = store
+        self.compressor = compressor
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def append_many(self, timestamped_readings):
+        kept = self.compressor.compress(timestamped_readings)
+        if kept:
+            self.store.append_many(kept)
+
+    def flush_held(self, before=None):
+        """Store readings the compressor is holding back, those taken before ``before`` if given"""
+        held = self.compressor.flush(before)
+        if held:
+            self.store.append_many(held)
+
+
+class MirroredStorage:
+    """Read from and write to ``primary``, copying every write to ``mirror``
+
+    Mirror writes happen after the primary has the data and a failing
+    mirror is logged, never raised, so it cannot lose or delay a write.
+    Alerts keep the same id in both. With a ``compressor``, only the
+    readings it keeps are mirrored; the primary always gets every reading,
+    so rollups and replays are computed from the full series.
+    """
+
+    def __init__(self, primary, mirror, compressor=None):
+        self.primary = primary
+        self.mirror = mirror
+        self.compressor = compressor
+
+    def __getattr__(self, name):
+        # Reads, prune and ``shared`` come from the primary
+        return getattr(self.primary, name)
+
+    def append_many(self, timestamped_readings):
+        self.primary.append_many(timestamped_readings)
+        try:
+            if self.compressor is not None:
+                timestamped_readings = self.compressor.compress(timestamped_readings)
+            if timestamped_readings:
+                self.mirror.append_many(timestamped_readings)
+        except Exception:
+            logger.exception('Error mirroring %d readings', len(timestamped_readings))
+
+    def flush_held(self, before=None):
+        """Mirror readings the compressor is holding back, those taken before ``before`` if given"""
+        if self.compressor is None:
+            return
+        held = self.compressor.flush(before)
+        if held:
+            self.mirror.append_many(held)
+
+    def append_alert(self, alert, ts=None, alert_id=None):
+        ts = ts if ts is not None else time.time()
+        alert_id = self.primary.append_alert(alert, ts, alert_id)
+        try:
+            self.mirror.append_alert(alert, ts, alert_id)
+        except Exception:
+            logger.exception('Error mirroring alert %s', alert_id)
+        return alert_id
+
+    def append_events(self, events):
+        self.primary.append_events(events)
+        try:
+            self.mirror.append_events(events)
+        except Exception:
+            logger.exception('Error mirroring %d events', len(events))
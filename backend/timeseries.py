@@ -0,0 +1,291 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Rollup resolutions in seconds: 1 minute, 1 hour, 1 day
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    device_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    gallons REAL,
+    fill_percentage REAL,
+    distance_cm REAL,
+    water_level_cm REAL,
+    battery_voltage REAL,
+    wifi_rssi REAL
+);
+CREATE INDEX IF NOT EXISTS readings_device_ts ON readings (device_id, ts);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    device_id TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    last_ts REAL NOT NULL,
+    gallons_min REAL,
+    gallons_max REAL,
+    gallons_sum REAL,
+    gallons_last REAL,
+    fill_min REAL,
+    fill_max REAL,
+    fill_sum REAL,
+    fill_last REAL,
+    PRIMARY KEY (resolution, device_id, bucket)
+) WITHOUT ROWID;
+"""
+
+# Fold one reading into its bucket. "last" only moves forward in time, so
+# late or replayed readings do not overwrite a newer value.
+UPSERT_ROLLUP = """
+INSERT INTO rollups (resolution, device_id, bucket, count, last_ts,
+                     gallons_min, gallons_max, gallons_sum, gallons_last,
+                     fill_min, fill_max, fill_sum, fill_last)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, device_id, bucket) DO UPDATE SET
+    count = count + 1,
+    gallons_min = min(gallons_min, excluded.gallons_min),
+    gallons_max = max(gallons_max, excluded.gallons_max),
+    gallons_sum = gallons_sum + excluded.gallons_sum,
+    gallons_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.gallons_last ELSE gallons_last END,
+    fill_min = min(fill_min, excluded.fill_min),
+    fill_max = max(fill_max, excluded.fill_max),
+    fill_sum = fill_sum + excluded.fill_sum,
+    fill_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.fill_last ELSE fill_last END,
+    last_ts = max(last_ts, excluded.last_ts)
+"""
+
+# Columns shared by raw readings and rollups so both can feed query_buckets
+RAW_AS_ROLLUP = """
+SELECT device_id, ts, 1 AS count, ts AS last_ts,
+       gallons AS gallons_min, gallons AS gallons_max, gallons AS gallons_sum, gallons AS gallons_last,
+       fill_percentage AS fill_min, fill_percentage AS fill_max, fill_percentage AS fill_sum,
+       fill_percentage AS fill_last
+FROM readings
+"""
+
+ROLLUP_AS_SOURCE = """
+SELECT device_id, bucket AS ts, count, last_ts,
+       gallons_min, gallons_max, gallons_sum, gallons_last,
+       fill_min, fill_max, fill_sum, fill_last
+FROM rollups WHERE resolution = :resolution
+"""
+
+# Re-bucket a source into equal-width bins in one pass. The row with the
+# latest last_ts in each bin supplies the bin's "last" values.
+BUCKET_QUERY = """
+WITH binned AS (
+    SELECT MIN(CAST((ts - :start) / :width AS INTEGER), :last_bin) AS bin, *
+    FROM ({source}) AS src
+    WHERE ts >= :start AND ts < :end {device_clause}
+),
+ranked AS (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY bin ORDER BY last_ts DESC) AS rn FROM binned
+)
+SELECT bin, SUM(count) AS count, MAX(last_ts) AS last_ts,
+       MIN(gallons_min) AS gallons_min, MAX(gallons_max) AS gallons_max,
+       SUM(gallons_sum) / SUM(count) AS gallons_mean,
+       MAX(CASE WHEN rn = 1 THEN gallons_last END) AS gallons_last,
+       MIN(fill_min) AS fill_min, MAX(fill_max) AS fill_max,
+       SUM(fill_sum) / SUM(count) AS fill_mean,
+       MAX(CASE WHEN rn = 1 THEN fill_last END) AS fill_last
+FROM ranked GROUP BY bin ORDER BY bin
+"""
+
+RESOLUTION_NAMES = {None: 'raw', 60: 'minute', 3600: 'hour', 86400: 'day'}
+
+READING_FIELDS = ('gallons', 'fill_percentage', 'distance_cm', 'water_level_cm',
+                  'battery_voltage', 'wifi_rssi')
+
+
+class TimeSeriesStore:
+    """Local SQLite store for raw readings and their min/max/mean/last rollups.
+
+    Every appended reading is written to ``readings`` and folded into the
+    1-minute, 1-hour and 1-day buckets in the same transaction, so range
+    queries over weeks or months read a few hundred pre-aggregated rows
+    instead of raw data. The database runs in WAL mode so readers in other
+    workers never block the writer.
+    """
+
+    def __init__(self, path, raw_retention_days=30, minute_retention_days=30):
+        self.path = path
+        self.raw_retention_days = raw_retention_days
+        self.minute_retention_days = minute_retention_days
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, reading, ts=None):
+        """Store one reading and update its rollup buckets"""
+        self.append_many([(ts if ts is not None else time.time(), reading)])
+
+    def append_many(self, timestamped_readings):
+        """Store (ts, reading) pairs in a single transaction"""
+        conn = self._connection()
+        rows = []
+        rollup_rows = []
+        for ts, reading in timestamped_readings:
+            device_id = reading.get('device_id', 'unknown')
+            values = [reading.get(field) for field in READING_FIELDS]
+            rows.append((device_id, ts, *values))
+            gallons = reading.get('gallons', 0)
+            fill = reading.get('fill_percentage', 0)
+            for resolution in ROLLUP_RESOLUTIONS:
+                bucket = int(ts // resolution) * resolution
+                rollup_rows.append((resolution, device_id, bucket, ts,
+                                    gallons, gallons, gallons, gallons,
+                                    fill, fill, fill, fill))
+
+        with self._transaction(conn):
+            conn.executemany(
+                'INSERT INTO readings (device_id, ts, gallons, fill_percentage, distance_cm, '
+                'water_level_cm, battery_voltage, wifi_rssi) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.executemany(UPSERT_ROLLUP, rollup_rows)
+
+    def query_raw(self, device_id=None, start=None, end=None, limit=None, descending=False):
+        """Return raw readings in [start, end) as dicts ordered by time"""
+        where, params = self._range_clause(device_id, start, end)
+        sql = f"SELECT * FROM readings{where} ORDER BY ts {'DESC' if descending else 'ASC'}"
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def iter_raw(self, device_id=None, start=None, end=None, chunk_size=10000):
+        """Stream raw readings in [start, end) ordered by device, then time
+
+        Rows are fetched ``chunk_size`` at a time along the (device_id, ts)
+        index, so arbitrarily long ranges never sit in memory at once.
+        """
+        where, params = self._range_clause(device_id, start, end)
+        cursor = self._connection().execute(
+            f"SELECT * FROM readings{where} ORDER BY device_id ASC, ts ASC", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            cursor.close()
+
+    def query_rollups(self, resolution, device_id=None, start=None, end=None):
+        """Return rollup buckets of the given resolution in [start, end)"""
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unsupported rollup resolution: {resolution}")
+        if start is not None:
+            # Include the bucket that start falls into
+            start = int(start // resolution) * resolution
+        where, params = self._range_clause(device_id, start, end, column='bucket')
+        where = (where + ' AND' if where else ' WHERE') + ' resolution = ?'
+        params.append(resolution)
+        sql = f"""
+            SELECT device_id, bucket, count, last_ts,
+                   gallons_min, gallons_max, gallons_sum / count AS gallons_mean, gallons_last,
+                   fill_min, fill_max, fill_sum / count AS fill_mean, fill_last
+            FROM rollups{where} ORDER BY bucket ASC
+        """
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def query_buckets(self, start, end, points, device_id=None):
+        """Aggregate [start, end) into exactly ``points`` equal-width buckets.
+
+        Reads from the coarsest rollup that is no wider than a bucket (raw
+        readings only for sub-minute buckets), so the cost depends on
+        ``points`` rather than on the length of the range. Returns
+        ``(source_name, buckets)``; empty buckets have a count of 0 and
+        None values so the payload size is always the same.
+        """
+        width = (end - start) / points
+        resolution = max((r for r in ROLLUP_RESOLUTIONS if r <= width), default=None)
+        # Fall back to a coarser source where the finer one has been pruned
+        age_days = (time.time() - start) / 86400
+        if resolution is None and age_days > self.raw_retention_days:
+            resolution = 60
+        if resolution == 60 and age_days > self.minute_retention_days:
+            resolution = 3600
+        source = RAW_AS_ROLLUP if resolution is None else ROLLUP_AS_SOURCE
+        params = {'start': start, 'end': end, 'width': width,
+                  'last_bin': points - 1, 'resolution': resolution}
+        device_clause = ''
+        if device_id is not None:
+            device_clause = 'AND device_id = :device_id'
+            params['device_id'] = device_id
+
+        sql = BUCKET_QUERY.format(source=source, device_clause=device_clause)
+        rows = {row['bin']: dict(row) for row in self._connection().execute(sql, params)}
+
+        buckets = []
+        for i in range(points):
+            row = rows.get(i)
+            bucket = {
+                'ts': start + i * width,
+                'count': row['count'] if row else 0
+            }
+            for column in ('gallons_min', 'gallons_max', 'gallons_mean', 'gallons_last',
+                           'fill_min', 'fill_max', 'fill_mean', 'fill_last'):
+                bucket[column] = row[column] if row else None
+            buckets.append(bucket)
+        return RESOLUTION_NAMES[resolution], buckets
+
+    def latest(self, device_id=None):
+        """Return the most recent raw reading, or None"""
+        rows = self.query_raw(device_id=device_id, limit=1, descending=True)
+        return rows[0] if rows else None
+
+    def prune(self, now=None):
+        """Drop raw readings and minute rollups past their retention"""
+        now = now if now is not None else time.time()
+        conn = self._connection()
+        with self._transaction(conn):
+            conn.execute('DELETE FROM readings WHERE ts < ?',
+                         (now - self.raw_retention_days * 86400,))
+            conn.execute('DELETE FROM rollups WHERE resolution = 60 AND bucket < ?',
+                         (now - self.minute_retention_days * 86400,))
+
+    @staticmethod
+    def _range_clause(device_id, start, end, column='ts'):
+        clauses = []
+        params = []
+        if device_id is not None:
+            clauses.append('device_id = ?')
+            params.append(device_id)
+        if start is not None:
+            clauses.append(f'{column} >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append(f'{column} < ?')
+            params.append(end)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
@@ -0,0 +1,61 @@
+import struct
+
+CONTENT_TYPE = 'application/vnd.wellsensor.readings'
+MAGIC = b'WS'
+VERSION = 1
+
+# magic, version, device_id length, record count, sent_at (device millis)
+HEADER = struct.Struct('<2sBBHI')
+# timestamp (millis), distance_cm, water_level_cm, gallons, fill_percentage,
+# battery_voltage, wifi_rssi
+RECORD = struct.Struct('<Ifffffh')
+RECORD_FIELDS = ('timestamp', 'distance_cm', 'water_level_cm', 'gallons',
+                 'fill_percentage', 'battery_voltage', 'wifi_rssi')
+
+
+def decode(body):
+    """Decode a packed batch into a /tank-data batch envelope
+
+    The layout is a little-endian header followed by the device_id in
+    UTF-8 and ``count`` fixed-size records::
+
+        header  '2s B B H I'      b'WS', version, len(device_id), count, sent_at
+        record  'I f f f f f h'   timestamp, distance_cm, water_level_cm,
+                                  gallons, fill_percentage, battery_voltage,
+                                  wifi_rssi
+
+    A single reading is a batch with one record. Records are unpacked
+    straight from a memoryview of the body without copying it. Raises
+    ValueError if the body does not match the layout.
+    """
+    view = memoryview(body)
+    if len(view) < HEADER.size:
+        raise ValueError(f"Body shorter than the {HEADER.size} byte header")
+    magic, version, id_length, count, sent_at = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Bad magic bytes')
+    if version != VERSION:
+        raise ValueError(f"Unsupported wire format version {version}")
+
+    records_start = HEADER.size + id_length
+    expected = records_start + count * RECORD.size
+    if len(view) != expected:
+        raise ValueError(f"Expected {expected} bytes for {count} records, got {len(view)}")
+
+    device_id = str(view[HEADER.size:records_start], 'utf-8')
+    readings = [dict(zip(RECORD_FIELDS, values))
+                for values in RECORD.iter_unpack(view[records_start:])]
+    return {'device_id': device_id, 'sent_at': sent_at, 'readings': readings}
+
+
+def encode(device_id, sent_at, readings):
+    """Pack readings (dicts with RECORD_FIELDS) into the wire format"""
+    device_id = device_id.encode()
+    buffer = bytearray(HEADER.size + len(device_id) + len(readings) * RECORD.size)
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, len(device_id), len(readings), sent_at)
+    buffer[HEADER.size:HEADER.size + len(device_id)] = device_id
+    offset = HEADER.size + len(device_id)
+    for reading in readings:
+        RECORD.pack_into(buffer, offset, *(reading.get(field, 0) for field in RECORD_FIELDS))
+        offset += RECORD.size
+    return bytes(buffer)
@@ -0,0 +1,160 @@
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class FirestoreWriteQueue:
+    """Bounded in-process queue that writes documents in Firestore batches.
+
+    ``enqueue`` never touches the network: documents are collected by a
+    background thread and committed with a ``WriteBatch`` once
+    ``batch_size`` documents are waiting or ``flush_interval`` seconds have
+    passed. Every document gets its ID when it is queued, so retrying a
+    batch that actually reached Firestore overwrites rather than duplicates.
+    Batches that still fail after ``max_retries`` are handed to
+    ``on_failure`` (or dropped when it is not set); committed batches are
+    passed to ``on_flush``. ``on_commit`` is called after every commit
+    attempt with its duration, the batch size and the error, if any.
+    """
+
+    # Firestore rejects batches with more than 500 writes
+    MAX_BATCH_SIZE = 500
+
+    def __init__(self, db, max_size=10000, batch_size=100, flush_interval=1.0,
+                 max_retries=5, base_backoff=0.5, on_failure=None, on_flush=None, on_commit=None):
+        self.db = db
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.on_failure = on_failure
+        self.on_flush = on_flush
+        self.on_commit = on_commit
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stats_lock = threading.Lock()
+        self._written = 0
+        self._dropped = 0
+        self._failed_batches = 0
+        self._retries = 0
+        self._flush_count = 0
+        self._flush_total_seconds = 0.0
+        self._last_flush_seconds = None
+        self._last_error = None
+        self._pending = 0
+        self._idle = threading.Condition(self._stats_lock)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def enqueue(self, collection, data, doc_id=None):
+        """Queue a document for writing; returns its ID, or None if dropped"""
+        doc_id = doc_id or uuid.uuid4().hex
+        with self._stats_lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((collection, doc_id, data))
+        except queue.Full:
+            with self._stats_lock:
+                self._pending -= 1
+                self._dropped += 1
+            logger.warning('Write queue full, dropping %s document %s', collection, doc_id)
+            return None
+        return doc_id
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed or failed"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stats(self):
+        """Return queue depth, throughput and flush latency figures"""
+        with self._stats_lock:
+            avg = (self._flush_total_seconds / self._flush_count) if self._flush_count else None
+            return {
+                'queue_depth': self._queue.qsize(),
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed_batches': self._failed_batches,
+                'retries': self._retries,
+                'flushes': self._flush_count,
+                'last_flush_ms': self._last_flush_seconds * 1000 if self._last_flush_seconds is not None else None,
+                'avg_flush_ms': avg * 1000 if avg is not None else None,
+                'last_error': self._last_error
+            }
+
+    def _next_batch(self):
+        """Wait for the first item, then gather more until full or timed out"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _commit(self, items):
+        batch = self.db.batch()
+        for collection, doc_id, data in items:
+            batch.set(self.db.collection(collection).document(doc_id), data)
+        batch.commit()
+
+    def _observe(self, start, count, error):
+        if self.on_commit:
+            try:
+                self.on_commit(time.monotonic() - start, count, error)
+            except Exception:
+                logger.exception('Error in write queue commit callback')
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            for attempt in range(self.max_retries + 1):
+                start = time.monotonic()
+                try:
+                    self._commit(items)
+                except Exception as e:
+                    self._observe(start, len(items), e)
+                    with self._stats_lock:
+                        self._last_error = str(e)
+                        if attempt < self.max_retries:
+                            self._retries += 1
+                    if attempt < self.max_retries:
+                        # Exponential backoff with jitter, capped at a minute
+                        delay = min(60, self.base_backoff * (2 ** attempt))
+                        time.sleep(delay * random.uniform(0.5, 1.5))
+                        continue
+                    with self._stats_lock:
+                        self._failed_batches += 1
+                    logger.error('Firestore batch of %d failed after %d attempts: %s', len(items), attempt + 1, e)
+                    if self.on_failure:
+                        self.on_failure(items)
+                    else:
+                        with self._stats_lock:
+                            self._dropped += len(items)
+                    break
+                elapsed = time.monotonic() - start
+                self._observe(start, len(items), None)
+                with self._stats_lock:
+                    self._written += len(items)
+                    self._flush_count += 1
+                    self._flush_total_seconds += elapsed
+                    self._last_flush_seconds = elapsed
+                if self.on_flush:
+                    try:
+                        self.on_flush(items)
+                    except Exception:
+                        logger.exception('Error in write queue flush callback')
+                break
+
+            with self._stats_lock:
+                self._pending -= len(items)
+                if self._pending == 0:
+                    self._idle.notify_all()
@@ -0,0 +1,121 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Matches the constants in WellMonitor.ino
+TANK_CAPACITY_GALLONS = 1550
+TANK_HEIGHT_CM = 183
+SENSOR_HEIGHT_CM = 200
+READING_INTERVAL_MS = 30000
+APP_SEND_INTERVAL_MS = 300000
+
+
+class FakeTank:
+    """A simulated tank that drains slowly and refills when low"""
+
+    def __init__(self, device_id, fill_percentage=None, drain_per_reading=0.05):
+        self.device_id = device_id
+        self.fill_percentage = fill_percentage if fill_percentage is not None else random.uniform(40, 95)
+        self.drain_per_reading = drain_per_reading
+        self.battery_voltage = random.uniform(11.8, 12.6)
+        self.wifi_rssi = random.randint(-80, -50)
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def millis(self):
+        return int((time.monotonic() - self._started) * 1000)
+
+    def take_reading(self):
+        """Advance the simulation by one reading and return it like /status does"""
+        with self._lock:
+            self.fill_percentage -= self.drain_per_reading * random.uniform(0, 2)
+            if self.fill_percentage < 10:
+                self.fill_percentage = random.uniform(85, 98)
+            fill = self.fill_percentage
+        water_level = TANK_HEIGHT_CM * fill / 100
+        return {
+            'device_id': self.device_id,
+            'distance_cm': round(SENSOR_HEIGHT_CM - water_level, 1),
+            'water_level_cm': round(water_level, 1),
+            'gallons': round(TANK_CAPACITY_GALLONS * fill / 100, 1),
+            'fill_percentage': round(fill, 2),
+            'battery_voltage': round(self.battery_voltage, 2),
+            'timestamp': self.millis(),
+            'tank_capacity': TANK_CAPACITY_GALLONS,
+            'wifi_rssi': self.wifi_rssi
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        tank = self.server.tank
+        if self.path == '/status':
+            self._send_json(self.server.last_reading)
+        elif self.path == '/reading':
+            # The sensor measures synchronously, then redirects to /status
+            time.sleep(self.server.measure_seconds)
+            self.server.last_reading = tank.take_reading()
+            self.send_response(302)
+            self.send_header('Location', '/status')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path == '/config':
+            self._send_json({
+                'device_id': tank.device_id,
+                'tank_capacity_gallons': TANK_CAPACITY_GALLONS,
+                'tank_height_cm': TANK_HEIGHT_CM,
+                'sensor_height_cm': SENSOR_HEIGHT_CM,
+                'reading_interval_ms': READING_INTERVAL_MS,
+                'app_send_interval_ms': APP_SEND_INTERVAL_MS,
+                'api_endpoint': '/tank-data',
+                'wifi_rssi': tank.wifi_rssi,
+                'ip_address': self.server.server_address[0]
+            })
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeESP32Fleet:
+    """One HTTP server per simulated sensor on 127.0.0.1, each on its own port.
+
+    Every server answers ``/status``, ``/reading`` and ``/config`` the way
+    WellMonitor.ino does. ``/reading`` takes ``measure_seconds`` to mimic the
+    ultrasonic measurement. ``endpoints`` is the host:port list to pass to
+    the backend as ESP32_DEVICES.
+    """
+
+    def __init__(self, count, measure_seconds=0.1, host='127.0.0.1'):
+        self.servers = []
+        for i in range(count):
+            server = ThreadingHTTPServer((host, 0), _Handler)
+            server.daemon_threads = True
+            server.tank = FakeTank(f"bench_tank_{i:04d}")
+            server.last_reading = server.tank.take_reading()
+            server.measure_seconds = measure_seconds
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+
+    @property
+    def endpoints(self):
+        return [f"{host}:{port}" for host, port in (server.server_address for server in self.servers)]
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,164 @@
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+
+def _comparable(value):
+    # The backend queries with naive local datetimes and stores aware UTC ones
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.astimezone(timezone.utc)
+    return value
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+
+class FakeQuery:
+    """Enough of google.cloud.firestore.Query for the backend's queries"""
+
+    def __init__(self, db, collection, filters=(), order=None, limit_count=None):
+        self._db = db
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit_count
+
+    def _copy(self, **changes):
+        state = {'filters': self._filters, 'order': self._order, 'limit_count': self._limit}
+        state.update(changes)
+        return FakeQuery(self._db, self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(field, _OPERATORS[op], _comparable(value))])
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(order=(field, direction == 'DESCENDING'))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._collection, doc_id or uuid.uuid4().hex)
+
+    def stream(self):
+        time.sleep(self._db.query_latency)
+        with self._db.lock:
+            docs = list(self._db.collections.get(self._collection, {}).items())
+        matches = []
+        for doc_id, data in docs:
+            try:
+                if all(field in data and op(_comparable(data[field]), value)
+                       for field, op, value in self._filters):
+                    matches.append((doc_id, data))
+            except TypeError:
+                continue
+        if self._order:
+            field, descending = self._order
+            matches.sort(key=lambda item: _comparable(item[1].get(field)), reverse=descending)
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        self._db.queries += 1
+        return iter([FakeSnapshot(doc_id, data) for doc_id, data in matches])
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, document, data):
+        self._writes.append((document, data))
+
+    def commit(self):
+        time.sleep(self._db.commit_latency)
+        if self._db.failure_rate and next(self._db.failure_counter) % round(1 / self._db.failure_rate) == 0:
+            raise RuntimeError('Simulated Firestore outage')
+        now = datetime.now(timezone.utc)
+        with self._db.lock:
+            for document, data in self._writes:
+                stored = {k: now if v is self._db.server_timestamp else v for k, v in data.items()}
+                self._db.collections.setdefault(document.collection, {})[document.id] = stored
+            self._db.commits += 1
+            self._db.writes += len(self._writes)
+
+
+class FakeFirestore:
+    """In-memory Firestore client with a fixed delay per round trip.
+
+    ``commit_latency`` and ``query_latency`` (seconds) stand in for the
+    network, and ``failure_rate`` fails that fraction of batch commits.
+    """
+
+    def __init__(self, commit_latency=0.03, query_latency=0.05, failure_rate=0.0, server_timestamp=None):
+        self.commit_latency = commit_latency
+        self.query_latency = query_latency
+        self.failure_rate = failure_rate
+        self.failure_counter = itertools.count(1)
+        self.server_timestamp = server_timestamp
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.commits = 0
+        self.writes = 0
+        self.queries = 0
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeMessaging:
+    """Stand-in for firebase_admin.messaging.send_each"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send_each(self, messages):
+        time.sleep(self.latency)
+        with self._lock:
+            self.sent += len(messages)
+        return SimpleNamespace(responses=[SimpleNamespace(success=True, exception=None) for _ in messages])
+
+
+def install(commit_latency=0.03, query_latency=0.05, send_latency=0.05, failure_rate=0.0):
+    """Make firebase_admin hand out the fakes; call before importing backend.app
+
+    Returns the (FakeFirestore, FakeMessaging) pair the backend will use.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, firestore, messaging
+
+    db = FakeFirestore(commit_latency, query_latency, failure_rate, server_timestamp=firestore.SERVER_TIMESTAMP)
+    fcm = FakeMessaging(send_latency)
+    credentials.Certificate = lambda info: SimpleNamespace(info=info)
+    firebase_admin.initialize_app = lambda cred=None, options=None, name='[DEFAULT]': None
+    firestore.client = lambda app=None: db
+    messaging.send_each = fcm.send_each
+    return db, fcm
@@ -0,0 +1,241 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+from backend import wire
+from .fake_esp32 import FakeESP32Fleet, FakeTank
+
+
+class Stats:
+    """Latencies, errors and delivered readings per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.readings = 0
+        self.last_finished = None
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok, readings=0):
+        finished = time.monotonic()
+        with self._lock:
+            self.last_finished = max(self.last_finished or finished, finished)
+            self.latencies[name].append(seconds)
+            if ok:
+                self.readings += readings
+            else:
+                self.errors[name] += 1
+
+    def report(self, measure_start, duration):
+        """Summarize; rates are over the measured window or until the last reply, if later"""
+        if self.last_finished is not None:
+            duration = max(duration, self.last_finished - measure_start)
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': self.errors[name],
+                'rate': round(len(values) / duration, 1),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p90_ms': round(percentile(values, 90) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                'max_ms': round(values[-1] * 1000, 1)
+            }
+        return {
+            'duration_seconds': round(duration, 1),
+            'readings_per_second': round(self.readings / duration, 1),
+            'endpoints': endpoints
+        }
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def ingest_requests(tanks, batch_size, fmt):
+    """Return make_request(k) that builds the k-th POST /tank-data"""
+
+    def make_request(k):
+        tank = tanks[k % len(tanks)]
+        readings = [tank.take_reading() for _ in range(batch_size)]
+        if fmt == 'binary':
+            body = wire.encode(tank.device_id, tank.millis(), readings)
+            return 'POST', '/tank-data', {'data': body, 'headers': {'Content-Type': wire.CONTENT_TYPE}}, batch_size
+        if batch_size == 1:
+            return 'POST', '/tank-data', {'json': readings[0]}, 1
+        envelope = {'device_id': tank.device_id, 'sent_at': tank.millis(), 'readings': readings}
+        return 'POST', '/tank-data', {'json': envelope}, batch_size
+
+    return make_request
+
+
+def read_requests(path, device_ids):
+    def make_request(k):
+        return 'GET', f"{path}?device_id={random.choice(device_ids)}", {}, 0
+    return make_request
+
+
+def run_scenario(base_url, name, rate, make_request, stats, start, warmup, duration, concurrency):
+    """Send requests at a fixed rate from a pool of threads, open loop
+
+    Request k is due at ``start + k / rate`` and its latency is measured
+    from that moment, so time spent waiting for a free thread when the
+    server falls behind counts against it instead of being hidden.
+    """
+    counter = itertools.count()
+    end = start + warmup + duration
+
+    def worker():
+        session = requests.Session()
+        while True:
+            k = next(counter)
+            due = start + k / rate
+            if due >= end:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            method, path, kwargs, readings = make_request(k)
+            try:
+                ok = session.request(method, base_url + path, timeout=30, **kwargs).status_code < 400
+            except requests.RequestException:
+                ok = False
+            if due >= start + warmup:
+                stats.record(name, time.monotonic() - due, ok, readings)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(args, esp32_endpoints, work_dir):
+    """Start bench.server in a subprocess and wait until it answers"""
+    port = free_port()
+    env = dict(os.environ,
+               ESP32_DEVICES=','.join(esp32_endpoints),
+               RUN_DIR=os.path.join(work_dir, 'run'),
+               DATA_DIR=os.path.join(work_dir, 'data'),
+               LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'),
+               STORAGE_BACKEND=args.storage,
+               FIRESTORE_MIRROR='false' if args.no_mirror else 'true',
+               ENABLE_EMAIL_ALERTS='false')
+    process = subprocess.Popen([
+        sys.executable, '-m', 'bench.server', '--bind', f"127.0.0.1:{port}",
+        '--workers', str(args.workers), '--threads', str(args.threads),
+        '--firestore-commit-ms', str(args.firestore_commit_ms),
+        '--firestore-query-ms', str(args.firestore_query_ms),
+        '--fcm-ms', str(args.fcm_ms)
+    ], env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode}")
+        try:
+            if requests.get(base_url + '/', timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Backend did not start within 60 seconds')
+
+
+def print_report(report):
+    print(f"{'endpoint':<12} {'requests':>9} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, row in report['endpoints'].items():
+        print(f"{name:<12} {row['requests']:>9} {row['errors']:>7} {row['rate']:>8} "
+              f"{row['p50_ms']:>8} {row['p90_ms']:>8} {row['p99_ms']:>8} {row['max_ms']:>8}")
+    print(f"readings/s: {report['readings_per_second']} over {report['duration_seconds']}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive the backend with a simulated sensor fleet and report latency')
+    parser.add_argument('--url', help='Backend to test; by default one is started offline with fake Firebase')
+    parser.add_argument('--devices', type=int, default=20, help='Simulated sensors (default: 20)')
+    parser.add_argument('--post-interval', type=float, default=1.0,
+                        help='Seconds between POST /tank-data per device (default: 1)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Readings per POST; above 1 sends a batch envelope (default: 1)')
+    parser.add_argument('--format', choices=('json', 'binary'), default='json')
+    parser.add_argument('--read-rate', type=float, default=10,
+                        help='Requests/s for each of /current, /history and /alerts; 0 to skip (default: 10)')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds (default: 30)')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds first (default: 3)')
+    parser.add_argument('--concurrency', type=int, default=32, help='Client threads per endpoint (default: 32)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--firestore-commit-ms', type=float, default=30)
+    parser.add_argument('--firestore-query-ms', type=float, default=50)
+    parser.add_argument('--fcm-ms', type=float, default=50)
+    parser.add_argument('--storage', choices=('sqlite', 'memory', 'firestore'), default='sqlite',
+                        help='STORAGE_BACKEND for the started backend (default: sqlite)')
+    parser.add_argument('--no-mirror', action='store_true', help='Do not mirror writes to the fake Firestore')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    tanks = [FakeTank(f"bench_tank_{i:04d}") for i in range(args.devices)]
+    device_ids = [tank.device_id for tank in tanks]
+    fleet = process = None
+    work_dir = tempfile.TemporaryDirectory(prefix='wellsensor-bench-')
+    try:
+        base_url = args.url
+        if base_url is None:
+            fleet = FakeESP32Fleet(args.devices)
+            process, base_url = start_backend(args, fleet.endpoints, work_dir.name)
+        base_url = base_url.rstrip('/')
+
+        stats = Stats()
+        start = time.monotonic() + 0.5
+        threads = run_scenario(base_url, 'tank-data', args.devices / args.post_interval,
+                               ingest_requests(tanks, args.batch_size, args.format),
+                               stats, start, args.warmup, args.duration, args.concurrency)
+        if args.read_rate > 0:
+            for path in ('/current', '/history', '/alerts'):
+                threads += run_scenario(base_url, path.lstrip('/'), args.read_rate,
+                                        read_requests(path, device_ids),
+                                        stats, start, args.warmup, args.duration, args.concurrency)
+        for thread in threads:
+            thread.join()
+
+        report = stats.report(start + args.warmup, args.duration)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if fleet is not None:
+            fleet.stop()
+        work_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
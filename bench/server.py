@@ -0,0 +1,59 @@
+import argparse
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+class BenchServer(BaseApplication):
+    """Run backend.app under gunicorn with the Firebase fakes installed
+
+    The app is loaded in each worker after the fork, as in production, so
+    every worker gets its own fake Firestore and FCM.
+    """
+
+    def __init__(self, options, fake_options):
+        self.options = options
+        self.fake_options = fake_options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from . import fake_firebase
+        fake_firebase.install(**self.fake_options)
+        from backend.app import app
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the backend offline with fake Firestore and FCM')
+    parser.add_argument('--bind', default='127.0.0.1:8090')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--firestore-commit-ms', type=float, default=30)
+    parser.add_argument('--firestore-query-ms', type=float, default=50)
+    parser.add_argument('--fcm-ms', type=float, default=50)
+    parser.add_argument('--firestore-failure-rate', type=float, default=0.0,
+                        help='Fraction of Firestore batch commits that fail')
+    args = parser.parse_args(argv)
+
+    # backend.app reads the service account from the environment
+    os.environ.setdefault('FIREBASE_PRIVATE_KEY', 'bench')
+    BenchServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'loglevel': 'warning'
+    }, {
+        'commit_latency': args.firestore_commit_ms / 1000,
+        'query_latency': args.firestore_query_ms / 1000,
+        'send_latency': args.fcm_ms / 1000,
+        'failure_rate': args.firestore_failure_rate
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,9 @@ class WellTankMonitor {
         this.apiBase = '/api';
         this.currentData = null;
         this.historyChart = null;
+        this.historyPoints = 200;
         this.updateInterval = null;
+        this.eventSource = null;
         this.isOnline = navigator.onLine;
         
         this.init();
@@ -15,7 +17,7 @@ class WellTankMonitor {
         this.setupServiceWorker();
         this.setupOnlineStatus();
         await this.loadInitialData();
-        this.startAutoRefresh();
+        this.startLiveUpdates();
     }
 
     setupEventListeners() {
@@ -26,6 +28,7 @@ class WellTankMonitor {
         // Action buttons
         document.getElementById('forceReadingBtn').addEventListener('click', () => this.forceReading());
         document.getElementById('historyBtn').addEventListener('click', () => this.showHistory());
+        document.getElementById('historyRange').addEventListener('change', () => this.showHistory());
         document.getElementById('alertsBtn').addEventListener('click', () => this.showAlerts());
         document.getElementById('configBtn').addEventListener('click', () => this.showSettings());
         document.getElementById('viewAllAlertsBtn').addEventListener('click', () => this.showAlerts());
@@ -187,7 +190,8 @@ class WellTankMonitor {
             const response = await fetch(`${this.apiBase}/force-reading`);
             if (!response.ok) throw new Error('Failed to force reading');
             
-            const result = await response.json();
+            const job = await response.json();
+            const result = await this.waitForJob(`${this.apiBase}/force-reading/${job.job_id}`);
             if (result.success) {
                 this.updateUI(result.data);
                 this.showToast('New reading taken successfully', 'success');
@@ -202,14 +206,37 @@ class WellTankMonitor {
         }
     }
 
+    async waitForJob(url, timeoutMs = 30000) {
+        const deadline = Date.now() + timeoutMs;
+        while (Date.now() < deadline) {
+            const response = await fetch(url);
+            if (!response.ok) throw new Error('Failed to fetch job status');
+            
+            const job = await response.json();
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+        throw new Error('Timed out waiting for reading');
+    }
+
     async showHistory() {
         try {
             this.showLoading(true);
-            const response = await fetch(`${this.apiBase}/history`);
+            const days = parseInt(document.getElementById('historyRange').value, 10);
+            const to = new Date();
+            const from = new Date(to.getTime() - days * 24 * 60 * 60 * 1000);
+            const params = new URLSearchParams({
+                from: from.toISOString(),
+                to: to.toISOString(),
+                points: this.historyPoints
+            });
+            const response = await fetch(`${this.apiBase}/history?${params}`);
             if (!response.ok) throw new Error('Failed to fetch history');
             
             const history = await response.json();
-            this.displayHistory(history);
+            this.displayHistory(history, days);
             document.getElementById('historyModal').classList.add('show');
         } catch (error) {
             console.error('Error loading history:', error);
@@ -219,43 +246,35 @@ class WellTankMonitor {
         }
     }
 
-    displayHistory(history) {
+    displayHistory(history, days) {
         const historyList = document.getElementById('historyList');
         const chartContainer = document.getElementById('historyChart');
         
         // Clear previous content
         historyList.innerHTML = '';
         
-        if (history.length === 0) {
+        const buckets = history.buckets || [];
+        const filled = buckets.filter(bucket => bucket.count > 0);
+        if (filled.length === 0) {
             historyList.innerHTML = '<div class="loading">No history data available</div>';
             return;
         }
 
         // Create chart
-        this.createHistoryChart(history, chartContainer);
+        this.createHistoryChart(buckets, chartContainer, days);
 
-        // Create history list
-        history.forEach(reading => {
+        // Create history list, newest first
+        filled.slice().reverse().forEach(bucket => {
             const item = document.createElement('div');
             item.className = 'history-item';
             
-            let timestamp = 'Unknown';
-            if (reading.timestamp) {
-                if (reading.timestamp.toDate) {
-                    timestamp = new Date(reading.timestamp.toDate()).toLocaleString();
-                } else if (reading.timestamp.seconds) {
-                    timestamp = new Date(reading.timestamp.seconds * 1000).toLocaleString();
-                } else {
-                    timestamp = new Date(reading.timestamp).toLocaleString();
-                }
-            }
-            
-            const percentage = reading.fill_percentage ? reading.fill_percentage.toFixed(1) : '0';
+            const timestamp = new Date(bucket.timestamp).toLocaleString();
+            const percentage = bucket.fill_last !== null ? bucket.fill_last.toFixed(1) : '0';
             
             item.innerHTML = `
                 <div class="history-info">
                     <div class="history-time">${timestamp}</div>
-                    <div class="history-value">${reading.gallons ? reading.gallons.toFixed(0) : '0'} gallons</div>
+                    <div class="history-value">${bucket.gallons_last !== null ? bucket.gallons_last.toFixed(0) : '0'} gallons</div>
                 </div>
                 <div class="history-value">${percentage}%</div>
             `;
@@ -264,7 +283,7 @@ class WellTankMonitor {
         });
     }
 
-    createHistoryChart(history, container) {
+    createHistoryChart(buckets, container, days) {
         const ctx = document.getElementById('historyCanvas');
         
         // Check if Chart.js is available
@@ -279,22 +298,13 @@ class WellTankMonitor {
             this.historyChart.destroy();
         }
 
-        // Prepare data
-        const labels = history.map(reading => {
-            let date = new Date();
-            if (reading.timestamp) {
-                if (reading.timestamp.toDate) {
-                    date = new Date(reading.timestamp.toDate());
-                } else if (reading.timestamp.seconds) {
-                    date = new Date(reading.timestamp.seconds * 1000);
-                } else {
-                    date = new Date(reading.timestamp);
-                }
-            }
-            return date.toLocaleTimeString();
-        }).reverse();
+        // Prepare data; buckets arrive oldest first and empty ones are null gaps
+        const labels = buckets.map(bucket => {
+            const date = new Date(bucket.timestamp);
+            return days > 1 ? date.toLocaleDateString() : date.toLocaleTimeString();
+        });
 
-        const data = history.map(reading => reading.fill_percentage || 0).reverse();
+        const data = buckets.map(bucket => bucket.fill_mean);
 
         try {
             // Create new chart
@@ -309,7 +319,9 @@ class WellTankMonitor {
                         backgroundColor: 'rgba(37, 99, 235, 0.1)',
                         borderWidth: 2,
                         fill: true,
-                        tension: 0.4
+                        tension: 0.4,
+                        spanGaps: true,
+                        pointRadius: 0
                     }]
                 },
                 options: {
@@ -346,7 +358,7 @@ class WellTankMonitor {
 
     async loadRecentAlerts() {
         try {
-            const response = await fetch(`${this.apiBase}/alerts?t=${Date.now()}`);
+            const response = await fetch(`${this.apiBase}/alerts`);
             if (!response.ok) {
                 const errorText = await response.text();
                 throw new Error(`HTTP ${response.status}: ${errorText}`);
@@ -403,7 +415,7 @@ class WellTankMonitor {
     async showAlerts() {
         try {
             this.showLoading(true);
-            const response = await fetch(`${this.apiBase}/alerts?t=${Date.now()}`);
+            const response = await fetch(`${this.apiBase}/alerts`);
             if (!response.ok) {
                 const errorText = await response.text();
                 throw new Error(`HTTP ${response.status}: ${errorText}`);
@@ -619,7 +631,38 @@ class WellTankMonitor {
         }
     }
 
+    startLiveUpdates() {
+        // Prefer server-pushed updates; fall back to polling without EventSource
+        if (!('EventSource' in window)) {
+            this.startAutoRefresh();
+            return;
+        }
+
+        this.eventSource = new EventSource(`${this.apiBase}/stream`);
+
+        this.eventSource.addEventListener('open', () => {
+            this.stopAutoRefresh();
+        });
+
+        this.eventSource.addEventListener('reading', (event) => {
+            const data = JSON.parse(event.data);
+            this.updateUI(data);
+            this.currentData = data;
+        });
+
+        this.eventSource.addEventListener('alert', () => {
+            this.loadRecentAlerts();
+        });
+
+        this.eventSource.addEventListener('error', () => {
+            // EventSource reconnects on its own; poll until it does
+            this.startAutoRefresh();
+        });
+    }
+
     startAutoRefresh() {
+        if (this.updateInterval) return;
+
         // Refresh data every 30 seconds
         this.updateInterval = setInterval(() => {
             if (this.isOnline) {
@@ -628,6 +671,13 @@ class WellTankMonitor {
         }, 30000);
     }
 
+    stopAutoRefresh() {
+        if (this.updateInterval) {
+            clearInterval(this.updateInterval);
+            this.updateInterval = null;
+        }
+    }
+
     showLoading(show) {
         const overlay = document.getElementById('loadingOverlay');
         if (show) {
@@ -1,4 +1,4 @@
-const CACHE_NAME = 'well-tank-monitor-v1';
+const CACHE_NAME = 'well-tank-monitor-v2';
 const urlsToCache = [
     '/',
     '/index.html',
@@ -20,9 +20,54 @@ self.addEventListener('install', (event) => {
     );
 });
 
+const API_CACHE_NAME = 'well-tank-monitor-api-v1';
+
+// API responses that carry an ETag and can be revalidated with If-None-Match
+function isRevalidatableApiRequest(request) {
+    return request.method === 'GET' &&
+        !request.url.includes('/api/stream') &&
+        !request.url.includes('/api/force-reading');
+}
+
+// Revalidate a cached API response; a 304 reuses the cached body without the
+// backend rebuilding it, and the cached copy is served when offline
+async function revalidateApiRequest(request) {
+    const cache = await caches.open(API_CACHE_NAME);
+    const cached = await cache.match(request);
+    const etag = cached && cached.headers.get('ETag');
+    const headers = new Headers(request.headers);
+    if (etag) {
+        headers.set('If-None-Match', etag);
+    }
+
+    try {
+        const response = await fetch(request.url, { headers, cache: 'no-store' });
+        if (response.status === 304 && cached) {
+            return cached;
+        }
+        if (response.ok && response.headers.get('ETag')) {
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        if (cached) {
+            return cached;
+        }
+        return new Response(JSON.stringify({ error: 'Network error' }), {
+            status: 503,
+            headers: { 'Content-Type': 'application/json' }
+        });
+    }
+}
+
 // Fetch event - serve from cache when offline
 self.addEventListener('fetch', (event) => {
-    // Don't cache API requests - let them go directly to the network
+    if (event.request.url.includes('/api/') && isRevalidatableApiRequest(event.request)) {
+        event.respondWith(revalidateApiRequest(event.request));
+        return;
+    }
+
+    // Other API requests go directly to the network
     if (event.request.url.includes('/api/')) {
         event.respondWith(
             fetch(event.request).catch(() => {
@@ -70,7 +115,7 @@ self.addEventListener('activate', (event) => {
         caches.keys().then((cacheNames) => {
             return Promise.all(
                 cacheNames.map((cacheName) => {
-                    if (cacheName !== CACHE_NAME) {
+                    if (cacheName !== CACHE_NAME && cacheName !== API_CACHE_NAME) {
                         console.log('Deleting old cache:', cacheName);
                         return caches.delete(cacheName);
                     }
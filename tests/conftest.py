@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# backend.app reads its configuration at import time
+_work_dir = tempfile.mkdtemp(prefix='wellsensor-tests-')
+os.environ.update(
+    RUN_DIR=os.path.join(_work_dir, 'run'),
+    DATA_DIR=os.path.join(_work_dir, 'data'),
+    LOG_LEVEL='WARNING',
+    ENABLE_EMAIL_ALERTS='false',
+    FIRESTORE_MIRROR='false'
+)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    from backend import app
+    return app
+
+
+def sensor_reading(device_id, fill, **extra):
+    """A reading as the firmware sends it, for a 1550 gallon, 183 cm tank"""
+    water_level = round(183 * fill / 100, 1)
+    reading = {'device_id': device_id, 'fill_percentage': fill, 'gallons': round(1550 * fill / 100, 1),
+               'water_level_cm': water_level, 'distance_cm': round(200 - water_level, 1)}
+    reading.update(extra)
+    return reading
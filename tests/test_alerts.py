@@ -0,0 +1,50 @@
+from .conftest import sensor_reading
+
+
+def test_enhanced_alert_accepts_any_rule_severity(app_module, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_module, 'send_push', sent.append)
+    app_module.send_enhanced_alert(sensor_reading('t', 40.0), sensor_reading('t', 60.0), 20.0,
+                                   'warning', 'rapid_drop')
+    assert len(sent) == 1
+    assert sent[0].notification.title == '📊 Rapid Water Level Drop'
+    assert sent[0].data['severity'] == 'warning'
+
+
+def test_rules_pick_first_rule_in_group_and_respect_cooldown():
+    from backend.rules import RuleEngine, features_from_readings
+
+    rule_set = {
+        'severity_levels': [{'severity': 'critical', 'when': [['fill_percentage', '<=', 10]]}],
+        'rules': [
+            {'name': 'rapid_drop', 'group': 'level', 'cooldown_minutes': 15, 'when': [['drop', '>=', 15]]},
+            {'name': 'critical_level', 'group': 'level', 'when': [['fill_percentage', '<=', 10]]}
+        ]
+    }
+    engine = RuleEngine(rule_set)
+    features = features_from_readings(
+        [{'fill_percentage': 8.0}, {'fill_percentage': 5.0}],
+        [{'fill_percentage': 30.0}, {'fill_percentage': 8.0}]
+    )
+    firings = engine.evaluate(['tank', 'tank'], [0, 60], features)
+    assert [(f.rule.name, f.severity) for f in firings] == [('rapid_drop', 'critical'), ('critical_level', 'critical')]
+
+    # A second drop inside the cooldown is held back
+    again = features_from_readings([{'fill_percentage': 40.0}], [{'fill_percentage': 60.0}])
+    assert engine.evaluate(['tank'], [600], again) == []
+    assert [f.rule.name for f in engine.evaluate(['tank'], [1000], again)] == ['rapid_drop']
+
+
+def test_repeated_leak_alerts_are_held_back(app_module, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_module, 'alerts_enabled', True)
+    monkeypatch.setattr(app_module, 'send_leak_alert', lambda device_id, leak: sent.append(device_id))
+    monkeypatch.setattr(app_module, 'store_leak_alert', lambda device_id, leak: None)
+    device = app_module.devices.get('test_leak_cooldown')
+    leak = {'night': '2024-03-04', 'night_flow_gph': 6.0, 'baseline_gph': 1.0}
+
+    suppressed = app_module.alerts_suppressed._values.get(('leak',), 0)
+    app_module.raise_leak_alert(device, leak)
+    app_module.raise_leak_alert(device, leak)
+    assert sent == ['test_leak_cooldown']
+    assert app_module.alerts_suppressed._values[('leak',)] == suppressed + 1
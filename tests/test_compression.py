@@ -0,0 +1,64 @@
+from backend.compression import ReadingCompressor, interpolate_buckets
+from backend.storage import CompressedStorage, MemoryStorage, MirroredStorage
+
+from .conftest import sensor_reading
+
+
+def draw_down(count, start_fill=80.0, step=0.1):
+    """One reading a minute on a straight line"""
+    return [(i * 60.0, sensor_reading('tank', start_fill - step * i)) for i in range(count)]
+
+
+def test_swinging_door_keeps_only_the_ends_of_a_straight_line():
+    compressor = ReadingCompressor('swinging_door', max_gap_seconds=86400)
+    readings = draw_down(30)
+    kept = compressor.compress(readings) + compressor.flush()
+    assert [ts for ts, _ in kept] == [0.0, 29 * 60.0]
+
+
+def test_swinging_door_keeps_the_corner_of_a_step():
+    compressor = ReadingCompressor('swinging_door', max_gap_seconds=86400)
+    readings = [(i * 60.0, sensor_reading('tank', 80.0 if i < 10 else 60.0)) for i in range(20)]
+    kept = [ts for ts, _ in compressor.compress(readings) + compressor.flush()]
+    assert kept == [0.0, 9 * 60.0, 10 * 60.0, 19 * 60.0]
+
+
+def test_mirror_is_compressed_but_primary_keeps_every_reading():
+    class Mirror:
+        def __init__(self):
+            self.readings = []
+
+        def append_many(self, timestamped_readings):
+            self.readings.extend(timestamped_readings)
+
+    primary, mirror = MemoryStorage(), Mirror()
+    storage = MirroredStorage(primary, mirror, ReadingCompressor('swinging_door', max_gap_seconds=86400))
+    storage.append_many(draw_down(30))
+    assert len(primary.query_raw('tank')) == 30
+    assert len(mirror.readings) == 1
+
+    storage.flush_held()
+    assert [ts for ts, _ in mirror.readings] == [0.0, 29 * 60.0]
+
+
+def test_a_compressed_store_only_writes_the_kept_points():
+    store = MemoryStorage()
+    storage = CompressedStorage(store, ReadingCompressor('swinging_door', max_gap_seconds=86400))
+    storage.append_many(draw_down(30))
+    assert len(storage.query_raw('tank')) == 1
+
+    storage.flush_held()
+    assert [row['ts'] for row in store.query_raw('tank')] == [0.0, 29 * 60.0]
+
+
+def test_history_buckets_between_kept_points_are_interpolated():
+    store = MemoryStorage()
+    storage = CompressedStorage(store, ReadingCompressor('swinging_door', max_gap_seconds=86400))
+    storage.append_many(draw_down(30))
+    storage.flush_held()
+
+    _, buckets = storage.query_buckets(0, 30 * 60.0, 10, 'tank')
+    interpolate_buckets(buckets, 3 * 60.0)
+    middle = buckets[5]
+    assert middle['count'] == 0 and middle['interpolated']
+    assert abs(middle['fill_mean'] - (80.0 - 0.1 * 16.5)) < 0.1
@@ -0,0 +1,46 @@
+import time
+
+from backend.filters import ReadingFilter
+
+from .conftest import sensor_reading
+
+
+def test_rejects_missing_echo_and_single_glitch():
+    reading_filter = ReadingFilter()
+    for k in range(5):
+        assert reading_filter.update(sensor_reading('t', 60.0), k * 30) is not None
+    assert reading_filter.update(sensor_reading('t', 60.0, distance_cm=0), 150) is None
+    assert reading_filter.update(sensor_reading('t', 20.0), 180) is None
+    assert reading_filter.update(sensor_reading('t', 60.1), 210) is not None
+    assert reading_filter.rejected == 2
+
+
+def test_accepts_a_real_step_once_it_fills_half_the_window():
+    reading_filter = ReadingFilter()
+    for k in range(5):
+        reading_filter.update(sensor_reading('t', 60.0), k * 30)
+    results = [reading_filter.update(sensor_reading('t', 44.0), 150 + k * 30) for k in range(4)]
+    assert results[:3] == [None, None, None]
+    assert results[3] is not None
+
+
+def test_smoothing_rescales_gallons_to_the_smoothed_fill():
+    reading_filter = ReadingFilter()
+    reading_filter.update(sensor_reading('t', 60.0), 0)
+    smoothed = reading_filter.update(sensor_reading('t', 61.0), 30)
+    assert 60.0 < smoothed['fill_percentage'] < 61.0
+    assert abs(smoothed['gallons'] - 1550 * smoothed['fill_percentage'] / 100) < 0.2
+
+
+def test_smoothing_does_not_hide_a_rapid_drop(app_module):
+    device_id = 'test_rapid_drop'
+    start = time.time() - 600
+    readings = [(start + k * 30, sensor_reading(device_id, 60.0)) for k in range(6)]
+    readings += [(start + (6 + k) * 30, sensor_reading(device_id, 44.0)) for k in range(4)]
+    app_module.process_batch(readings)
+
+    alerts = app_module.storage.query_alerts(device_id)
+    assert 'rapid_drop' in {alert.get('type') for alert in alerts}
+    # Raw readings are stored, not the smoothed ones
+    app_module.flush_held_readings()
+    assert app_module.storage.latest(device_id)['fill_percentage'] == 44.0
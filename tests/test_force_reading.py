@@ -0,0 +1,13 @@
+def test_force_reading_rejects_unconfigured_hosts(app_module):
+    client = app_module.app.test_client()
+    response = client.get('/force-reading?endpoint=169.254.169.254:80')
+    assert response.status_code == 400
+    assert '169.254.169.254:80' not in app_module.poller.status()
+
+
+def test_force_reading_accepts_a_configured_endpoint(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'ESP32_ENDPOINTS', ['tank.local:80'])
+    monkeypatch.setattr(app_module, 'run_force_reading', lambda endpoint: {'endpoint': endpoint})
+    client = app_module.app.test_client()
+    response = client.get('/force-reading?endpoint=tank.local')
+    assert response.status_code == 202
@@ -0,0 +1,35 @@
+from backend.forecast import ConsumptionForecaster
+
+START = 1700000000 // 3600 * 3600
+
+
+def steady_use(forecaster, hours, gallons_per_hour=10.0, start_gallons=1500.0):
+    """A reading every five minutes while the tank drains at a constant rate"""
+    for i in range(hours * 12 + 1):
+        forecaster.add('tank', START + i * 300, start_gallons - gallons_per_hour * i / 12)
+
+
+def test_no_forecast_until_the_profile_has_enough_hours():
+    forecaster = ConsumptionForecaster(min_hours=24)
+    steady_use(forecaster, 12)
+    assert forecaster.forecast('tank', 500.0, now=START + 12 * 3600) is None
+
+
+def test_steady_use_forecasts_hours_to_empty():
+    forecaster = ConsumptionForecaster(min_hours=24)
+    steady_use(forecaster, 48)
+    forecast = forecaster.forecast('tank', 500.0, now=START + 48 * 3600)
+    assert abs(forecast['hours_to_empty'] - 50) <= 1
+    assert forecast['earliest_hours'] <= forecast['hours_to_empty'] <= forecast['latest_hours']
+
+
+def test_refills_are_not_counted_as_use():
+    forecaster = ConsumptionForecaster(min_hours=24)
+    steady_use(forecaster, 24)
+    # The pump runs, then use carries on as before
+    forecaster.add('tank', START + 24 * 3600 + 300, 1500.0)
+    steady_use_after = [(START + 24 * 3600 + 300 + i * 300, 1500.0 - 10.0 * i / 12) for i in range(1, 24 * 12)]
+    for ts, gallons in steady_use_after:
+        forecaster.add('tank', ts, gallons)
+    forecast = forecaster.forecast('tank', 500.0, now=steady_use_after[-1][0])
+    assert abs(forecast['hours_to_empty'] - 50) <= 1
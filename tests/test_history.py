@@ -0,0 +1,18 @@
+import time
+
+from .conftest import sensor_reading
+
+
+def test_history_defaults_to_the_latest_device(app_module):
+    now = time.time()
+    app_module.process_batch([(now - 60 + k * 10, sensor_reading('test_history_a', 30.0)) for k in range(3)])
+    app_module.process_batch([(now - 30 + k * 10, sensor_reading('test_history_b', 80.0)) for k in range(2)])
+    client = app_module.app.test_client()
+
+    readings = client.get('/history').get_json()
+    assert {reading['device_id'] for reading in readings} == {'test_history_b'}
+
+    history = client.get(f'/history?from={now - 120}&to={now + 1}&points=1').get_json()
+    assert history['device_id'] == 'test_history_b'
+    assert history['buckets'][0]['count'] == 2
+    assert history['buckets'][0]['fill_max'] == 80.0
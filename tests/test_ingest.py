@@ -0,0 +1,120 @@
+import time
+
+from .conftest import sensor_reading
+
+
+def test_pushed_batch_older_than_a_poll_is_ingested(app_module):
+    device_id = 'test_poll_then_push'
+    app_module.process_reading(sensor_reading(device_id, 60.0))
+    polled_at = app_module.devices.get(device_id).last_reading_time
+
+    # The device's 30 s readings from before the poll arrive afterwards
+    readings = [(polled_at - 120 + k * 30, sensor_reading(device_id, 60.0 - k)) for k in range(4)]
+    result = app_module.process_batch(readings)
+    assert result['stored'] == 4
+    assert len(app_module.storage.query_raw(device_id)) == 5
+    # They are filtered and alert-checked, not skipped as stale
+    device = app_module.devices.get(device_id)
+    assert device.last_raw_reading['fill_percentage'] == 57.0
+    assert device.last_pushed_time == readings[-1][0]
+
+
+def test_polled_reading_of_a_pushing_device_is_only_shown(app_module):
+    device_id = 'test_forced_duplicate'
+    now = time.time()
+    app_module.process_batch([(now - 30, sensor_reading(device_id, 50.0))])
+    app_module.process_reading(sensor_reading(device_id, 49.0))
+
+    assert len(app_module.storage.query_raw(device_id)) == 1
+    device = app_module.devices.get(device_id)
+    assert device.last_reading['fill_percentage'] == 49.0
+    assert device.last_raw_reading['fill_percentage'] == 50.0
+
+
+def test_pushed_reading_older_than_the_newest_pushed_is_stale(app_module):
+    device_id = 'test_stale_push'
+    now = time.time()
+    app_module.process_batch([(now - 30, sensor_reading(device_id, 50.0))])
+    app_module.process_batch([(now - 60, sensor_reading(device_id, 51.0))])
+    assert app_module.devices.get(device_id).last_raw_reading['fill_percentage'] == 50.0
+
+
+def test_reading_age_survives_a_millis_wrap():
+    from backend.ingest import normalize_batch
+
+    # Buffered 2 s before millis() wrapped, sent 1 s after
+    payload = {'device_id': 't', 'sent_at': 1000,
+               'readings': [dict(sensor_reading('t', 50.0), timestamp=2 ** 32 - 2000)]}
+    accepted, rejected = normalize_batch(payload, now=10000.0)
+    assert rejected == []
+    assert accepted[0][0] == 9997.0
+
+
+def test_only_accepted_readings_are_counted(app_module):
+    device_id = 'test_ingested_count'
+    now = time.time()
+    readings = [(now - 90 + k * 30, sensor_reading(device_id, 60.0)) for k in range(3)]
+    # A missing echo, and one older than the newest pushed reading
+    readings.append((now, sensor_reading(device_id, 60.0, distance_cm=0)))
+    app_module.process_batch(readings)
+    app_module.process_batch([(now - 120, sensor_reading(device_id, 60.0))])
+    assert app_module.readings_ingested._values[(device_id,)] == 3
+
+
+def test_non_numeric_measurement_is_rejected_and_the_rest_of_the_batch_ingested(app_module):
+    device_id = 'test_bad_gallons'
+    now = time.time()
+    client = app_module.app.test_client()
+    batch = {'device_id': device_id, 'readings': [
+        dict(sensor_reading(device_id, 60.0), ts=now - 60),
+        dict(sensor_reading(device_id, 60.0), ts=now - 30, gallons='abc'),
+        dict(sensor_reading(device_id, 60.0), ts=now)
+    ]}
+    response = client.post('/tank-data', json=batch)
+    assert response.status_code == 200
+    assert [item['index'] for item in response.get_json()['rejected']] == [1]
+    assert len(app_module.storage.query_raw(device_id)) == 2
+
+
+def test_nan_and_infinite_values_are_rejected():
+    from backend.ingest import normalize_batch
+
+    accepted, rejected = normalize_batch([dict(sensor_reading('t', 50.0), ts='nan'),
+                                          dict(sensor_reading('t', 50.0), ts=float('nan')),
+                                          dict(sensor_reading('t', 50.0), fill_percentage=float('inf'))],
+                                         now=1000.0)
+    assert accepted == []
+    assert len(rejected) == 3
+
+
+def test_fractional_millis_are_rejected():
+    from backend.ingest import normalize_batch
+
+    payload = {'device_id': 't', 'sent_at': 1000.5,
+               'readings': [dict(sensor_reading('t', 50.0), timestamp=500)]}
+    accepted, rejected = normalize_batch(payload, now=1000.0)
+    assert accepted == [] and rejected[0]['error'].startswith('Invalid timestamp')
+
+
+def test_rejected_reading_does_not_move_the_stale_mark(app_module):
+    device_id = 'test_outlier_mark'
+    now = time.time()
+    app_module.process_batch([(now - 60, sensor_reading(device_id, 50.0))])
+    app_module.process_batch([(now - 30, sensor_reading(device_id, 50.0, distance_cm=0))])
+    assert app_module.devices.get(device_id).last_pushed_time == now - 60
+
+
+def test_single_pushed_reading_is_stored_after_a_batch(app_module):
+    device_id = 'test_single_push'
+    client = app_module.app.test_client()
+    client.post('/tank-data', json={'device_id': device_id,
+                                    'readings': [dict(sensor_reading(device_id, 60.0), ts=time.time() - 30)]})
+    response = client.post('/tank-data', json=sensor_reading(device_id, 59.0))
+    assert response.get_json()['success'] is True
+    stored = app_module.storage.query_raw(device_id)
+    assert [row['fill_percentage'] for row in stored] == [60.0, 59.0]
+
+
+def test_invalid_single_reading_is_refused(app_module):
+    response = app_module.app.test_client().post('/tank-data', json=sensor_reading('t', 50.0, gallons=None))
+    assert response.status_code == 400
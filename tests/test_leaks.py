@@ -0,0 +1,51 @@
+import time
+
+from backend.leaks import LeakDetector
+
+# Local midnight, so night hours fall where the detector looks for them
+MIDNIGHT = time.mktime((2024, 3, 4, 0, 0, 0, 0, 0, -1))
+
+
+def hourly_buckets(night_flows, day_use=20.0):
+    """One-hour buckets over len(night_flows) days, draining night_flows[d] gal/h from 01:00 to 05:00"""
+    buckets = []
+    gallons = 1500.0
+    for day, night_flow in enumerate(night_flows):
+        for hour in range(24):
+            ts = MIDNIGHT + day * 86400 + hour * 3600
+            gallons -= night_flow if 1 <= hour < 5 else day_use
+            if hour == 12:
+                gallons += 24 * day_use + 4 * night_flow
+            buckets.append({'ts': ts, 'gallons_last': gallons, 'gallons_max': gallons})
+    return buckets
+
+
+def test_steady_nights_are_not_a_leak():
+    detector = LeakDetector()
+    result = detector.check(hourly_buckets([1.0, 1.2, 0.8, 1.1, 0.9, 1.0, 1.0, 1.1]))
+    assert result['leak'] is False
+    assert result['baseline_gph'] == 1.0
+
+
+def test_nights_above_baseline_are_a_leak():
+    detector = LeakDetector()
+    result = detector.check(hourly_buckets([1.0, 1.2, 0.8, 1.1, 0.9, 1.0, 6.0, 6.0]))
+    assert result['leak'] is True
+    assert result['night_flow_gph'] == 6.0
+
+
+def test_one_bad_night_is_not_enough():
+    detector = LeakDetector(confirm_nights=2)
+    result = detector.check(hourly_buckets([1.0, 1.2, 0.8, 1.1, 0.9, 1.0, 1.0, 6.0]))
+    assert result['leak'] is False
+
+
+def test_too_few_nights_give_no_result():
+    assert LeakDetector().check(hourly_buckets([1.0, 1.0, 1.0])) is None
+
+
+def test_leak_checks_need_a_store_with_rollups(app_module):
+    from backend.storage import MemoryStorage, MirroredStorage
+
+    assert app_module.STORAGE_BACKEND == 'sqlite' and app_module.leak_detection
+    assert MirroredStorage(MemoryStorage(), None).rollups is False
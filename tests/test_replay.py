@@ -0,0 +1,40 @@
+from backend.filters import ReadingFilter
+from backend.replay import Replay
+
+from .conftest import sensor_reading
+
+RULES = {'rules': [{'name': 'rapid_drop', 'cooldown_minutes': 0, 'when': [['drop', '>=', 15]]}]}
+
+
+def glitchy_readings():
+    """Five minutes apart at 60%, with one bad echo reading 20% in the middle"""
+    return [(i * 300.0, sensor_reading('tank', 20.0 if i == 5 else 60.0)) for i in range(10)]
+
+
+def test_replay_filters_glitches_like_the_live_path():
+    report = Replay(RULES, new_filter=ReadingFilter).run(glitchy_readings())
+    assert 'rapid_drop' not in report['by_rule']
+    assert report['rejected_outliers'] == 1
+
+
+def test_unfiltered_replay_sees_the_glitch():
+    report = Replay(RULES).run(glitchy_readings())
+    assert report['by_rule']['rapid_drop'] == 1
+
+
+def test_replay_measures_no_change_across_a_wide_gap():
+    readings = [(0.0, sensor_reading('tank', 60.0)), (3600.0, sensor_reading('tank', 40.0))]
+    assert Replay(RULES).run(readings)['by_rule']['rapid_drop'] == 1
+    assert 'rapid_drop' not in Replay(RULES, max_gap_seconds=600).run(readings)['by_rule']
+
+
+def test_limit_lists_the_earliest_alerts_of_every_kind():
+    # A drop at the second reading, then a fast draw that raises predictive alerts
+    readings = [(0.0, sensor_reading('tank', 60.0)), (300.0, sensor_reading('tank', 40.0))]
+    readings += [(300.0 * i, dict(sensor_reading('tank', 40.0), gallons=620.0 - 20 * i)) for i in range(2, 30)]
+    report = Replay(RULES, predictive_cooldown_seconds=0).run(readings, limit=2)
+
+    assert report['by_rule']['predictive'] > 2
+    assert report['truncated'] is True
+    assert [alert['rule'] for alert in report['alerts']] == ['rapid_drop', 'predictive']
+    assert report['alerts'][0]['ts'] == 300.0
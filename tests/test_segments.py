@@ -0,0 +1,54 @@
+from backend.segments import EventSegmenter, summarize_events
+
+
+def draw_then_refill():
+    """A reading a minute: 30 min idle, 60 min draw of 60 gal, 30 min refill of 90 gal, 60 min idle"""
+    gallons = [1000.0] * 30
+    gallons += [1000.0 - i for i in range(1, 61)]
+    gallons += [940.0 + 3 * i for i in range(1, 31)]
+    gallons += [1030.0] * 60
+    return [i * 60.0 for i in range(len(gallons))], gallons
+
+
+def test_add_finds_idle_draw_refill_and_idle():
+    segmenter = EventSegmenter(min_gallons=10, idle_seconds=1800)
+    events = []
+    for ts, gallons in zip(*draw_then_refill()):
+        events.extend(segmenter.add('tank', ts, gallons))
+
+    assert [event['kind'] for event in events] == ['idle', 'draw', 'refill']
+    draw, refill = events[1], events[2]
+    # Idle lasts until the last reading within min_gallons of its level
+    assert (draw['start_gallons'], draw['end_gallons']) == (990.0, 940.0)
+    assert draw['rate'] == 60.0
+    assert (refill['start_gallons'], refill['end_gallons']) == (940.0, 1030.0)
+    assert refill['rate'] == 180.0
+    assert segmenter.current('tank')['kind'] == 'idle'
+
+
+def test_backfill_gives_the_same_events_as_add():
+    timestamps, gallons = draw_then_refill()
+    one_at_a_time = EventSegmenter()
+    added = []
+    for ts, value in zip(timestamps, gallons):
+        added.extend(one_at_a_time.add('tank', ts, value))
+    assert EventSegmenter().backfill('tank', timestamps, gallons, chunk_size=16) == added
+
+
+def test_gap_closes_the_open_event():
+    segmenter = EventSegmenter(min_gallons=10, max_gap_seconds=7200)
+    for i in range(20):
+        segmenter.add('tank', i * 60.0, 1000.0 - 2 * i)
+    closed = segmenter.add('tank', 20 * 60.0 + 3 * 3600, 900.0)
+    assert [(event['kind'], event['end']) for event in closed] == [('draw', 19 * 60.0)]
+    assert segmenter.current('tank') is None
+
+
+def test_summary_counts_pump_duty():
+    timestamps, gallons = draw_then_refill()
+    summary = summarize_events(EventSegmenter().backfill('tank', timestamps, gallons))
+    assert summary['refill']['count'] == 1
+    assert summary['draw']['volume'] == 50.0
+    assert summary['refill']['hours'] == 0.5
+    # Idle 39 min, draw 50 min, refill 30 min
+    assert summary['pump_duty'] == round(30 / 119, 4)
@@ -0,0 +1,40 @@
+import time
+
+from backend.spool import Spool, SpoolReplayer
+
+
+class FakeWriteQueue:
+    def __init__(self):
+        self.documents = {}
+
+    def enqueue(self, collection, data, doc_id=None):
+        self.documents[(collection, doc_id)] = data
+        return doc_id
+
+    def flush(self, timeout=None):
+        return True
+
+    def stats(self):
+        return {'failed_batches': 0}
+
+
+def test_replayer_retries_until_firestore_connects(tmp_path):
+    spool = Spool(str(tmp_path), segment_max_age=0)
+    spool.append('readings', 'doc1', {'gallons': 100.0})
+    spool.close()
+
+    attempts = []
+    write_queue = FakeWriteQueue()
+
+    def connect():
+        attempts.append(1)
+        return write_queue if len(attempts) > 1 else None
+
+    replayer = SpoolReplayer(Spool(str(tmp_path)), connect, retry_interval=0.01)
+    replayer.start()
+    deadline = time.monotonic() + 5
+    while replayer.replayed < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert len(attempts) >= 2
+    assert write_queue.documents == {('readings', 'doc1'): {'gallons': 100.0}}
@@ -0,0 +1,49 @@
+import gzip
+
+import pytest
+
+from backend import wire
+from backend.ingest import PayloadError, decode_body, normalize_batch
+
+READINGS = [
+    {'timestamp': 1000, 'distance_cm': 40.25, 'water_level_cm': 142.75, 'gallons': 1209.5,
+     'fill_percentage': 78.0, 'battery_voltage': 12.5, 'wifi_rssi': -61},
+    {'timestamp': 31000, 'distance_cm': 40.5, 'water_level_cm': 142.5, 'gallons': 1207.0,
+     'fill_percentage': 77.875, 'battery_voltage': 12.5, 'wifi_rssi': -60}
+]
+
+
+def test_round_trip():
+    decoded = wire.decode(wire.encode('tank_01', 61000, READINGS))
+    assert decoded == {'device_id': 'tank_01', 'sent_at': 61000, 'readings': READINGS}
+
+
+def test_truncated_and_foreign_bodies_are_rejected():
+    body = wire.encode('tank_01', 61000, READINGS)
+    with pytest.raises(ValueError, match='Expected'):
+        wire.decode(body[:-1])
+    with pytest.raises(ValueError, match='magic'):
+        wire.decode(b'XX' + body[2:])
+
+
+def test_gzipped_binary_batch_is_dated_from_sent_at():
+    body = gzip.compress(wire.encode('tank_01', 61000, READINGS))
+    payload = decode_body(body, wire.CONTENT_TYPE, 'gzip')
+    accepted, rejected = normalize_batch(payload, now=5000.0)
+    assert rejected == []
+    assert [ts for ts, _ in accepted] == [4940.0, 4970.0]
+    assert accepted[0][1]['device_id'] == 'tank_01'
+
+
+def test_gzip_bomb_is_refused():
+    with pytest.raises(PayloadError) as error:
+        decode_body(gzip.compress(b'\0' * 4096), wire.CONTENT_TYPE, 'gzip', max_bytes=1024)
+    assert error.value.status == 413
+
+
+def test_tank_data_accepts_the_binary_format(app_module):
+    body = wire.encode('test_wire_device', 61000, READINGS)
+    response = app_module.app.test_client().post('/tank-data', data=body, content_type=wire.CONTENT_TYPE)
+    assert response.status_code == 200
+    stored = app_module.storage.query_raw('test_wire_device')
+    assert [row['gallons'] for row in stored] == [1209.5, 1207.0]